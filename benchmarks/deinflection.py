@@ -0,0 +1,66 @@
+import random
+import statistics
+import sys
+import time
+from dictionary.loader import db, Entry, get_headwords, result_cache, shard_rows
+from dictionary.deinflect import RULES, deinflect, deinflected_headwords, rule_mask
+from dictionary.instrument import percentile
+
+## Conjugates random verbs and adjectives of an existing database with the deinflection rules run backwards, then
+## compares looking up the conjugated forms against an exact lookup of their dictionary forms, and against looking
+## up every deinflection candidate on its own.
+## Usage: python -m benchmarks.deinflection [dictionary_fts.db] [number of words]
+
+def inflected_forms(n, seed=0):
+    # (dictionary form, conjugated form) pairs
+    rng = random.Random(seed)
+    rules = [rule for rules in RULES.values() for rule in rules if rule.kana_out]
+    query = Entry.select(Entry.expression, Entry.reading, Entry.rules).where(Entry.rules != '').tuples()
+    bases = shard_rows(query)
+    rng.shuffle(bases)
+    pairs = {}
+    for expression, reading, entry_rules in bases:
+        mask = rule_mask(entry_rules)
+        for base in (expression, reading):
+            applicable = [i for i in rules if i.rules_out & mask and base and base.endswith(i.kana_out) and len(base) > len(i.kana_out)]
+            if applicable:
+                rule = rng.choice(applicable)
+                pairs.setdefault(base[:-len(rule.kana_out)] + rule.kana_in, base)
+                break
+        if len(pairs) == n:
+            break
+    return [(base, inflected) for inflected, base in pairs.items()]
+
+def timed(lookup, terms):
+    timings = []
+    for term in terms:
+        start = time.perf_counter()
+        lookup(term)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def run(path='dictionary_fts.db', n=1000):
+    db.init(path)
+    result_cache.max_size = 0 # measure the lookups themselves, not the result cache
+    pairs = inflected_forms(n)
+    bases = [base for base, _ in pairs]
+    inflected = [i for _, i in pairs]
+
+    deinflect.cache_clear()
+    found = sum(any(base in (i.expression, i.reading) for i in deinflected_headwords(term)) for base, term in pairs)
+    candidates = statistics.mean(len(deinflect(term)) for term in inflected)
+    print(f"{len(pairs)} conjugated forms, {candidates:.1f} candidates each, dictionary form found for {found / len(pairs):.1%}\n")
+
+    modes = (
+        ('exact lookup of the dictionary form', get_headwords, bases),
+        ('deinflected, one query', deinflected_headwords, inflected),
+        ('deinflected, query per candidate', lambda term: [get_headwords(i.term) for i in deinflect(term)], inflected),
+    )
+    print(f"{'mode':<38}{'mean (ms)':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}")
+    for mode, lookup, terms in modes:
+        deinflect.cache_clear()
+        timings = timed(lookup, terms)
+        print(f"{mode:<38}{statistics.mean(timings):>10.2f}{statistics.median(timings):>10.2f}{percentile(timings, 0.95):>10.2f}")
+
+if __name__ == "__main__":
+    run(*sys.argv[1:2], *map(int, sys.argv[2:3]))
@@ -0,0 +1,58 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import dictionary.loader as loader
+from dictionary.loader import db, EntryFTS, FTS_TOKENIZERS, copy_database, database_size, each_shard, load_dictionary, migrate_fts_index, schema
+
+## Compares the EntryFTS index modes on a Yomichan dictionary zip
+## Usage: python -m benchmarks.fts_index dictionary_files/jmdict.zip
+
+def use_database(path):
+    db.close()
+    db.init(path)
+    db.connect()
+
+def file_size(path):
+    use_database(path)
+    return database_size() / 2**20
+
+def drop_fts_index(shard):
+    schema(EntryFTS, shard).drop_all()
+    shard.execute_sql('VACUUM')
+
+def run(zip_path):
+    workdir = tempfile.mkdtemp()
+    try:
+        ## Import once, then keep a copy of the database without any FTS index as the baseline
+        base = os.path.join(workdir, 'base.db')
+        use_database(base)
+        start = time.perf_counter()
+        load_dictionary(zip_path)
+        import_time = time.perf_counter() - start
+        use_database(base)
+        each_shard(drop_fts_index)
+        base_size = file_size(base)
+        db.close()
+
+        results = []
+        for index_mode in FTS_TOKENIZERS:
+            path = os.path.join(workdir, f'{index_mode}.db')
+            copy_database(base, path)
+            use_database(path)
+            build_time = migrate_fts_index(index_mode)
+            results.append((index_mode, build_time, file_size(path) - base_size))
+            db.close()
+    finally:
+        db.close()
+        shutil.rmtree(workdir)
+
+    print(f"\nImport (default index mode): {import_time:.1f}s, database without EntryFTS: {base_size:.1f} MiB\n")
+    print(f"{'index mode':<12}{'build time (s)':>16}{'index size (MiB)':>18}")
+    for index_mode, build_time, size in results:
+        print(f"{index_mode:<12}{build_time:>16.2f}{size:>18.1f}")
+    return results
+
+if __name__ == "__main__":
+    run(sys.argv[1] if len(sys.argv) > 1 else 'dictionary_files/jmdict.zip')
@@ -0,0 +1,61 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from dictionary.loader import (
+    db,
+    Entry,
+    compress_glossaries,
+    copy_database,
+    database_size,
+    each_shard,
+    get_definition,
+    glossary_of,
+    result_cache,
+    shard_rows,
+)
+
+## Compares database size and glossary decode time with JSON and compressed glossary storage,
+## on a copy of an existing database
+## Usage: python -m benchmarks.glossary_storage [dictionary_fts.db] [number of lookups]
+
+def vacuum():
+    each_shard(lambda shard: shard.execute_sql('VACUUM'))
+    return database_size() / 2**20
+
+def decode_time(terms):
+    # Time to fetch every definition of the terms, and then to decode all their glossaries
+    start = time.perf_counter()
+    definitions = [definition for term in terms for entry in get_definition(term) for definition in entry.definitions]
+    fetched = time.perf_counter()
+    for definition in definitions:
+        glossary_of(definition)
+    return (fetched - start) / len(terms), (time.perf_counter() - fetched) / max(len(definitions), 1)
+
+def run(path='dictionary_fts.db', n=2000):
+    workdir = tempfile.mkdtemp()
+    try:
+        copy = os.path.join(workdir, 'glossary.db')
+        copy_database(path, copy)
+        db.init(copy)
+        db.connect()
+        result_cache.max_size = 0 # measure the lookups themselves, not the result cache
+        terms = [i for i, in shard_rows(Entry.select(Entry.expression).tuples())]
+        terms = random.Random(0).sample(terms, min(n, len(terms)))
+
+        results = [('json', vacuum(), *decode_time(terms))]
+        compress_glossaries()
+        results.append(('compressed', vacuum(), *decode_time(terms)))
+    finally:
+        db.close()
+        shutil.rmtree(workdir)
+
+    print(f"\n{'storage':<12}{'database (MiB)':>16}{'lookup (us/term)':>18}{'decode (us/definition)':>24}")
+    for storage, size, lookup, decode in results:
+        print(f"{storage:<12}{size:>16.1f}{lookup * 1e6:>18.1f}{decode * 1e6:>24.1f}")
+    return results
+
+if __name__ == "__main__":
+    run(*sys.argv[1:2], *map(int, sys.argv[2:3]))
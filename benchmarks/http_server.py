@@ -0,0 +1,110 @@
+import http.client
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import ujson
+from urllib.parse import quote
+from dictionary.loader import db, Entry, shard_rows
+from dictionary.instrument import percentile
+
+## Load test for python -m dictionary.server: starts it on a free loopback port, then client threads that each keep
+## one connection alive send lookups for random headwords as fast as they can. Reports requests per second and
+## latency percentiles for single term lookups and for the batch endpoint.
+## The clients share one process with the GIL, so on a machine with few cores they compete with the server for CPU.
+## Usage: python -m benchmarks.http_server [dictionary_fts.db] [clients] [seconds] [connections]
+BATCH_TERMS = 50
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(path, port, connections):
+    server = subprocess.Popen([
+        sys.executable, '-m', 'dictionary.server',
+        '-d', path, '--port', str(port), '--connections', str(connections)
+    ])
+    deadline = time.perf_counter() + 30
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            if server.poll() is not None or time.perf_counter() > deadline:
+                server.kill()
+                raise RuntimeError("Lookup server didn't start")
+            time.sleep(0.05)
+
+def sample_terms(path, n=5000):
+    db.init(path)
+    terms = list(dict.fromkeys(i for i, in shard_rows(Entry.select(Entry.expression).distinct().tuples())))
+    db.close()
+    return random.Random(0).sample(terms, min(n, len(terms)))
+
+def client(port, request, terms, seed, stop, latencies):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    while not stop.is_set():
+        method, path, body = request(rng, terms)
+        start = time.perf_counter()
+        conn.request(method, path, body, {'Content-Type': 'application/json'} if body else {})
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            raise RuntimeError(f"{path} returned {response.status}")
+    conn.close()
+
+def lookup_request(rng, terms):
+    return 'GET', '/lookup?term=' + quote(rng.choice(terms)), None
+
+def batch_request(rng, terms):
+    return 'POST', '/batch', ujson.dumps({'terms': rng.sample(terms, BATCH_TERMS)}, ensure_ascii=False).encode('utf-8')
+
+def load(port, request, terms, clients, seconds):
+    stop = threading.Event()
+    latencies = [[] for _ in range(clients)]
+    threads = [
+        threading.Thread(target=client, args=(port, request, terms, seed, stop, latencies[seed]))
+        for seed in range(clients)
+    ]
+    start = time.perf_counter()
+    for i in threads:
+        i.start()
+    time.sleep(seconds)
+    stop.set()
+    for i in threads:
+        i.join()
+    elapsed = time.perf_counter() - start
+    latencies = sorted(i for l in latencies for i in l)
+    return (
+        len(latencies) / elapsed,
+        statistics.median(latencies) * 1000,
+        percentile(latencies, 0.99) * 1000,
+    )
+
+def run(path='dictionary_fts.db', clients=4, seconds=10, connections=4):
+    terms = sample_terms(path)
+    port = free_port()
+    server = start_server(path, port, connections)
+    try:
+        results = [
+            ('lookup', 1, *load(port, lookup_request, terms, clients, seconds)),
+            ('batch', BATCH_TERMS, *load(port, batch_request, terms, clients, seconds)),
+        ]
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"\n{clients} clients, {connections} connections, {seconds}s per endpoint")
+    print(f"{'endpoint':<10}{'req/s':>10}{'terms/s':>10}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for name, terms_per_request, rate, p50, p99 in results:
+        print(f"{name:<10}{rate:>10.0f}{rate * terms_per_request:>10.0f}{p50:>10.2f}{p99:>10.2f}")
+    return results
+
+if __name__ == "__main__":
+    run(*sys.argv[1:2], *map(int, sys.argv[2:]))
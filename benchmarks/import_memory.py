@@ -0,0 +1,45 @@
+import os
+import resource
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+## Imports each dictionary zip into an empty database in a fresh process and reports its peak RSS
+## (Unix only). With streaming ingestion the peak should not grow with the size of the dictionary.
+## Usage: python -m benchmarks.import_memory dictionary_files/jmdict.zip dictionary_files/daijirin.zip ...
+
+def term_bank_size(zip_path):
+    with zipfile.ZipFile(zip_path) as z:
+        return sum(i.file_size for i in z.infolist() if i.filename.startswith("term_bank_"))
+
+def max_rss():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+def import_dictionary(zip_path):
+    from dictionary.loader import db, load_dictionary
+    with tempfile.TemporaryDirectory() as workdir:
+        db.init(os.path.join(workdir, 'dictionary_fts.db'))
+        baseline = max_rss()
+        start = time.perf_counter()
+        load_dictionary(zip_path)
+        return time.perf_counter() - start, baseline, max_rss()
+
+def run(*zip_paths):
+    results = []
+    for zip_path in zip_paths:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            elapsed, baseline, peak = executor.submit(import_dictionary, zip_path).result()
+        results.append((os.path.basename(zip_path), term_bank_size(zip_path) / 2**20, elapsed, baseline, peak))
+
+    print(f"\n{'dictionary':<24}{'term banks (MiB)':>18}{'time (s)':>10}{'RSS before (MiB)':>18}{'peak RSS (MiB)':>16}")
+    for name, size, elapsed, baseline, peak in results:
+        print(f"{name:<24}{size:>18.1f}{elapsed:>10.1f}{baseline:>18.1f}{peak:>16.1f}")
+    return results
+
+if __name__ == "__main__":
+    run(*sys.argv[1:])
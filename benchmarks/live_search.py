@@ -0,0 +1,54 @@
+import random
+import statistics
+import sys
+import time
+from peewee import fn
+from dictionary.loader import db, Entry, IncrementalSearch, QueryPlan, definitions_select, fetch_rows, result_cache, each_shard, shard_rows
+from dictionary.instrument import percentile
+
+## Replays typed words one keystroke at a time against an existing database and reports the latency per keystroke
+## Usage: python -m benchmarks.live_search [dictionary_fts.db] [number of words]
+
+## Typing stays smooth as long as a keystroke is handled within a frame
+TARGET_MS = 16
+
+def sample_words(n, seed=0):
+    query = Entry.select(Entry.expression).where(fn.length(Entry.expression).between(2, 6))
+    words = [i for i, in shard_rows(query.tuples())]
+    random.Random(seed).shuffle(words)
+    return words[:n]
+
+def prefix_definitions(shard, term):
+    # What get_definition runs on a shard, without the result cache
+    plan = QueryPlan(term, database=shard).prefer_ordered_scan()
+    return fetch_rows('definitions', definitions_select(term, plan=plan), plan)
+
+def replay(words, incremental):
+    timings = []
+    reused = 0
+    for word in words:
+        search = IncrementalSearch()
+        for i in range(1, len(word)+1):
+            text = word[:i]
+            start = time.perf_counter()
+            if incremental:
+                search.lookup(text)
+            else:
+                each_shard(prefix_definitions, text + '%')
+            timings.append((time.perf_counter() - start) * 1000)
+        reused += search.reused
+    return timings, reused
+
+def run(path='dictionary_fts.db', n=200):
+    db.init(path)
+    result_cache.max_size = 0 # measure the lookups themselves, not the result cache
+    words = sample_words(n)
+    print(f"Replaying {len(words)} words, target {TARGET_MS} ms per keystroke\n")
+    print(f"{'mode':<14}{'p50 (ms)':>10}{'p95 (ms)':>10}{'max (ms)':>10}{'in target':>11}{'reused':>8}")
+    for mode, incremental in (('full query', False), ('incremental', True)):
+        timings, reused = replay(words, incremental)
+        within = sum(t <= TARGET_MS for t in timings) / len(timings)
+        print(f"{mode:<14}{statistics.median(timings):>10.2f}{percentile(timings, 0.95):>10.2f}{max(timings):>10.2f}{within:>11.1%}{reused:>8}")
+
+if __name__ == "__main__":
+    run(*sys.argv[1:2], *map(int, sys.argv[2:3]))
@@ -0,0 +1,65 @@
+import os
+import random
+import statistics
+import sys
+import time
+from peewee import SQL
+from dictionary.loader import db, Entry, result_cache, each_shard
+from dictionary.scan import Trie, build_trie, headword_keys, scan_headwords, trie_path
+
+## Scans paragraphs made of random headwords of an existing database for every dictionary word in them, with the
+## memory-mapped headword trie and with a query per substring (up to the longest headword), and reports the trie's
+## build time, size and the time to map it.
+## Usage: python -m benchmarks.scan [dictionary_fts.db] [number of paragraphs] [headwords per paragraph]
+
+def paragraphs(keys, n, words, seed=0):
+    rng = random.Random(seed)
+    return [''.join(rng.sample(keys, words)) for _ in range(n)]
+
+def scan_by_query(text, max_length):
+    found = []
+    for start in range(len(text)):
+        for end in range(min(len(text), start + max_length), start, -1):
+            word = text[start:end]
+            query = Entry.select(SQL('1')).where((Entry.expression == word) | (Entry.reading == word)).limit(1)
+            if any(each_shard(query.scalar)):
+                found.append((start, word))
+    return found
+
+def timed(scan, texts):
+    timings = []
+    for text in texts:
+        start = time.perf_counter()
+        scan(text)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def run(path='dictionary_fts.db', n=20, words=30):
+    db.init(path)
+    result_cache.max_size = 0 # measure the lookups themselves, not the result cache
+    start = time.perf_counter()
+    build_trie().close()
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    trie = Trie.open(trie_path())
+    open_time = time.perf_counter() - start
+    print(f"Trie built in {build_time:.1f}s, {os.path.getsize(trie_path()) / 2**20:.1f} MiB, mapped in {open_time * 1000:.2f} ms\n")
+
+    keys = headword_keys()
+    max_length = max(map(len, keys))
+    texts = paragraphs(keys, n, words)
+    assert all(trie.scan(i) == scan_by_query(i, max_length) for i in texts[:2])
+    modes = (
+        ('trie scan', trie.scan),
+        ('trie scan and headword query', scan_headwords),
+        ('query per substring', lambda text: scan_by_query(text, max_length)),
+    )
+    print(f"{n} paragraphs of {statistics.mean(map(len, texts)):.0f} characters\n")
+    print(f"{'mode':<32}{'mean (ms)':>10}{'p50 (ms)':>10}{'max (ms)':>10}")
+    for mode, scan in modes:
+        timings = timed(scan, texts)
+        print(f"{mode:<32}{statistics.mean(timings):>10.2f}{statistics.median(timings):>10.2f}{max(timings):>10.2f}")
+    trie.close()
+
+if __name__ == "__main__":
+    run(*sys.argv[1:2], *map(int, sys.argv[2:4]))
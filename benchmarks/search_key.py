@@ -0,0 +1,60 @@
+import random
+import statistics
+import sys
+import time
+from dictionary.loader import db, Entry, QueryPlan, definitions_select, headwords_select, migrate_entry_keys, result_cache, each_shard, fetch_rows, shard_rows
+from dictionary.instrument import percentile
+
+## Looks up random expressions and readings of an existing database exactly, through the expression and reading indexes
+## (an OR of two index seeks) and through the normalized search keys (a single seek), and counts how many of their
+## kana variants (hiragana written in katakana and the other way round) each of them finds.
+## Usage: python -m benchmarks.search_key [dictionary_fts.db] [number of terms]
+SWAP_KANA = {
+    **{i: i + 0x60 for i in range(ord('ぁ'), ord('ゖ') + 1)},
+    **{i: i - 0x60 for i in range(ord('ァ'), ord('ヶ') + 1)},
+}
+
+def sample_terms(n, seed=0):
+    rng = random.Random(seed)
+    expressions = [i for i, in shard_rows(Entry.select(Entry.expression).tuples())]
+    readings = [i for i, in shard_rows(Entry.select(Entry.reading).where(Entry.reading != '').tuples())]
+    return rng.sample(expressions, min(n // 2, len(expressions))) + rng.sample(readings, min(n // 2, len(readings)))
+
+def lookup_rows(select, term, search_keys):
+    # The rows of select on every shard, with the route forced to the search keys or expression OR reading
+    def lookup(shard):
+        plan = QueryPlan(term, search_keys=search_keys, database=shard)
+        return fetch_rows('lookup', select(term, plan=plan), plan)
+    return each_shard(lookup)
+
+def timed(lookup, terms):
+    timings = []
+    for term in terms:
+        start = time.perf_counter()
+        lookup(term)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def run(path='dictionary_fts.db', n=1000):
+    db.init(path)
+    result_cache.max_size = 0 # measure the lookups themselves, not the result cache
+    migrate_entry_keys()
+    terms = sample_terms(n)
+    variants = [i.translate(SWAP_KANA) for i in terms]
+    variants = [i for i, term in zip(variants, terms) if i != term]
+
+    routes = (('expression OR reading', False), ('search key', True))
+    print(f"{len(terms)} terms, {len(variants)} kana variants\n")
+    print(f"{'route':<24}{'lookup':<14}{'mean (ms)':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}{'variants found':>16}")
+    for route, search_keys in routes:
+        lookups = (
+            ('headwords', lambda term: lookup_rows(headwords_select, term, search_keys)),
+            ('definitions', lambda term: lookup_rows(definitions_select, term, search_keys)),
+        )
+        found = sum(any(lookups[0][1](i)) for i in variants)
+        for name, lookup in lookups:
+            timings = timed(lookup, terms)
+            print(f"{route:<24}{name:<14}{statistics.mean(timings):>10.2f}{statistics.median(timings):>10.2f}{percentile(timings, 0.95):>10.2f}{found:>16}")
+
+if __name__ == "__main__":
+    run(*sys.argv[1:2], *map(int, sys.argv[2:3]))
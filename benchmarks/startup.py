@@ -0,0 +1,58 @@
+import statistics
+import subprocess
+import sys
+import time
+
+## Measures how long after launch the main window is shown and the OCR model is ready, with the model loaded
+## before showing the window (eager, how it used to work) and warmed up in the background after it (lazy).
+## Every run is a fresh process so the imports are counted too.
+## Usage: python -m benchmarks.startup [runs]
+
+def child(mode):
+    import os
+    from PyQt6.QtWidgets import QApplication
+    from PyQt6.QtCore import QTimer
+    app = QApplication(sys.argv)
+    import main
+    window = main.MainWindow()
+    if mode == 'eager':
+        window.manga_ocr.warm_up().result()
+    window.show()
+
+    def ocr_ready(future):
+        print('ocr_ready', time.time(), flush=True)
+        window.manga_ocr.close()
+        os._exit(0)
+
+    def shown():
+        # Runs once the events queued by show() have been processed
+        print('shown', time.time(), flush=True)
+        window.manga_ocr.warm_up().add_done_callback(ocr_ready)
+    QTimer.singleShot(0, shown)
+    app.exec()
+
+def launch(mode):
+    start = time.time()
+    out = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.startup', '--child', mode],
+        capture_output=True, text=True, check=True
+    ).stdout
+    times = dict(line.split() for line in out.splitlines() if line.startswith(('shown ', 'ocr_ready ')))
+    return float(times['shown']) - start, float(times['ocr_ready']) - start
+
+def run(runs=3):
+    results = []
+    for mode in ('eager', 'lazy'):
+        times = [launch(mode) for _ in range(runs)]
+        results.append((mode, statistics.median(i[0] for i in times), statistics.median(i[1] for i in times)))
+
+    print(f"\n{'mode':<8}{'window shown (s)':>18}{'OCR ready (s)':>16}")
+    for mode, shown, ready in results:
+        print(f"{mode:<8}{shown:>18.2f}{ready:>16.2f}")
+    return results
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2])
+    else:
+        run(*map(int, sys.argv[1:]))
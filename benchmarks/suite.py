@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from benchmarks.synthetic import make_dictionary
+from dictionary.instrument import percentile
+
+## Import and lookup benchmarks on a synthetic dictionary (benchmarks.synthetic), so they run offline and without
+## dictionary files. Results are written as JSON and can be compared against a previous run:
+##   python -m benchmarks.suite -o baseline.json
+##   ... change something ...
+##   python -m benchmarks.suite --baseline baseline.json
+## --keep saves the database so the other benchmarks (live_search, deinflection, scan, http_server) can use it.
+LOOKUP_KINDS = ('exact', 'prefix', 'infix', 'underscore')
+SLOWER_THRESHOLD = 0.1 # relative change reported as a regression
+## Only these are checked against the threshold, the tail latencies of a single run are too noisy
+REGRESSION_METRICS = ('seconds', 'entries_per_second', 'peak_rss_mib', 'database_mib', 'p50_ms', 'peak_alloc_kib')
+
+def max_rss():
+    # Peak RSS in MiB, None where the resource module isn't available (Windows)
+    try:
+        from benchmarks.import_memory import max_rss
+    except ImportError:
+        return None
+    return max_rss()
+
+def timings_summary(timings):
+    return {
+        'mean_ms': statistics.mean(timings),
+        'p50_ms': statistics.median(timings),
+        'p95_ms': percentile(timings, 0.95),
+        'max_ms': max(timings),
+    }
+
+def measure(function, items, memory_samples=20):
+    # Times function over items, then runs it again on a few of them under tracemalloc for the peak allocation
+    timings = []
+    for item in items:
+        start = time.perf_counter()
+        function(item)
+        timings.append((time.perf_counter() - start) * 1000)
+    result = timings_summary(timings)
+    tracemalloc.start()
+    peak = 0
+    for item in items[:memory_samples]:
+        tracemalloc.reset_peak()
+        function(item)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+    result['peak_alloc_kib'] = peak / 2**10
+    return result
+
+def import_dictionary(zip_path, database):
+    # Runs in a fresh process so its peak RSS is the import's own
+    from dictionary.loader import db, load_dictionary
+    db.init(database)
+    baseline = max_rss()
+    start = time.perf_counter()
+    dictionary_id = load_dictionary(zip_path)
+    elapsed = time.perf_counter() - start
+    peak = max_rss()
+    return dictionary_id, elapsed, baseline, peak
+
+def lookup_terms(n, seed=0):
+    from dictionary.loader import Entry, shard_rows
+    from peewee import fn
+    rng = random.Random(seed)
+    words = [i for i, in shard_rows(Entry.select(Entry.expression).where(fn.length(Entry.expression).between(2, 6)).tuples())]
+    words = rng.sample(words, min(n, len(words)))
+    def underscore(word):
+        i = rng.randrange(len(word))
+        return word[:i] + '_' + word[i+1:]
+    return {
+        'exact': words,
+        'prefix': [i[:rng.randint(1, 2)] + '%' for i in words],
+        'infix': ['%' + i[1:3] + '%' for i in words],
+        'underscore': [underscore(i) for i in words],
+    }
+
+def render_pages(words):
+    from dictionary import page
+    from dictionary.loader import get_definition
+    entries = [i for word in words for i in get_definition(word, 1)]
+    def render(entry):
+        page._page_cache.clear()
+        page.generate_page_html(entry)
+    return entries, render
+
+def run(entries=100000, seed=0, lookups=200, dictionary_zip=None, keep=None):
+    results = {}
+    workdir = tempfile.mkdtemp()
+    zip_path = dictionary_zip
+    try:
+        if zip_path is None:
+            zip_path = os.path.join(workdir, 'synthetic.zip')
+            start = time.perf_counter()
+            make_dictionary(zip_path, entries, seed)
+            print(f"Generated {entries} entries in {time.perf_counter() - start:.1f}s")
+        database = os.path.join(workdir, 'dictionary_fts.db')
+
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            dictionary_id, elapsed, baseline, peak = executor.submit(import_dictionary, zip_path, database).result()
+        from dictionary.loader import db, Entry, result_cache, copy_database, database_size, each_shard, get_definition, get_fts_index_mode, migrate_fts_index, remove_dictionary
+        db.init(database)
+        count = sum(each_shard(lambda shard: Entry.select().count(shard)))
+        results['import'] = {
+            'seconds': elapsed,
+            'entries_per_second': count / elapsed,
+            'rss_before_mib': baseline,
+            'peak_rss_mib': peak,
+            'database_mib': database_size() / 2**20,
+        }
+        print(f"Imported {count} entries in {elapsed:.1f}s")
+
+        start = time.perf_counter()
+        migrate_fts_index(get_fts_index_mode())
+        results['fts_build'] = {'seconds': time.perf_counter() - start, 'database_mib': database_size() / 2**20}
+
+        result_cache.max_size = 0 # measure the lookups themselves, not the result cache
+        terms = lookup_terms(lookups, seed)
+        for kind in LOOKUP_KINDS:
+            results[f'lookup_{kind}'] = measure(get_definition, terms[kind])
+            results[f'lookup_{kind}']['matches'] = statistics.mean(len(get_definition(i)) for i in terms[kind])
+
+        pages, render = render_pages(terms['exact'])
+        results['render_page'] = measure(render, pages)
+
+        if keep:
+            db.close()
+            copy_database(database, keep)
+            print(f"Saved the database as {keep}")
+
+        start = time.perf_counter()
+        remove_dictionary(dictionary_id)
+        results['remove_dictionary'] = {'seconds': time.perf_counter() - start, 'database_mib': database_size() / 2**20}
+        db.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'entries': count,
+            'seed': seed,
+            'lookups': lookups,
+            'zip': os.path.basename(dictionary_zip) if dictionary_zip else None,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+def compare(current, baseline, threshold=SLOWER_THRESHOLD):
+    # Metric by metric change against a baseline run, returns the names of the metrics that got worse by more than threshold
+    # (every metric is better lower, except entries_per_second)
+    regressions = []
+    print(f"\n{'benchmark':<24}{'metric':<20}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, metrics in current['results'].items():
+        for metric, value in metrics.items():
+            previous = baseline.get('results', {}).get(name, {}).get(metric)
+            if previous is None or value is None or metric == 'matches':
+                continue
+            change = (value - previous) / previous if previous else 0.0
+            worse = -change if metric == 'entries_per_second' else change
+            flag = ' !' if worse > threshold and metric in REGRESSION_METRICS else ''
+            if flag:
+                regressions.append(f'{name}.{metric}')
+            print(f"{name:<24}{metric:<20}{previous:>12.2f}{value:>12.2f}{change:>+9.1%}{flag}")
+    return regressions
+
+def report(current):
+    print(f"\n{'benchmark':<24}{'metric':<20}{'value':>12}")
+    for name, metrics in current['results'].items():
+        for metric, value in metrics.items():
+            if value is not None:
+                print(f"{name:<24}{metric:<20}{value:>12.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description="Import and lookup benchmarks on a synthetic dictionary")
+    parser.add_argument('-n', '--entries', type=int, default=100000, help="entries in the synthetic dictionary")
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-l', '--lookups', type=int, default=200, help="terms looked up per kind of lookup")
+    parser.add_argument('--zip', help="benchmark this Yomichan dictionary instead of a synthetic one")
+    parser.add_argument('-o', '--output', help="write the results as JSON")
+    parser.add_argument('--baseline', help="JSON results of a previous run to compare against")
+    parser.add_argument('--threshold', type=float, default=SLOWER_THRESHOLD, help="relative change reported as a regression")
+    parser.add_argument('--keep', help="save the benchmark database to this path")
+    args = parser.parse_args(argv)
+
+    current = run(args.entries, args.seed, args.lookups, args.zip, args.keep)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(current, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} metrics worse than the baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    else:
+        report(current)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
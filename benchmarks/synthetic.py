@@ -0,0 +1,106 @@
+import itertools
+import json
+import random
+import sys
+import zipfile
+
+## Writes a synthetic dictionary in the Yomichan format (index.json and term_bank_*.json), so the benchmarks run
+## without any dictionary files. Headwords look like a Japanese dictionary's: mostly one to four kanji with a reading
+## of about two kana each, verbs and adjectives with okurigana and rules, kana words and katakana loanwords, and
+## homographs with several readings. The same seed always gives the same dictionary.
+## Usage: python -m benchmarks.synthetic synthetic.zip [entries] [seed]
+TERM_BANK_SIZE = 10000
+
+HIRAGANA = [chr(i) for i in range(ord('ぁ'), ord('ゖ') + 1)]
+KATAKANA = [chr(i) for i in range(ord('ァ'), ord('ヺ') + 1)] + ['ー']
+KANJI_POOL = [chr(i) for i in random.Random(0).sample(range(0x4E00, 0x9FA0), 3000)]
+# Common kanji are used far more than rare ones
+KANJI_WEIGHTS = list(itertools.accumulate(1 / (i + 10) for i in range(len(KANJI_POOL))))
+GLOSS_CHARACTERS = KANJI_POOL[:500] + HIRAGANA[:40]
+KANA_PER_KANJI = (1, 2, 2, 2, 3)
+KANJI_COUNT = (1, 2, 2, 2, 2, 3, 3, 4)
+
+## Okurigana with the rules of the words ending in them
+VERB_ENDINGS = (('べる', 'v1'), ('める', 'v1'), ('きる', 'v1'), ('む', 'v5'), ('く', 'v5'), ('す', 'v5'), ('う', 'v5'), ('る', 'v5'), ('つ', 'v5'))
+ADJECTIVE_ENDINGS = (('い', 'adj-i'), ('しい', 'adj-i'))
+
+GLOSS_WORDS = (
+    'to', 'of', 'the', 'a', 'state', 'act', 'person', 'thing', 'place', 'time', 'way', 'make', 'become', 'use', 'take',
+    'give', 'see', 'think', 'feel', 'large', 'small', 'new', 'old', 'good', 'strong', 'quickly', 'first', 'together',
+)
+
+def kana(rng, length, alphabet=HIRAGANA):
+    return ''.join(rng.choices(alphabet, k=length))
+
+def glossary(rng, expression, reading):
+    # Half like a monolingual dictionary (one numbered text), half like a bilingual one (a list of short glosses)
+    if rng.random() < 0.5:
+        senses = [
+            f"（{i}）" + ''.join(rng.choices(GLOSS_CHARACTERS, k=rng.randint(15, 80))) + '。'
+            for i in range(1, rng.randint(1, 4) + 1)
+        ]
+        return [f"{expression}【{reading}】\n" + '\n'.join(senses)]
+    return [' '.join(rng.choice(GLOSS_WORDS) for _ in range(rng.randint(1, 6))) for _ in range(rng.randint(1, 5))]
+
+def synthetic_terms(entries, seed=0):
+    rng = random.Random(seed)
+    previous = []
+    for sequence in range(1, entries + 1):
+        kind = rng.random()
+        rules = ''
+        if kind < 0.1 and previous:
+            # Another reading of an earlier headword
+            expression, _, rules = rng.choice(previous)
+            reading = kana(rng, rng.randint(2, 6))
+        elif kind < 0.7:
+            kanji = rng.choices(KANJI_POOL, cum_weights=KANJI_WEIGHTS, k=rng.choice(KANJI_COUNT))
+            expression = ''.join(kanji)
+            reading = ''.join(kana(rng, rng.choice(KANA_PER_KANJI)) for _ in kanji)
+            kind = rng.random()
+            if len(kanji) <= 2 and kind < 0.25:
+                ending, rules = rng.choice(VERB_ENDINGS)
+                expression, reading = expression + ending, reading + ending
+            elif len(kanji) <= 2 and kind < 0.35:
+                ending, rules = rng.choice(ADJECTIVE_ENDINGS)
+                expression, reading = expression + ending, reading + ending
+            elif len(kanji) >= 2 and kind < 0.5:
+                rules = 'vs'
+        elif kind < 0.85:
+            expression, reading = kana(rng, rng.randint(2, 6)), ''
+        else:
+            expression, reading = kana(rng, rng.randint(3, 8), KATAKANA), ''
+        if len(previous) < 10000:
+            previous.append((expression, reading, rules))
+        yield [
+            expression,
+            reading,
+            rules or 'n',
+            rules,
+            rng.randint(-10, 10),
+            glossary(rng, expression, reading or expression),
+            sequence,
+            'P ' if rng.random() < 0.2 else '',
+        ]
+
+def write(z, name, data):
+    # Fixed timestamps, so the zip itself is the same for the same seed
+    z.writestr(zipfile.ZipInfo(name, date_time=(2000, 1, 1, 0, 0, 0)), data, zipfile.ZIP_DEFLATED)
+
+def make_dictionary(path, entries=100000, seed=0, title=None):
+    title = title or f'synthetic-{entries}-{seed}'
+    with zipfile.ZipFile(path, 'w') as z:
+        write(z, 'index.json', json.dumps({'title': title, 'format': 3, 'revision': str(seed), 'sequenced': True}))
+        bank = []
+        number = 1
+        for term in synthetic_terms(entries, seed):
+            bank.append(term)
+            if len(bank) == TERM_BANK_SIZE:
+                write(z, f'term_bank_{number}.json', json.dumps(bank, ensure_ascii=False))
+                bank = []
+                number += 1
+        if bank:
+            write(z, f'term_bank_{number}.json', json.dumps(bank, ensure_ascii=False))
+    return path
+
+if __name__ == "__main__":
+    make_dictionary(sys.argv[1], *map(int, sys.argv[2:4]))
@@ -0,0 +1,94 @@
+import argparse
+import sys
+import time
+import ujson
+from multiprocessing import get_context
+from peewee import chunked
+from dictionary.loader import db, get_definitions, glossary_of, sort_definitions
+
+## Looks up a list of terms (one per line) without the GUI and writes one JSON line per term, with the matches
+## and their definitions in the order the dictionary pages show them. Lookups are spread over worker processes,
+## each with its own read-only connection to the database.
+## Usage: python -m dictionary.batch terms.txt -o definitions.jsonl
+##        cat terms.txt | python -m dictionary.batch > definitions.jsonl
+BATCH_CHUNK_SIZE = 64 # terms sent to a worker, and looked up together, at a time
+PROGRESS_INTERVAL = 5 # seconds
+
+def open_read_only(path):
+    # Runs once in every worker process, the tokenizers are registered when db connects
+    db.init(f'file:{path}?mode=ro', uri=True)
+    db.connect(reuse_if_open=True)
+
+def definition_record(definition):
+    record = {k: v for k, v in definition.items() if k not in ('glossary', 'glossary_blob')}
+    record['glossary'] = glossary_of(definition)
+    return record
+
+def match_records(matches):
+    # Same data generate_page_html renders, for every match of a term
+    return [
+        {
+            'expression': i.expression,
+            'reading': i.reading,
+            'definitions': [definition_record(d) for d in sort_definitions(i.definitions)],
+        }
+        for i in matches
+    ]
+
+def lookup_lines(args):
+    terms, max_return = args
+    try:
+        records = [{'term': term, 'matches': match_records(matches)} for term, matches in zip(terms, get_definitions(terms, max_return))]
+    except Exception:
+        # Looked up one at a time so only the failing terms are reported as errors
+        records = []
+        for term in terms:
+            try:
+                records.append({'term': term, 'matches': match_records(get_definitions([term], max_return)[0])})
+            except Exception as e:
+                records.append({'term': term, 'error': str(e), 'matches': []})
+    return [ujson.dumps(i, ensure_ascii=False) for i in records]
+
+def read_terms(f):
+    for line in f:
+        term = line.strip()
+        if term:
+            yield term
+
+def run(terms, out, database='dictionary_fts.db', processes=None, max_return=300, chunk_size=BATCH_CHUNK_SIZE):
+    # Writes the JSON lines in the order of terms, returns (terms looked up, seconds)
+    start = time.perf_counter()
+    last_report = start
+    count = 0
+    with get_context('spawn').Pool(processes, initializer=open_read_only, initargs=(database,)) as pool:
+        for lines in pool.imap(lookup_lines, ((chunk, max_return) for chunk in chunked(terms, chunk_size))):
+            out.write(''.join(line + '\n' for line in lines))
+            count += len(lines)
+            now = time.perf_counter()
+            if now - last_report > PROGRESS_INTERVAL:
+                print(f"{count} terms, {count / (now - start):.0f} terms/s", file=sys.stderr)
+                last_report = now
+    return count, time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m dictionary.batch', description="Look up a list of terms and write their definitions as JSON Lines")
+    parser.add_argument('terms', nargs='?', help="file with one term per line, stdin if omitted")
+    parser.add_argument('-o', '--output', help="output file, stdout if omitted")
+    parser.add_argument('-d', '--database', default='dictionary_fts.db')
+    parser.add_argument('-p', '--processes', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('-n', '--max-return', type=int, default=300, help="matches per term")
+    args = parser.parse_args(argv)
+
+    terms_file = open(args.terms, encoding='utf-8') if args.terms else sys.stdin
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        count, elapsed = run(read_terms(terms_file), out, args.database, args.processes, args.max_return)
+    finally:
+        if args.terms:
+            terms_file.close()
+        if args.output:
+            out.close()
+    print(f"Looked up {count} terms in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.0f} terms/s)", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,57 @@
 import sys
+import threading
 from PyQt6.QtWidgets import *
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
-from dictionary.loader import load_dictionary, Dictionary, remove_dictionary, remove_all_dictionaries, update_dictionary_priority
+from dictionary.loader import ThreadConnections, load_dictionary, Dictionary, ImportCancelled, remove_dictionary, remove_all_dictionaries, update_dictionary_priority
+from dictionary.scan import refresh_trie, refresh_trie_in_background, entry_signature
+
+class ImportSignals(QObject):
+    progress = pyqtSignal(str, int, int, int, float)
+    finished = pyqtSignal(str)
+
+class ImportWorker(QRunnable):
+    """Imports a dictionary on a thread pool thread, cancelling rolls back everything it inserted"""
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.signals = ImportSignals()
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._connections = None
+
+    def run(self):
+        with self._lock:
+            self._connections = ThreadConnections()
+        dictionary_id = None
+        try:
+            dictionary_id = load_dictionary(self.path, progress=self.signals.progress.emit, cancel=self._cancel)
+            message = "Import finished" if dictionary_id else "Dictionary has already been loaded"
+        except Exception as e:
+            # Cancelling interrupts whatever statement load_dictionary is running
+            if self._cancel.is_set() or isinstance(e, ImportCancelled):
+                message = "Import cancelled"
+            else:
+                print(e)
+                message = f"Import failed: {e}"
+        finally:
+            # Once load_dictionary returns the dictionary is imported, so cancelling doesn't interrupt the trie rebuild
+            with self._lock:
+                self._connections = None
+        if dictionary_id:
+            self.signals.progress.emit("Building headword trie", 0, 0, entry_signature()[0], 0.0)
+            try:
+                refresh_trie()
+            except Exception as e:
+                print(e)
+                message = f"Import finished, building the headword trie failed: {e}"
+        self.signals.finished.emit(message)
+
+    def cancel(self):
+        with self._lock:
+            self._cancel.set()
+            if self._connections is not None:
+                self._connections.interrupt()
 
 class ConfigWindow(QMainWindow):
     def __init__(self):
@@ -15,23 +64,37 @@ class ConfigWindow(QMainWindow):
         self.file_browse_button.clicked.connect(self.browse_button_clicked)
         self.delete_all_button = QPushButton('Delete all dictionaries',self)
         self.delete_all_button.clicked.connect(self.delete_all_button_clicked)
+        self.cancel_import_button = QPushButton('Cancel import',self)
+        self.cancel_import_button.clicked.connect(self.cancel_import_button_clicked)
+        self.cancel_import_button.hide()
         self.dictionaries_table = ReorderTableView(self)
         self.display_dictionaries_table()
 
+        self.import_progress = QProgressBar(self)
+        self.import_progress.hide()
+        self.import_status = QLabel(self)
+        self.import_worker = None
+
         layout = QVBoxLayout()
         layout.setSpacing(2)
         
         horizontal_layout_1 = QHBoxLayout()
         horizontal_layout_2 = QHBoxLayout()
+        horizontal_layout_3 = QHBoxLayout()
         
         horizontal_layout_1.addWidget(self.dictionaries_table)
         
         horizontal_layout_2.addWidget(self.save_button)
         horizontal_layout_2.addWidget(self.file_browse_button)
         horizontal_layout_2.addWidget(self.delete_all_button)
+
+        horizontal_layout_3.addWidget(self.import_progress)
+        horizontal_layout_3.addWidget(self.import_status, stretch=1)
+        horizontal_layout_3.addWidget(self.cancel_import_button)
         
         layout.addLayout(horizontal_layout_1)
         layout.addLayout(horizontal_layout_2)
+        layout.addLayout(horizontal_layout_3)
         
         widget = QWidget()
         widget.setLayout(layout)
@@ -47,8 +110,40 @@ class ConfigWindow(QMainWindow):
     def browse_button_clicked(self):
         file_name, _ = QFileDialog.getOpenFileName(self,"Choose file","","zip (*.zip)")
         if file_name:
-            load_dictionary(file_name)
-            self.display_dictionaries_table()
+            self.import_worker = ImportWorker(file_name)
+            self.import_worker.signals.progress.connect(self.on_import_progress)
+            self.import_worker.signals.finished.connect(self.on_import_finished)
+            self.set_importing(True)
+            self.import_status.setText("Starting import")
+            QThreadPool.globalInstance().start(self.import_worker)
+
+    def cancel_import_button_clicked(self):
+        if self.import_worker is not None:
+            self.import_status.setText("Cancelling import")
+            self.import_worker.cancel()
+
+    def set_importing(self, importing):
+        for button in (self.save_button, self.file_browse_button, self.delete_all_button):
+            button.setEnabled(not importing)
+        self.cancel_import_button.setVisible(importing)
+        self.import_progress.setVisible(importing)
+
+    @pyqtSlot(str, int, int, int, float)
+    def on_import_progress(self, stage, done, total, rows, rows_per_second):
+        # A total of 0 shows a busy indicator while the search index is built
+        self.import_progress.setRange(0, total)
+        self.import_progress.setValue(done)
+        if total:
+            self.import_status.setText(f"{stage} ({done}/{total}), {rows:,} entries, {rows_per_second:,.0f} entries/s")
+        else:
+            self.import_status.setText(f"{stage}, {rows:,} entries")
+
+    @pyqtSlot(str)
+    def on_import_finished(self, message):
+        self.import_worker = None
+        self.set_importing(False)
+        self.import_status.setText(message)
+        self.display_dictionaries_table()
         
     def delete_all_button_clicked(self):
         message_box = QMessageBox()
@@ -59,6 +154,7 @@ class ConfigWindow(QMainWindow):
         return_value = message_box.exec()
         if return_value == QMessageBox.StandardButton.Ok:
             remove_all_dictionaries()
+            refresh_trie_in_background()
             self.display_dictionaries_table()
 
     def display_dictionaries_table(self):
@@ -0,0 +1,205 @@
+from collections import namedtuple
+from functools import lru_cache
+from itertools import chain
+from dictionary.loader import Entry, result_cache, catalog_generation, each_shard, match_terms, normalize_wildcards
+from dictionary.instrument import instrumentation
+
+## Conjugated words are looked up by undoing their inflections. Every rule whose inflected ending matches the end of
+## the text is replaced by the dictionary form ending, over and over, and all the candidates are looked up with one query.
+## A candidate only matches entries whose rules field (v1, v5, vs, vk or adj-i in Yomichan dictionaries) has one of
+## the rule types it was deinflected to. 'te' marks a te form left behind by removing an auxiliary such as いる.
+RULE_TYPES = ('v1', 'v5', 'vs', 'vk', 'adj-i', 'te')
+RULE_BITS = {rule: 1 << i for i, rule in enumerate(RULE_TYPES)}
+
+Rule = namedtuple('Rule', ['kana_in', 'kana_out', 'rules_in', 'rules_out', 'reason'])
+Deinflection = namedtuple('Deinflection', ['term', 'rules', 'reasons'])
+
+def rule_mask(rules):
+    # Bits of the rule types in a space separated rules field, other tags are ignored
+    mask = 0
+    for rule in rules.split() if rules else ():
+        mask |= RULE_BITS.get(rule, 0)
+    return mask
+
+## Godan rows: dictionary ending, then the a, i, e and o stems and the te/ta form
+GODAN = (
+    ('う', 'わ', 'い', 'え', 'お', 'って'),
+    ('く', 'か', 'き', 'け', 'こ', 'いて'),
+    ('ぐ', 'が', 'ぎ', 'げ', 'ご', 'いで'),
+    ('す', 'さ', 'し', 'せ', 'そ', 'して'),
+    ('つ', 'た', 'ち', 'て', 'と', 'って'),
+    ('ぬ', 'な', 'に', 'ね', 'の', 'んで'),
+    ('ぶ', 'ば', 'び', 'べ', 'ぼ', 'んで'),
+    ('む', 'ま', 'み', 'め', 'も', 'んで'),
+    ('る', 'ら', 'り', 'れ', 'ろ', 'って'),
+)
+
+## Endings added to each stem, with the rule type of the inflected word ('' for endings that are never inflected further)
+STEM_FORMS = {
+    'negative': (('ない', 'adj-i', 'negative'), ('ず', '', 'negative'), ('ぬ', '', 'negative')),
+    'continuative': (
+        ('ます', '', 'polite'),
+        ('ました', '', 'polite past'),
+        ('ません', '', 'polite negative'),
+        ('ませんでした', '', 'polite past negative'),
+        ('ましょう', '', 'polite volitional'),
+        ('たい', 'adj-i', 'tai'),
+        ('すぎる', 'v1', 'sugiru'),
+        ('そう', '', 'sou'),
+        ('ながら', '', 'nagara'),
+    ),
+    'conditional': (('ば', '', 'ba'),),
+}
+
+def verb_rules(rule_type, dictionary_ending, stems):
+    # stems: negative, continuative, te (ending in て or で), conditional, imperatives, volitional,
+    # passive and causative stems, potential form
+    negative, continuative, te, conditional, imperatives, volitional, passive, causative, potential = stems
+    past = te[:-1] + ('た' if te.endswith('て') else 'だ')
+    rules = []
+    def add(kana_in, rules_in, reason):
+        # An empty ending (the ichidan masu stem) would make a candidate of every text
+        if kana_in:
+            rules.append(Rule(kana_in, dictionary_ending, rule_mask(rules_in), RULE_BITS[rule_type], reason))
+    for stem, forms in (('negative', negative), ('continuative', continuative), ('conditional', conditional)):
+        for ending, rules_in, reason in STEM_FORMS[stem]:
+            add(forms + ending, rules_in, reason)
+    add(continuative, '', 'masu stem')
+    add(te, 'te', 'te')
+    add(past, '', 'past')
+    add(past + 'ら', '', 'conditional')
+    add(past + 'り', '', 'tari')
+    for imperative in imperatives:
+        add(imperative, '', 'imperative')
+    add(volitional, '', 'volitional')
+    add(passive, 'v1', 'passive')
+    add(causative, 'v1', 'causative')
+    add(potential, 'v1', 'potential')
+    return rules
+
+def build_rules():
+    rules = verb_rules('v1', 'る', ('', '', 'て', 'れ', ('ろ', 'よ'), 'よう', 'られる', 'させる', 'られる'))
+    # Potential without ら (食べれる)
+    rules.append(Rule('れる', 'る', RULE_BITS['v1'], RULE_BITS['v1'], 'potential'))
+    for ending, a, i, e, o, te in GODAN:
+        rules += verb_rules('v5', ending, (a, i, te, e, (e,), o + 'う', a + 'れる', a + 'せる', e + 'る'))
+    # 行く is the only く verb with って
+    for base in ('いく', '行く'):
+        stem = base[:-1]
+        for kana_in, reason in (('って', 'te'), ('った', 'past'), ('ったら', 'conditional'), ('ったり', 'tari')):
+            rules.append(Rule(stem + kana_in, base, RULE_BITS['te'] if reason == 'te' else 0, RULE_BITS['v5'], reason))
+    rules += verb_rules('vs', 'する', ('し', 'し', 'して', 'すれ', ('しろ', 'せよ'), 'しよう', 'される', 'させる', 'できる'))
+    rules.append(Rule('せず', 'する', 0, RULE_BITS['vs'], 'negative'))
+    # Nouns that take する are listed without it
+    rules.append(Rule('する', '', RULE_BITS['vs'], RULE_BITS['vs'], 'suru'))
+    for base, negative, continuative in (('くる', 'こ', 'き'), ('来る', '来', '来')):
+        rules += verb_rules('vk', base, (negative, continuative, continuative + 'て', base[:-1] + 'れ', (negative + 'い',), negative + 'よう', negative + 'られる', negative + 'させる', negative + 'られる'))
+
+    adjective = (
+        ('くない', 'adj-i', 'negative'),
+        ('かった', '', 'past'),
+        ('くて', 'te', 'te'),
+        ('ければ', '', 'ba'),
+        ('かったら', '', 'conditional'),
+        ('かったり', '', 'tari'),
+        ('く', '', 'adv'),
+        ('さ', '', 'noun'),
+        ('そう', '', 'sou'),
+        ('すぎる', 'v1', 'sugiru'),
+    )
+    rules += [Rule(kana_in, 'い', rule_mask(rules_in), RULE_BITS['adj-i'], reason) for kana_in, rules_in, reason in adjective]
+
+    # Auxiliaries that follow a te form
+    auxiliaries = (
+        ('ている', 'v1', 'progressive'),
+        ('てる', 'v1', 'progressive'),
+        ('ておく', 'v5', 'teoku'),
+        ('とく', 'v5', 'teoku'),
+        ('てしまう', 'v5', 'teshimau'),
+        ('ちゃう', 'v5', 'teshimau'),
+        ('てください', '', 'kudasai'),
+    )
+    for kana_in, rules_in, reason in auxiliaries:
+        rules.append(Rule(kana_in, 'て', rule_mask(rules_in), RULE_BITS['te'], reason))
+        # The same auxiliaries after a te form ending in で
+        voiced = kana_in.replace('て', 'で', 1).replace('と', 'ど', 1).replace('ちゃ', 'じゃ', 1)
+        rules.append(Rule(voiced, 'で', rule_mask(rules_in), RULE_BITS['te'], reason))
+    return rules
+
+def compile_rules(rules):
+    # Rules by inflected ending, and the lengths of the endings so only those suffixes are looked up
+    table = {}
+    for rule in rules:
+        table.setdefault(rule.kana_in, []).append(rule)
+    return table, sorted({len(i) for i in table})
+
+RULES, SUFFIX_LENGTHS = compile_rules(build_rules())
+
+@lru_cache(maxsize=4096)
+def deinflect(term):
+    # Every candidate dictionary form of term, starting with term itself, with the rule types it
+    # can have (0 for any) and the inflections that were undone, innermost first
+    results = [Deinflection(term, 0, ())]
+    seen = {(term, 0)}
+    for current in results:
+        text = current.term
+        for length in SUFFIX_LENGTHS:
+            if length > len(text):
+                break
+            for rule in RULES.get(text[-length:], ()):
+                if current.rules and not current.rules & rule.rules_in:
+                    continue
+                if len(text) - length + len(rule.kana_out) <= 0:
+                    continue
+                candidate = text[:-length] + rule.kana_out
+                if (candidate, rule.rules_out) in seen:
+                    continue
+                seen.add((candidate, rule.rules_out))
+                results.append(Deinflection(candidate, rule.rules_out, (rule.reason,) + current.reasons))
+    return tuple(results)
+
+@instrumentation.timed('deinflected_headwords')
+def deinflected_headwords(term, max_return=300):
+    # get_headwords rows for the dictionary forms of a conjugated term, each with the inflections
+    # that were undone as reasons. All candidates are looked up with a single query.
+    term = normalize_wildcards(term)
+    key = ('deinflected', term, max_return)
+    generation = catalog_generation()
+    result = result_cache.get(key, generation)
+    if result is not None:
+        return result
+
+    candidates = {}
+    for deinflection in deinflect(term):
+        candidates.setdefault(deinflection.term, []).append(deinflection)
+    def lookup(shard):
+        # Matched like exact lookups, through the search keys
+        condition, terms_of = match_terms(shard, candidates)
+        query = Entry\
+            .select(Entry.id, Entry.expression, Entry.reading, Entry.rules)\
+            .where(condition)\
+            .tuples()
+        return [(row, dict.fromkeys(terms_of(row[1]) + terms_of(row[2]))) for row in query.execute(shard)]
+
+    headwords = {}
+    for (entry_id, expression, reading, rules), terms in chain.from_iterable(each_shard(lookup)):
+        mask = rule_mask(rules)
+        matching = [i for term in terms for i in candidates[term] if not i.rules or i.rules & mask]
+        if not matching:
+            continue
+        best = min(matching, key=lambda i: len(i.reasons))
+        headword = headwords.get((expression, reading))
+        if headword is None:
+            headword = headwords[(expression, reading)] = Entry(expression=expression, reading=reading)
+            headword.entry_ids = []
+            headword.reasons = best.reasons
+        elif len(best.reasons) < len(headword.reasons):
+            headword.reasons = best.reasons
+        headword.entry_ids.append(entry_id)
+
+    # Fewest inflections first, then the same order as get_headwords
+    result = sorted(headwords.values(), key=lambda i: (len(i.reasons), len(i.expression), i.expression, i.reading))[:max_return]
+    for i in result:
+        i.entry_ids.sort()
+    result_cache.put(key, generation, result)
+    return result
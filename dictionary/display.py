@@ -10,116 +10,160 @@ from PyQt6.QtWidgets import (
     QHBoxLayout, 
     QTableView, 
     QHeaderView,
+    QProgressBar,
     QApplication
 )
-from PyQt6.QtCore import Qt, pyqtSlot, pyqtSignal, QEvent, QAbstractTableModel
-from PyQt6.QtGui import QFontDatabase, QFont, QKeySequence
+from PyQt6.QtCore import Qt, pyqtSlot, pyqtSignal, QEvent, QAbstractTableModel, QModelIndex, QObject, QRunnable, QThreadPool, QTimer
+from PyQt6.QtGui import QFont, QKeySequence
 from PyQt6.QtWebEngineWidgets import QWebEngineView
-import ujson
-from dictionary.loader import get_definition
+from PyQt6.QtWebEngineCore import QWebEngineProfile
+import threading
+import time
+from collections import OrderedDict
+from dictionary.loader import ThreadConnections, get_headwords, get_entry_definitions, cached_entry_definitions, normalize_wildcards, headword_key, IncrementalSearch, HEADWORD_PAGE_SIZE
+from dictionary.page import generate_page_html
 from dictionary.config import ConfigWindow
+from dictionary.fonts import font_family
+from dictionary.deinflect import deinflected_headwords
+from dictionary.scan import scan_headwords
+from dictionary.instrument import instrumentation
 from PIL import ImageGrab
 from PIL.PngImagePlugin import PngImageFile
 from PIL.BmpImagePlugin import DibImageFile
-from manga_ocr import MangaOcr
-import re
-
-def format_definitions(text):
-    out = text.replace('\n','<br>')
-
-    ## Make sure there is a line break before bracketed circled unicode numbers
-    ## (?<!^) negative look behind to ensure that the pattern is not at the start of the string
-    ## \uff08 and \uff09 are brackets
-    ## \u2460-\u2473 is the range of circled unicode numbers
-    out = re.sub(r'(?<!^)(<br>)*(\uff08[\u2460-\u2473]\uff09)',r"<br>\2",out)
-
-    ## Similar to above, make sure there is a line break before unbracketed circled unicode numbers while ignoring the bracketed ones
-    out = re.sub(r'(?<!^)(<br>)*([\u2460-\u2473])(?!\uff09)',r"<br>\2",out)
-    return out
-
-def definition_to_html(definition, expression, reading):
-    _definition = ujson.loads(definition['glossary'])
-    try:
-        _headword, d = _definition[0].removesuffix('\n').split('\n',1)
-        _definition_list = [d]+_definition[1:]
-        _definition_list = [format_definitions(i) for i in _definition_list]
-    except: #Mainly for JMdict
-        if reading:
-            _headword = f"{expression} 【{reading}】"
+from dictionary.ocr import OcrWorker, OcrCache, OCR_CACHE
+
+## Search as you type: lookups run once typing pauses for LIVE_SEARCH_DELAY ms
+LIVE_SEARCH = True
+LIVE_SEARCH_DELAY = 150
+
+## Tabs borrow their web view from a shared pool when they are shown,
+## hidden tabs hand theirs over once more than WEB_VIEW_POOL_SIZE are in use
+WEB_VIEW_POOL_SIZE = 3
+
+class WebViewPool:
+    def __init__(self, size=WEB_VIEW_POOL_SIZE):
+        self.size = size
+        self._free = []
+        self._owners = OrderedDict() # view: tab, least recently shown first
+
+    def create_view(self):
+        # Every view shares the default profile, and with it the renderer processes and caches
+        return QWebEngineView(QWebEngineProfile.defaultProfile())
+
+    def acquire(self, tab):
+        if not self._free and len(self._owners) >= self.size:
+            hidden = [owner for owner in self._owners.values() if not owner.isVisible()]
+            if hidden:
+                hidden[0].detach_view()
+        view = self._free.pop() if self._free else self.create_view()
+        self._owners[view] = tab
+        return view
+
+    def touch(self, view):
+        self._owners.move_to_end(view)
+
+    def release(self, view):
+        self._owners.pop(view, None)
+        view.setParent(None)
+        if len(self._free) + len(self._owners) < self.size:
+            self._free.append(view)
         else:
-            _headword = f"{expression}"
-        _headword = _headword+f"{'(P) ' if definition.get('term_tags').startswith('P ') else ''}"
-        _definition_list = _definition
-
-    if len(_definition) > 1:
-        _definition_list = '<ol>'+''.join(f"<li>{i}</li>" for i in _definition)+'</ol>'
-    else:
-        _definition_list = _definition_list[0]
-        
-    if reading:
-        return f"""<definition>
-    <b>{_headword}</b><dictname>{definition['dictionary_name']}</dictname>
-    <br>
-    <blockquote>
-    {_definition_list}
-    </blockquote>
-    </definition>
+            view.deleteLater()
+
+web_view_pool = WebViewPool()
+
+class LookupSignals(QObject):
+    finished = pyqtSignal(int, object)
+
+class DatabaseWorker(QRunnable):
+    """Runs lookup() on a thread pool thread, which has its own SQLite connections, and emits its result
+
+    cancel() interrupts the running query, a cancelled worker emits nothing.
     """
-    return f"""<definition>
-    <b>{_headword}</b><dictname>{definition['dictionary_name']}</dictname>
-    <br>
-    <blockquote>
-    {_definition_list}
-    </blockquote>
-    </definition>
+    failed = None # emitted if lookup() raises
+
+    def __init__(self, lookup_id):
+        super().__init__()
+        self.lookup_id = lookup_id
+        self.signals = LookupSignals()
+        self._lock = threading.Lock()
+        self._connections = None
+        self._cancelled = False
+
+    def lookup(self):
+        raise NotImplementedError
+
+    def run(self):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._connections = ThreadConnections()
+        try:
+            result = self.lookup()
+        except Exception as e:
+            # An interrupted query means the lookup was superseded
+            if self._cancelled:
+                return
+            print(e)
+            result = self.failed
+        finally:
+            with self._lock:
+                self._connections = None
+        if not self._cancelled:
+            self.signals.finished.emit(self.lookup_id, result)
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            if self._connections is not None:
+                self._connections.interrupt()
+
+class LookupWorker(DatabaseWorker):
+    """Runs get_headwords on a thread pool thread
+
+    Fetches one page of HEADWORD_PAGE_SIZE headwords, after is the headword_key of the previous page's last row.
+    When nothing matches a text without wildcards, its deinflected dictionary forms are looked up instead, and
+    failing that a searched (not typed) text is scanned for every dictionary word in it, e.g. a selected sentence.
     """
+    failed = []
 
-def definitions_to_html(definitions, expression, reading):
-    return '<p>'.join(definition_to_html(definition, expression, reading) for definition in definitions)
+    def __init__(self, lookup_id, search_text, live_text=None, after=None):
+        super().__init__(lookup_id)
+        self.search_text = search_text
+        self.live_text = live_text
+        self.after = after
+        self.fallback = None
 
-def generate_page_html(entry):
-    if entry:
-        definitions = definitions_to_html(
-            definitions = sorted(entry.definitions, key=lambda x: (x.get('dictionary_priority'), not x.get('term_tags').startswith('P '))), 
-            expression = entry.expression,
-            reading = entry.reading
-        )
-    else:
-        definitions = ''
-    return f"""
-    <html>
-    <head>
-    <style type="text/css">
-    blockquote {{
-      margin: 1em;
-      padding: 0 1em;
-      border-left: .25em solid #d0d7de;
-    }}
-    ol li 
-    {{
-      margin: 0px;
-      padding: 0px;
-      margin-left: -1.4em;
-    }}
-    dictname
-    {{
-      padding: .2em .4em;
-      margin: 0;
-      font-size: 85%;
-      background-color: rgba(175,184,193,0.2);
-      border-radius: 6px;
-    }}
-    </style>
-    </head>
-    <body>
-    {definitions} 
-    </body>
-    </html>"""
+    def lookup(self):
+        match_data = get_headwords(self.search_text, HEADWORD_PAGE_SIZE, self.after)
+        text = normalize_wildcards(self.search_text if self.live_text is None else self.live_text)
+        if not match_data and self.after is None and '%' not in text and '_' not in text:
+            match_data = deinflected_headwords(text, HEADWORD_PAGE_SIZE)
+            self.fallback = 'deinflected' if match_data else None
+            if not match_data and self.live_text is None and len(text) > 1:
+                match_data = scan_headwords(text, HEADWORD_PAGE_SIZE)
+                self.fallback = 'scanned' if match_data else None
+        return match_data
+
+class DefinitionsWorker(DatabaseWorker):
+    """Runs get_entry_definitions for the headword being displayed on a thread pool thread"""
+    def __init__(self, lookup_id, entry_ids):
+        super().__init__(lookup_id)
+        self.entry_ids = entry_ids
+
+    def lookup(self):
+        return get_entry_definitions(self.entry_ids)
 
 class LineEdit(QLineEdit):
+    ocr_finished = pyqtSignal(str)
+    ocr_settled = pyqtSignal()
     def __init__(self, ocr):
         super().__init__()
         self.ocr = ocr
+        self.ocr_finished.connect(self.insert)
+        self.ocr_settled.connect(self.on_ocr_settled)
+        self._ocr_pending = set()
+        self._placeholder = None # placeholder text to restore once no pasted image is being recognised
     def contextMenuEvent(self, event):
         menu = self.createStandardContextMenu()
         menu.exec(event.globalPos())
@@ -130,30 +174,69 @@ class LineEdit(QLineEdit):
             elif not QApplication.clipboard().image().isNull():
                 data = ImageGrab.grabclipboard()
                 if type(data) in (PngImageFile, DibImageFile):
-                    text = self.ocr(data)
-                    self.insert(text)
+                    # Recognised in the OCR process, the text is inserted when it is done
+                    if self._placeholder is None:
+                        self._placeholder = self.placeholderText()
+                    self.setPlaceholderText("Recognising image" if self.ocr.ready else "Waiting for the OCR model to load")
+                    future = self.ocr.submit(data)
+                    self._ocr_pending.add(future)
+                    future.add_done_callback(self.on_ocr_done)
+            return
+        if event.key() == Qt.Key.Key_Escape and self._ocr_pending:
+            self.cancel_ocr()
             return
         super().keyPressEvent(event)
 
+    def cancel_ocr(self):
+        # Drops pasted images that haven't been recognised yet
+        for future in list(self._ocr_pending):
+            future.cancel()
+
+    def on_ocr_done(self, future):
+        # Called on the thread that reads results from the OCR process, the signals hand the text over to the GUI thread
+        self._ocr_pending.discard(future)
+        try:
+            self.ocr_settled.emit()
+            if future.cancelled():
+                return
+            try:
+                text = future.result()
+            except Exception as e:
+                print(e)
+                return
+            self.ocr_finished.emit(text)
+        except RuntimeError: # the tab was closed in the meantime
+            pass
+
+    def on_ocr_settled(self):
+        if not self._ocr_pending and self._placeholder is not None:
+            self.setPlaceholderText(self._placeholder)
+            self._placeholder = None
+
 class MainWindow(QMainWindow):
     def __init__(self, ocr, parent_tab=None):
         super().__init__()
         self.ocr = ocr
         
-        self.dictionary = QWebEngineView()
+        # The web view is only attached when the tab is shown, see showEvent
+        self.dictionary = None
+        self.dictionary_area = QWidget()
+        self.dictionary_layout = QVBoxLayout(self.dictionary_area)
+        self.dictionary_layout.setContentsMargins(0, 0, 0, 0)
+        self._page_html = generate_page_html(None)
         self.parent_tab = parent_tab
-        _id = QFontDatabase.addApplicationFont("font/NotoSansJP-Regular.otf")
-        _fontstr = QFontDatabase.applicationFontFamilies(_id)[0]
+        _fontstr = font_family()
         self._font = QFont(_fontstr, 12)
-        self.dictionary.setFont(self._font)
-        self.dictionary.setHtml(generate_page_html(None))
-        self.dictionary.focusProxy().installEventFilter(self)
         
         self.search_box_label = QLabel('Search')
         self.search_box = LineEdit(ocr)
         self.search_box.setFont(self._font)
         self.search_box.setPlaceholderText("Use % and _ as wildcard characters") 
         self.search_box.returnPressed.connect(self.get_definitions)
+        self.search_timer = QTimer(self, singleShot=True, interval=LIVE_SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.search_as_you_type)
+        if LIVE_SEARCH:
+            self.search_box.textEdited.connect(lambda _: self.search_timer.start())
         self.search_box.setStyleSheet("""
             QLineEdit { 
                 border: 1px solid;
@@ -165,12 +248,19 @@ class MainWindow(QMainWindow):
             }"""
         )
 
+        self.busy_indicator = QProgressBar()
+        self.busy_indicator.setRange(0, 0)
+        self.busy_indicator.setTextVisible(False)
+        self.busy_indicator.setMaximumWidth(60)
+        self.busy_indicator.hide()
+
         self.config_button = QPushButton("Config", self)
         self.config_button.resize(100,32)
         self.config_button.clicked.connect(self.config_window)
 
         self.table = MatchTable()
         self.model = MatchTableModel()
+        self.model.fetch_requested.connect(self.fetch_more_matches)
         self.table.setModel(self.model)
         selection_model = self.table.selectionModel()
         selection_model.selectionChanged.connect(self.on_selectionChanged)
@@ -202,10 +292,11 @@ class MainWindow(QMainWindow):
         
         horizontal_layout_1.addWidget(self.search_box_label)
         horizontal_layout_1.addWidget(self.search_box)
+        horizontal_layout_1.addWidget(self.busy_indicator)
         horizontal_layout_1.addWidget(self.config_button)
         
         horizontal_layout_2.addWidget(self.table, stretch=1)
-        horizontal_layout_2.addWidget(self.dictionary, stretch=3)
+        horizontal_layout_2.addWidget(self.dictionary_area, stretch=3)
         
         layout.addLayout(horizontal_layout_1)
         layout.addLayout(horizontal_layout_2)
@@ -213,11 +304,72 @@ class MainWindow(QMainWindow):
         widget = QWidget()
         widget.setLayout(layout)
         self.setCentralWidget(widget)
+
+        self.match_data = []
+        self.incremental_search = IncrementalSearch()
+        self._lookup = None
+        self._lookup_id = 0
+        self._definitions = None # DefinitionsWorker of the headword being displayed
+        self._definitions_id = 0
+        self._search_text = None # term of the displayed matches, for fetching their next page
+        self._live_text = None
+        self._restore = None # snapshot of a reopened tab, until its matches are in
+        self._shown = False
+        self._pending_lookup = None # lookup of a tab that hasn't been shown yet
+        self._lookup_started = None # perf_counter of the running lookup and of the page being loaded, for instrumentation
+        self._page_started = None
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        # Tabs opened in the background stay placeholders without a web view or lookup until first shown
+        if self.dictionary is None:
+            self.attach_view()
+        else:
+            web_view_pool.touch(self.dictionary)
+        self._shown = True
+        if self._pending_lookup is not None:
+            lookup, self._pending_lookup = self._pending_lookup, None
+            self.start_lookup(*lookup)
+
+    def attach_view(self):
+        self.dictionary = web_view_pool.acquire(self)
+        self.dictionary.setFont(self._font)
+        self.dictionary.setHtml(self._page_html)
+        self.dictionary.loadFinished.connect(self.on_page_loaded)
+        self.dictionary_layout.addWidget(self.dictionary)
+        self.dictionary.show()
+        if self.dictionary.focusProxy() is not None:
+            self.dictionary.focusProxy().installEventFilter(self)
+
+    def detach_view(self):
+        # Hands the web view back to the pool, the page is set again from _page_html when the tab is shown
+        view, self.dictionary = self.dictionary, None
+        view.loadFinished.disconnect(self.on_page_loaded)
+        self._page_started = None
+        if view.focusProxy() is not None:
+            view.focusProxy().removeEventFilter(self)
+        self.dictionary_layout.removeWidget(view)
+        web_view_pool.release(view)
+
+    def set_page(self, html):
+        self._page_html = html
+        if self.dictionary is not None:
+            self._page_started = time.perf_counter()
+            with instrumentation.stage('setHtml'):
+                self.dictionary.setHtml(html)
+
+    @pyqtSlot(bool)
+    def on_page_loaded(self, ok):
+        # setHtml returns before the page is parsed and laid out by the renderer process
+        if self._page_started is not None and instrumentation.enabled:
+            instrumentation.record('page_load', (time.perf_counter() - self._page_started) * 1000)
+        self._page_started = None
         
     @pyqtSlot('QItemSelection', 'QItemSelection')
     def on_selectionChanged(self, selected, deselected):
-        for ix in selected.indexes():
-            self.dictionary.setHtml(generate_page_html(self.match_data[ix.row()]))
+        with instrumentation.stage('select_headword'):
+            for ix in selected.indexes():
+                self.show_definitions(self.match_data[ix.row()])
         
     def get_definitions(self, lookup_from_search_box=True, lookup_text=None):
         # Check if the search comes from querying through the search box or ctrl+d on selected text
@@ -225,33 +377,188 @@ class MainWindow(QMainWindow):
             search_text = self.search_box.text()
         else:
             search_text = lookup_text
-        self.match_data = get_definition(search_text)
-        
+        self.search_timer.stop()
+        self._restore = None
+        self.start_lookup_when_shown(search_text)
+
+    def search_as_you_type(self):
+        text = normalize_wildcards(self.search_box.text())
+        if not text:
+            return
+        self._restore = None
+        # Extending the previous text only needs the previous result set to be filtered
+        match_data = self.incremental_search.reuse(text)
+        # No prefix matches left may mean a conjugated word, which the lookup deinflects
+        if not match_data:
+            self.start_lookup(self.incremental_search.pattern(text), tab_text=text, live_text=text)
+            return
+        self.incremental_search.update(text, match_data)
+        self.cancel_lookup()
+        self.set_tab_text(text)
+        self._search_text = self.incremental_search.pattern(text)
+        self._live_text = text
+        self.show_matches(match_data, has_more=False)
+
+    def set_tab_text(self, text):
         if self.parent_tab:
-            self.parent_tab.setTabText(self.parent_tab.currentIndex(),search_text)
-            
+            self.parent_tab.setTabText(self.parent_tab.indexOf(self),text)
+
+    def cancel_lookup(self):
+        if self._lookup is not None:
+            self._lookup.cancel()
+            self._lookup = None
+        self._lookup_id += 1
+        self.model.fetching = False
+        self.busy_indicator.hide()
+
+    def start_lookup_when_shown(self, search_text, tab_text=None, live_text=None):
+        if self._shown:
+            self.start_lookup(search_text, tab_text, live_text)
+        else:
+            self._pending_lookup = (search_text, tab_text, live_text)
+
+    def start_lookup(self, search_text, tab_text=None, live_text=None):
+        self.set_tab_text(search_text if tab_text is None else tab_text)
+
+        # A newer search supersedes the one still running in this tab
+        self.cancel_lookup()
+        self._lookup_started = time.perf_counter()
+        self._lookup = LookupWorker(self._lookup_id, search_text, live_text)
+        self._lookup.signals.finished.connect(self.on_lookup_finished)
+        self.busy_indicator.show()
+        QThreadPool.globalInstance().start(self._lookup)
+
+    @pyqtSlot(int, object)
+    def on_lookup_finished(self, lookup_id, match_data):
+        if lookup_id != self._lookup_id:
+            return
+        lookup = self._lookup
+        if lookup.fallback:
+            # Dictionary forms aren't prefix matches, typing on has to look them up again
+            self.incremental_search.clear()
+        elif lookup.live_text is not None:
+            self.incremental_search.update(lookup.live_text, match_data)
+        self._lookup = None
+        self.busy_indicator.hide()
+        self._search_text = lookup.search_text
+        self._live_text = lookup.live_text
+        self.show_matches(match_data, has_more=not lookup.fallback and len(match_data) == HEADWORD_PAGE_SIZE)
+        # From starting the lookup to the matches and the first page being set
+        if instrumentation.enabled:
+            instrumentation.record('lookup', (time.perf_counter() - self._lookup_started) * 1000)
+
+    def fetch_more_matches(self):
+        # Called by the model when the table is scrolled to the end of the fetched rows
+        if self._search_text is None or not self.match_data:
+            self.model.fetching = False
+            return
+        self._lookup = LookupWorker(self._lookup_id, self._search_text, self._live_text, after=headword_key(self.match_data[-1]))
+        self._lookup.signals.finished.connect(self.on_page_finished)
+        QThreadPool.globalInstance().start(self._lookup)
+
+    @pyqtSlot(int, object)
+    def on_page_finished(self, lookup_id, page):
+        if lookup_id != self._lookup_id:
+            return
+        if self._live_text is not None:
+            self.incremental_search.extend(self._live_text, page)
+        self._lookup = None
+        self.match_data = self.match_data + page
+        self.model.append_matches(page, has_more=len(page) == HEADWORD_PAGE_SIZE)
+        self.restore_position()
+
+    def show_matches(self, match_data, has_more=False):
+        self.match_data = match_data
+
         # Display first result upon finding matches (if any)
         try:
             if self.match_data:
-                self.dictionary.setHtml(generate_page_html(self.match_data[0]))
+                self.show_definitions(self.match_data[0])
             else:
-                self.dictionary.setHtml(generate_page_html(None))
-            self.model._data = [[f"{i.expression} 【{i.reading}】"] if i.reading else [f"{i.expression}"] for i in self.match_data]
-            self.model.layoutChanged.emit()
+                self.cancel_definitions()
+                self.set_page(generate_page_html(None))
+            self.model.set_matches(self.match_data, has_more)
             self.table.selectRow(0)
+            self.restore_position()
         except Exception as e:
             print(e)
 
+    def show_definitions(self, headword):
+        # Definitions are only fetched for the headword being displayed, on a thread pool thread unless
+        # they are still cached, so selecting rows quickly never waits on a query
+        self.cancel_definitions()
+        entry = cached_entry_definitions(headword.entry_ids)
+        if entry is not None:
+            self.set_page(generate_page_html(entry))
+            return
+        self._definitions = DefinitionsWorker(self._definitions_id, headword.entry_ids)
+        self._definitions.signals.finished.connect(self.on_definitions_finished)
+        QThreadPool.globalInstance().start(self._definitions)
+
+    def cancel_definitions(self):
+        if self._definitions is not None:
+            self._definitions.cancel()
+            self._definitions = None
+        self._definitions_id += 1
+
+    @pyqtSlot(int, object)
+    def on_definitions_finished(self, definitions_id, entry):
+        if definitions_id != self._definitions_id:
+            return
+        self._definitions = None
+        self.set_page(generate_page_html(entry))
+
     def eventFilter(self, source, event):
-        if source is self.dictionary.focusProxy() and event.type() == QEvent.Type.KeyPress:
-            if event.modifiers() == Qt.KeyboardModifier.ControlModifier:
+        if self.dictionary is not None and source is self.dictionary.focusProxy() and event.type() == QEvent.Type.KeyPress:
+            # Ctrl+D looks up the selected text in a new tab, Ctrl+Shift+D opens it in the background
+            background = event.modifiers() == Qt.KeyboardModifier.ControlModifier | Qt.KeyboardModifier.ShiftModifier
+            if event.modifiers() == Qt.KeyboardModifier.ControlModifier or background:
                 if event.key() == Qt.Key.Key_D:
                     text = self.dictionary.selectedText()
-                    tab_idx = self.parent_tab._addTab(text, True, self.parent_tab.currentIndex()+1)
+                    tab_idx = self.parent_tab._addTab(text, True, self.parent_tab.currentIndex()+1, background)
                     self.parent_tab.widget(tab_idx).get_definitions(lookup_from_search_box=False, lookup_text=text)
                     self.parent_tab.widget(tab_idx).search_box.setText(text)
         return super().eventFilter(source, event)
     
+    def tab_closed(self):
+        self.cancel_lookup()
+        self.cancel_definitions()
+        self.search_box.cancel_ocr()
+        if self.dictionary is not None:
+            self.detach_view()
+
+    def snapshot(self):
+        # Enough to rebuild the tab after it has been closed, see ShrinkTabWidget._reopenTab
+        search_text, _, live_text = self._pending_lookup or (self._search_text, None, self._live_text)
+        return {
+            "search_box": self.search_box.text(),
+            "search_text": search_text,
+            "live_text": live_text,
+            "row": self.table.currentIndex().row(),
+            "scroll": self.table.verticalScrollBar().value(),
+        }
+
+    def restore(self, snapshot):
+        self.search_box.setText(snapshot["search_box"])
+        if snapshot["search_text"] is None:
+            return
+        self._restore = snapshot
+        live_text = snapshot["live_text"]
+        self.start_lookup_when_shown(snapshot["search_text"], tab_text=live_text, live_text=live_text)
+
+    def restore_position(self):
+        # Selects the row a reopened tab was on, fetching pages until it is reached
+        snapshot = self._restore
+        if snapshot is None:
+            return
+        if snapshot["row"] >= len(self.match_data) and self.model.canFetchMore(QModelIndex()):
+            self.model.fetchMore(QModelIndex())
+            return
+        self._restore = None
+        if 0 <= snapshot["row"] < len(self.match_data):
+            self.table.selectRow(snapshot["row"])
+        self.table.verticalScrollBar().setValue(snapshot["scroll"])
+
     def config_window(self):
         self.w = ConfigWindow()
         self.w.show()
@@ -284,10 +591,45 @@ class MatchTable(QTableView):
                     self.lookup.emit(text)
         return super().eventFilter(source, event)
 
+def match_row(headword):
+    text = f"{headword.expression} 【{headword.reading}】" if headword.reading else f"{headword.expression}"
+    # Deinflected matches show the inflections that were undone
+    reasons = getattr(headword, 'reasons', None)
+    if reasons:
+        text += " « " + " « ".join(reasons)
+    return [text]
+
 class MatchTableModel(QAbstractTableModel):
+    """Matches are fetched a page at a time, the view asks for the next one through fetchMore when it is scrolled to the end"""
+    fetch_requested = pyqtSignal()
+
     def __init__(self, data=[]):
         super().__init__()
         self._data = data
+        self.has_more = False
+        self.fetching = False
+
+    def set_matches(self, match_data, has_more):
+        self.beginResetModel()
+        self._data = [match_row(i) for i in match_data]
+        self.has_more = has_more
+        self.fetching = False
+        self.endResetModel()
+
+    def append_matches(self, match_data, has_more):
+        self.fetching = False
+        self.has_more = has_more
+        if match_data:
+            self.beginInsertRows(QModelIndex(), len(self._data), len(self._data) + len(match_data) - 1)
+            self._data.extend(match_row(i) for i in match_data)
+            self.endInsertRows()
+
+    def canFetchMore(self, parent):
+        return self.has_more and not self.fetching and not parent.isValid()
+
+    def fetchMore(self, parent):
+        self.fetching = True
+        self.fetch_requested.emit()
 
     def data(self, index, role=Qt.ItemDataRole.DisplayRole):
         if index.isValid():
@@ -317,7 +659,7 @@ class MatchTableModel(QAbstractTableModel):
         return Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsEnabled
 
 if __name__ == "__main__":
-    manga_ocr = MangaOcr()
+    manga_ocr = OcrWorker(cache=OcrCache() if OCR_CACHE else None)
     app = QApplication(sys.argv)
     window = MainWindow(manga_ocr)
     window.show()
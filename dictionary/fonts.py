@@ -0,0 +1,10 @@
+from functools import lru_cache
+from PyQt6.QtGui import QFontDatabase
+
+FONT_PATH = "font/NotoSansJP-Regular.otf"
+
+@lru_cache(maxsize=None)
+def font_family():
+    # Every call to addApplicationFont loads the font file again, so it is only registered once per application
+    _id = QFontDatabase.addApplicationFont(FONT_PATH)
+    return QFontDatabase.applicationFontFamilies(_id)[0]
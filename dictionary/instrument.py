@@ -0,0 +1,139 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+## Opt-in lookup latency instrumentation. When enabled, the lookup stages (queries, decoding the definitions' JSON,
+## rendering and setting the page) are timed into rolling histograms, and queries slower than SLOW_QUERY_MS are logged
+## with their EXPLAIN QUERY PLAN. Off by default, set INSTRUMENTATION = True or turn it on in the debug window
+## (Ctrl+Shift+I). Disabled, a stage costs a single attribute check.
+INSTRUMENTATION = False
+HISTOGRAM_WINDOW = 1000 # most recent samples kept per stage
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000) # upper bounds in ms, the last bucket is everything above
+SLOW_QUERY_MS = 50
+SLOW_QUERY_LOG = 50 # most recent slow queries kept
+
+def percentile(values, p):
+    # The value below which a fraction p of values fall, used by the benchmarks too
+    values = sorted(values)
+    return values[min(len(values)-1, int(len(values)*p))]
+
+class LatencyHistogram:
+    """Rolling window of the most recent latencies of a stage, in ms"""
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0 # since the last reset, including samples that left the window
+        self.total = 0.0
+
+    def add(self, ms):
+        self.samples.append(ms)
+        self.count += 1
+        self.total += ms
+
+    def buckets(self):
+        counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for i in self.samples:
+            counts[bisect_left(HISTOGRAM_BUCKETS, i)] += 1
+        return counts
+
+    def summary(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {'count': self.count}
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count,
+            'p50_ms': percentile(samples, 0.5),
+            'p95_ms': percentile(samples, 0.95),
+            'p99_ms': percentile(samples, 0.99),
+            'max_ms': samples[-1],
+            'buckets': self.buckets(),
+        }
+
+class Instrumentation:
+    """Stage timers, latency histograms and the slow query log, shared by every thread"""
+    def __init__(self, enabled=INSTRUMENTATION, slow_query_ms=SLOW_QUERY_MS):
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self.histograms = {}
+        self.slow_queries = deque(maxlen=SLOW_QUERY_LOG)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, stage, ms):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram()
+            histogram.add(ms)
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def timed(self, name):
+        # Decorator version of stage, checks enabled on every call so it can be switched on at runtime
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self.stage(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def accumulate(self, name, ms):
+        # Time spent in many small calls (e.g. decoding each row) on this thread, collected with take
+        totals = getattr(self._local, 'totals', None)
+        if totals is None:
+            totals = self._local.totals = {}
+        totals[name] = totals.get(name, 0.0) + ms
+
+    def take(self, name):
+        totals = getattr(self._local, 'totals', None)
+        return totals.pop(name, 0.0) if totals else 0.0
+
+    def log_slow_query(self, stage, ms, sql, params, plan, details=None):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'stage': stage,
+            'ms': ms,
+            'sql': sql,
+            'params': [str(i) for i in params],
+            'plan': plan,
+            **(details or {}),
+        }
+        with self._lock:
+            self.slow_queries.append(entry)
+        print(f"Slow query in {stage} ({ms:.1f} ms):\n" + '\n'.join(f"  {i}" for i in plan))
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.slow_queries.clear()
+
+    def summary(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'buckets_ms': list(HISTOGRAM_BUCKETS),
+                'stages': {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+                'slow_queries': list(self.slow_queries),
+            }
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), **self.summary()}, f, ensure_ascii=False, indent=2)
+
+instrumentation = Instrumentation()
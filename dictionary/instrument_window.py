@@ -0,0 +1,124 @@
+from PyQt6.QtWidgets import (
+    QMainWindow,
+    QWidget,
+    QVBoxLayout,
+    QHBoxLayout,
+    QCheckBox,
+    QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QPlainTextEdit,
+    QHeaderView,
+    QFileDialog,
+    QLabel,
+)
+from PyQt6.QtCore import Qt, QTimer
+from dictionary.instrument import instrumentation, HISTOGRAM_BUCKETS
+
+## Refresh interval of the debug window in ms
+REFRESH_INTERVAL = 1000
+
+SUMMARY_COLUMNS = ('count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+
+class InstrumentationWindow(QMainWindow):
+    """Debug window with the lookup stage latencies and the slow query log, see dictionary.instrument"""
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("Lookup instrumentation")
+        self.resize(900, 600)
+
+        self.enabled_box = QCheckBox("Instrumentation enabled", self)
+        self.enabled_box.setChecked(instrumentation.enabled)
+        self.enabled_box.toggled.connect(self.set_enabled)
+        self.reset_button = QPushButton("Reset", self)
+        self.reset_button.clicked.connect(self.reset_button_clicked)
+        self.save_button = QPushButton("Save to file", self)
+        self.save_button.clicked.connect(self.save_button_clicked)
+        self.status = QLabel(self)
+
+        headers = ['Stage', 'Count', 'Mean', 'p50', 'p95', 'p99', 'Max']
+        headers += [f"≤{i}" for i in HISTOGRAM_BUCKETS] + [f">{HISTOGRAM_BUCKETS[-1]}"]
+        self.stages_table = QTableWidget(0, len(headers), self)
+        self.stages_table.setHorizontalHeaderLabels(headers)
+        self.stages_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.stages_table.verticalHeader().hide()
+        self.stages_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+
+        self.slow_queries = QPlainTextEdit(self)
+        self.slow_queries.setReadOnly(True)
+        self.slow_queries.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+
+        layout = QVBoxLayout()
+        layout.setSpacing(2)
+
+        horizontal_layout = QHBoxLayout()
+        horizontal_layout.addWidget(self.enabled_box)
+        horizontal_layout.addWidget(self.status, stretch=1)
+        horizontal_layout.addWidget(self.reset_button)
+        horizontal_layout.addWidget(self.save_button)
+
+        layout.addLayout(horizontal_layout)
+        layout.addWidget(QLabel("Latency per stage (ms) and the number of recent samples per bucket"))
+        layout.addWidget(self.stages_table, stretch=2)
+        layout.addWidget(QLabel(f"Queries slower than {instrumentation.slow_query_ms} ms"))
+        layout.addWidget(self.slow_queries, stretch=1)
+
+        widget = QWidget()
+        widget.setLayout(layout)
+        self.setCentralWidget(widget)
+
+        self.refresh_timer = QTimer(self, interval=REFRESH_INTERVAL)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+        self.refresh_timer.start()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.refresh_timer.stop()
+
+    def set_enabled(self, enabled):
+        instrumentation.enabled = enabled
+        self.refresh()
+
+    def reset_button_clicked(self):
+        instrumentation.reset()
+        self.refresh()
+
+    def save_button_clicked(self):
+        file_name, _ = QFileDialog.getSaveFileName(self, "Save instrumentation", "instrumentation.json", "json (*.json)")
+        if file_name:
+            try:
+                instrumentation.dump(file_name)
+                self.status.setText(f"Saved to {file_name}")
+            except OSError as e:
+                print(e)
+                self.status.setText(f"Couldn't save: {e}")
+
+    def refresh(self):
+        summary = instrumentation.summary()
+        stages = summary['stages']
+        self.stages_table.setRowCount(len(stages))
+        for row, (name, stage) in enumerate(stages.items()):
+            values = [stage.get(i) for i in SUMMARY_COLUMNS] + stage.get('buckets', [])
+            self.stages_table.setItem(row, 0, QTableWidgetItem(name))
+            for column, value in enumerate(values, 1):
+                text = '' if value is None else f"{value:.2f}" if isinstance(value, float) else str(value)
+                item = QTableWidgetItem(text)
+                item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                self.stages_table.setItem(row, column, item)
+
+        lines = []
+        for query in reversed(summary['slow_queries']):
+            details = ' '.join(f"{key}={query[key]}" for key in ('term', 'route', 'shard', 'rows') if key in query)
+            lines.append(f"{query['time']}  {query['stage']}  {query['ms']:.1f} ms  {details}")
+            if 'fts_match_ms' in query:
+                lines.append(f"  FTS match alone: {query['fts_match_ms']:.1f} ms, {query['fts_candidates']} candidates")
+            lines += [f"  {i}" for i in query['plan']]
+            lines.append('')
+        text = '\n'.join(lines)
+        if text != self.slow_queries.toPlainText():
+            self.slow_queries.setPlainText(text)
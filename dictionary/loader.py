@@ -1,31 +1,344 @@
+import copy
+import heapq
+import io
 import json
+import os
+import pathlib
+import shutil
+import sqlite3
+import threading
+import time
+import unicodedata
 import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from peewee import (
     IntegrityError,
+    OperationalError,
     Model,
     SqliteDatabase,
     AutoField,
     TextField,
     BooleanField,
     IntegerField,
+    BlobField,
     ForeignKeyField,
+    CompositeKey,
     SQL,
+    Select,
+    ModelObjectCursorWrapper,
     fn,
+    Tuple,
+    Case,
     chunked,
 )
 from playhouse.sqlite_ext import JSONField, SearchField, FTS5Model, RowIDField
 import re
+import ujson
+import zlib
+from functools import lru_cache
 from sqlitefts import fts5
-from itertools import combinations
+from itertools import combinations, count
+from dictionary.instrument import instrumentation
 
-db = SqliteDatabase('dictionary_fts.db',autoconnect=True)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class DictionaryDatabase(SqliteDatabase):
+    """SqliteDatabase that registers the FTS5 tokenizers and search_key once on every connection it opens
+
+    A thread that borrowed a ConnectionSet (see lend_connections) connects with its connection to the database instead.
+    """
+    def _add_conn_hooks(self, conn):
+        super()._add_conn_hooks(conn)
+        register_connection_tokenizers(conn)
+        conn.create_function('search_key', 1, search_key, deterministic=True)
+
+    @property
+    def path(self):
+        return database_file(self.database)
+
+    def open_connection(self):
+        return super()._connect()
+
+    def _connect(self):
+        lent = getattr(_thread_state, 'lent', None)
+        if lent is not None:
+            return lent.get(self)
+        conn = self.open_connection()
+        opened_connections()[conn] = self
+        return conn
+
+    def _close(self, conn):
+        lent = getattr(_thread_state, 'lent', None)
+        if lent is not None and lent.owns(conn):
+            return # stays open in the set
+        opened_connections().pop(conn, None)
+        super()._close(conn)
+
+class ShardDatabase(DictionaryDatabase):
+    """Database of the entries of one dictionary (see shards), with the catalog attached to every connection so
+    queries can join Dictionary. Opened in the catalog's mode, and never created unless create is set."""
+    def __init__(self, path, catalog, create=False):
+        self._path = path
+        self.catalog = catalog
+        mode = catalog.database.split('?', 1)[1] if catalog.database.startswith('file:') and '?' in catalog.database else None
+        mode = mode or ('mode=rwc' if create else 'mode=rw')
+        super().__init__(
+            f'{pathlib.Path(path).absolute().as_uri()}?{mode}',
+            autoconnect=True,
+            timeout=catalog.timeout,
+            **{**catalog.connect_params, 'uri': True}
+        )
+
+    @property
+    def path(self):
+        return self._path
+
+    def _add_conn_hooks(self, conn):
+        super()._add_conn_hooks(conn)
+        conn.execute('ATTACH DATABASE ? AS catalog', (self.catalog.database,))
+
+db = DictionaryDatabase('dictionary_fts.db',autoconnect=True)
+
+## Storage layout: db is the catalog (the Dictionary table), and the entries of every imported dictionary (Entry,
+## EntryFTS, EntryKey and GlossaryCodec) are in a shard of their own, dictionary_fts.shards/<dictionary id>.db, so
+## importing a dictionary doesn't touch the others and removing one deletes its file. Every shard is a ShardDatabase
+## the queries are run on explicitly (query.execute(shard), or compiled once and run with shard.execute_sql), and
+## lookups merge the results of every shard in headword order. Joining a UNION ALL view over attached shards would
+## make SQLite materialize the whole view, and only 10 databases can be attached to a connection.
+## Entry ids are unique across shards, a shard's start at its dictionary id << SHARD_ID_BITS.
+## Databases created before shards existed keep their entries in the catalog, which is then queried as a shard
+## too, until migrate_to_shards moves them out.
+SHARD_ID_BITS = 32
+
+def database_file(database=None):
+    # Path of a database, also for the file: URIs read-only connections use
+    database = database or db.database
+    if database.startswith('file:'):
+        database = database[len('file:'):].split('?', 1)[0]
+    return database
+
+def shard_directory(database=None):
+    return os.path.splitext(database_file(database))[0] + '.shards'
+
+def shard_path(dictionary_id):
+    return os.path.join(shard_directory(), f'{dictionary_id}.db')
+
+def first_entry_id(dictionary_id):
+    return dictionary_id << SHARD_ID_BITS
+
+_thread_state = threading.local()
+
+def opened_connections():
+    # The connections this thread opened and the database of each, see ThreadConnections
+    connections = getattr(_thread_state, 'opened', None)
+    if connections is None:
+        connections = _thread_state.opened = {}
+    return connections
+
+def close_connections():
+    # Closes the connections this thread opened, e.g. before a thread of its own ends
+    for database in set(opened_connections().values()):
+        database.close()
+
+class ConnectionSet:
+    """A connection to the catalog and to every shard, opened on first use, lent to one thread at a time"""
+    def __init__(self):
+        self.connections = {}
+
+    def get(self, database):
+        conn = self.connections.get(database)
+        if conn is None:
+            conn = self.connections[database] = database.open_connection()
+        return conn
+
+    def owns(self, conn):
+        return any(i is conn for i in self.connections.values())
+
+    def prune(self):
+        # Closes the connections to shards that were removed since
+        for database in list(self.connections):
+            if isinstance(database, ShardDatabase) and database not in _shard_list:
+                self.connections.pop(database).close()
+
+    def close(self):
+        for conn in self.connections.values():
+            conn.close()
+        self.connections.clear()
+
+@contextmanager
+def lend_connections(connections):
+    # Until the block ends, the databases this thread connects to use the connections of a ConnectionSet
+    _thread_state.lent = connections
+    try:
+        yield connections
+    finally:
+        for database in list(connections.connections):
+            database.close() # only unbinds it from this thread, see DictionaryDatabase._close
+        _thread_state.lent = None
+        connections.prune()
+
+## The shards are listed from the catalog, which is checked on every lookup (catalog_generation) so dictionaries
+## imported, removed or reordered by another process are noticed too
+_shard_lock = threading.Lock()
+_shard_signature = None
+_shard_list = ()
+_shard_databases = {}
+
+def catalog_signature():
+    # Changes with every import, removal or priority change, and when migrate_to_shards drops the catalog's entries
+    version, = db.execute_sql('PRAGMA schema_version').fetchone()
+    exists = db.execute_sql("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (Dictionary._meta.table_name,)).fetchone()
+    rows = db.execute_sql('SELECT id, title, revision, priority FROM dictionary ORDER BY id').fetchall() if exists else []
+    return db.database, version, tuple(rows)
+
+def shards():
+    # Every database with entries (the catalog of an older database, then a ShardDatabase per dictionary), in dictionary id order
+    global _shard_signature, _shard_list
+    signature = catalog_signature()
+    if signature != _shard_signature:
+        with _shard_lock:
+            if signature != _shard_signature:
+                if _shard_signature is not None:
+                    bump_generation()
+                databases = [db] if has_entries() else []
+                for dictionary_id, title, revision, _ in signature[2]:
+                    path = shard_path(dictionary_id)
+                    key = (db.database, path, title, revision)
+                    if key not in _shard_databases:
+                        _shard_databases[key] = ShardDatabase(path, db)
+                    if os.path.exists(path):
+                        databases.append(_shard_databases[key])
+                for key in [i for i, shard in _shard_databases.items() if shard not in databases]:
+                    del _shard_databases[key]
+                _shard_list = tuple(databases)
+                _shard_signature = signature
+    if getattr(_thread_state, 'shards', None) is not _shard_list:
+        # This thread's connections to removed shards are closed once it sees them gone
+        _thread_state.shards = _shard_list
+        for conn, database in list(opened_connections().items()):
+            if isinstance(database, ShardDatabase) and database not in _shard_list and not database.in_transaction():
+                database.close()
+    return _shard_list
+
+def catalog_generation():
+    # The generation lookups cache their results with, after checking the catalog for changes
+    shards()
+    return _generation
+
+def each_shard(function, *args):
+    # function(shard, *args) for every shard, one after another. A shard removed by another process since the catalog
+    # was read is skipped.
+    results = []
+    for shard in shards():
+        try:
+            results.append(function(shard, *args))
+        except OperationalError:
+            if shard is db or os.path.exists(shard.path):
+                raise
+    return results
+
+def shard_rows(query):
+    # The rows of a query over Entry from every shard
+    return [row for rows in each_shard(lambda shard: list(query.clone().execute(shard))) for row in rows]
+
+def dictionary_shard(dictionary_id):
+    # The catalog holds the entries of dictionaries imported before shards existed. Uses the shards as of the last
+    # lookup, which are the ones the results being displayed came from.
+    path = shard_path(dictionary_id)
+    for shard in _shard_list or shards():
+        if shard is not db and shard.path == path:
+            return shard
+    return db
+
+def entry_shard(entry_id):
+    dictionary_id = entry_id >> SHARD_ID_BITS
+    return dictionary_shard(dictionary_id) if dictionary_id else db
+
+def create_shard(dictionary_id):
+    # A leftover file of a removed dictionary with the same id is replaced
+    path = shard_path(dictionary_id)
+    os.makedirs(shard_directory(), exist_ok=True)
+    delete_shard(path, quiet=False)
+    return ShardDatabase(path, db, create=True)
+
+def delete_shard(path, quiet=True):
+    # Other threads' connections to it are closed once they see it gone (see shards), on Windows the file
+    # can't be deleted while they are open and is removed by remove_orphan_shards later instead
+    for conn, database in list(opened_connections().items()):
+        if isinstance(database, ShardDatabase) and database.path == path:
+            database.close()
+    for name in (path, path + '-journal', path + '-wal', path + '-shm'):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            if not quiet:
+                raise
+            print(f"Couldn't delete {name}, it will be deleted after the next import: {e}")
+
+def remove_orphan_shards():
+    # Deletes the shards of dictionaries that are no longer in the catalog
+    if not os.path.isdir(shard_directory()):
+        return
+    ids = {str(i) for i, in Dictionary.select(Dictionary.id).tuples()} if Dictionary.table_exists() else set()
+    for name in os.listdir(shard_directory()):
+        if name.endswith('.db') and name[:-len('.db')] not in ids:
+            delete_shard(os.path.join(shard_directory(), name))
+
+def database_size():
+    # Bytes on disk of the catalog and its shards
+    paths = [database_file()]
+    if os.path.isdir(shard_directory()):
+        paths += [os.path.join(shard_directory(), i) for i in os.listdir(shard_directory())]
+    return sum(os.path.getsize(i) for i in paths if os.path.exists(i))
+
+def copy_database(path, target):
+    # Copies a catalog together with its shards
+    shutil.copy(path, target)
+    if os.path.isdir(shard_directory(path)):
+        shutil.copytree(shard_directory(path), shard_directory(target), dirs_exist_ok=True)
+
+def schema(model, database):
+    # model's schema manager on another database than the one it's bound to, e.g. to create its table in a shard
+    return type(model._schema)(model, database)
+
+class ThreadConnections:
+    """The connections of the thread that created it, including the ones it opens later, for other threads to interrupt"""
+    def __init__(self):
+        self.connections = opened_connections()
+
+    def interrupt(self):
+        for conn in list(self.connections):
+            try:
+                conn.interrupt()
+            except sqlite3.ProgrammingError:
+                pass # closed in the meantime
+
+## EntryFTS index modes and the FTS5 tokenizer backing each of them
+## substring: every substring of the text (legacy, O(n^2) tokens per string)
+## ngram: uni/bi/trigrams only, longer query tokens are split into overlapping trigrams
+## trigram: SQLite's built-in trigram tokenizer (query tokens shorter than 3 characters can't use the index)
+FTS_TOKENIZERS = {
+    'substring': 'simple_tokenizer',
+    'ngram': 'ngram_tokenizer',
+    'trigram': 'trigram',
+}
+FTS_INDEX_MODE = 'ngram' # used when creating a new EntryFTS table
+NGRAM_SIZE = 3
 
 class SimpleTokenizer(fts5.FTS5Tokenizer):
     def __init__(self, **kwargs):
         self.tokenize_flag = kwargs.get('tokenize_flag', True)
 
     def tokenize(self, text, flags=None):
-        if not self.tokenize_flag:
+        # Query strings are never split, only documents are
+        if not self.tokenize_flag or (flags is not None and flags & fts5.FTS5_TOKENIZE_QUERY):
             yield text, 0, len(text.encode('utf-8'))
         else:
             length = len(text) + 1
@@ -35,161 +348,1266 @@ class SimpleTokenizer(fts5.FTS5Tokenizer):
                 p = len(text[:s].encode('utf-8'))
                 yield t, p, p + l
 
-def register_tokenizer(db, tokenize_flag=True):
-    tk = fts5.make_fts5_tokenizer(SimpleTokenizer(tokenize_flag=tokenize_flag))
-    conn = db.connection()
+class NgramTokenizer(fts5.FTS5Tokenizer):
+    def __init__(self, **kwargs):
+        self.tokenize_flag = kwargs.get('tokenize_flag', True)
+        self.n = kwargs.get('n', NGRAM_SIZE)
+
+    def tokenize(self, text, flags=None):
+        if not self.tokenize_flag or (flags is not None and flags & fts5.FTS5_TOKENIZE_QUERY):
+            yield text, 0, len(text.encode('utf-8'))
+        else:
+            offsets = [0]
+            for c in text:
+                offsets.append(offsets[-1] + len(c.encode('utf-8')))
+            length = len(text)
+            for s in range(length):
+                for e in range(s+1, min(s+self.n, length)+1):
+                    yield text[s:e], offsets[s], offsets[e]
+
+def register_connection_tokenizers(conn, tokenize_flag=True):
     conn.enable_load_extension(True)
+    tk = fts5.make_fts5_tokenizer(SimpleTokenizer(tokenize_flag=tokenize_flag))
     fts5.register_tokenizer(conn, 'simple_tokenizer', tk)
+    tk = fts5.make_fts5_tokenizer(NgramTokenizer(tokenize_flag=tokenize_flag))
+    fts5.register_tokenizer(conn, 'ngram_tokenizer', tk)
+
+def register_tokenizer(db, tokenize_flag=True):
+    # Connections opened by DictionaryDatabase already have the tokenizers, this is for other databases
+    register_connection_tokenizers(db.connection(), tokenize_flag)
+
+def get_fts_index_mode(database=None):
+    # Returns the index mode of the existing EntryFTS table of database, or None if it hasn't been created yet.
+    # By default that's the catalog's, or the first shard's for a catalog without entries (new shards get the same).
+    if database is None:
+        if not has_entries():
+            modes = each_shard(get_fts_index_mode)
+            return modes[0] if modes else None
+        database = db
+    row = database.execute_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (EntryFTS._meta.table_name,)
+    ).fetchone()
+    if row is None:
+        return None
+    tokenizer = re.search(r"tokenize\s*=\s*'?\"?(\w+)", row[0])
+    for mode, name in FTS_TOKENIZERS.items():
+        if tokenizer and tokenizer.group(1) == name:
+            return mode
+    return 'substring'
+
+def new_shard_fts_index_mode():
+    # New and migrated shards are indexed like the existing ones (e.g. after migrate_fts_index('trigram')), except
+    # with the legacy substring index of older databases, which is only kept for reading their catalog
+    index_mode = get_fts_index_mode()
+    return index_mode if index_mode and index_mode != 'substring' else FTS_INDEX_MODE
+
+def set_fts_index_mode(index_mode):
+    if index_mode not in FTS_TOKENIZERS:
+        raise ValueError(f"Unknown FTS index mode {index_mode!r}, expected one of {list(FTS_TOKENIZERS)}")
+    EntryFTS._meta.options = {'tokenize': FTS_TOKENIZERS[index_mode]}
+
+def fts_query_tokens(tokens, index_mode):
+    # Turns the non-wildcard parts of a search term into the tokens that are looked up in EntryFTS
+    out = []
+    for token in tokens:
+        if index_mode == 'ngram' and len(token) > NGRAM_SIZE:
+            grams = [token[i:i+NGRAM_SIZE] for i in range(len(token)-NGRAM_SIZE+1)]
+        elif index_mode == 'trigram' and len(token) < 3:
+            grams = []
+        else:
+            grams = [token]
+        out.extend(g for g in grams if g not in out)
+    return out
+
+def fts_match_expression(tokens):
+    return ' AND '.join('"{}"'.format(t.replace('"','""')) for t in tokens)
+
+def rebuild_fts_index(database):
+    with database.atomic():
+        schema(EntryFTS, database).drop_all()
+        schema(EntryFTS, database).create_all()
+        query = Entry.select(Entry.id, Entry.expression, Entry.reading)
+        EntryFTS.insert_from(query, EntryFTS._meta.fields.keys()).execute(database)
+    database.execute_sql('VACUUM')
+
+def migrate_fts_index(index_mode=FTS_INDEX_MODE):
+    # Rebuilds EntryFTS of every shard with a different tokenizer, e.g. to move a dictionary_fts.db created
+    # with the substring tokenizer over to the much smaller ngram index
+    db.connect(reuse_if_open=True)
+    set_fts_index_mode(index_mode)
+    start = time.perf_counter()
+    each_shard(rebuild_fts_index)
+    elapsed = time.perf_counter() - start
+    print(f"Rebuilt EntryFTS with {index_mode=} in {elapsed:.1f}s")
+    if db.database != ':memory:':
+        print(f"Database size: {database_size()/2**20:.1f} MiB")
+    return elapsed
+
+## Column order of a term in Yomichan's term_bank_*.json files
+YOMICHAN_FIELDS = ('expression', 'reading', 'definition_tags', 'rules', 'score', 'glossary', 'sequence', 'term_tags')
+
+ENTRY_BATCH_SIZE = 100
+
+def yomichan_export_to_row(dictionary_id, d):
+    # Entry row in the order of Entry.insert_fields()
+    return (dictionary_id, *d[:len(YOMICHAN_FIELDS)], d[0][::-1], d[1][::-1])
+
+_json_separators = re.compile(r'[\s,]*')
+
+def iter_json_array(f, chunk_size=2**16):
+    # Yields the elements of the JSON array in a binary file object one at a time, so only
+    # a chunk of the file and the element being decoded are held in memory
+    decoder = json.JSONDecoder()
+    reader = io.TextIOWrapper(f, encoding='utf-8-sig')
+    buffer = reader.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError("Expected a JSON array")
+    pos = 1
+    eof = False
+    while True:
+        pos = _json_separators.match(buffer, pos).end()
+        if pos < len(buffer):
+            if buffer[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                # An element running up to the end of the buffer (e.g. a number) might continue in the next chunk
+                if end < len(buffer) or eof:
+                    yield item
+                    pos = end
+                    continue
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+        elif eof:
+            raise ValueError("Unexpected end of JSON array")
+        chunk = reader.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+def migrate_reversed_keys():
+    # Adds and fills the reversed key columns used for suffix lookups in databases created before they existed
+    db.connect(reuse_if_open=True)
+    if not has_entries() or has_reversed_keys():
+        return
+    print("Adding reversed keys to Entry table")
+    db.connection().create_function('reverse', 1, lambda s: s[::-1] if s is not None else None, deterministic=True)
+    with db.atomic():
+        db.execute_sql('ALTER TABLE entry ADD COLUMN expression_reversed TEXT')
+        db.execute_sql('ALTER TABLE entry ADD COLUMN reading_reversed TEXT')
+        db.execute_sql('UPDATE entry SET expression_reversed = reverse(expression), reading_reversed = reverse(reading)')
+        Entry._schema.create_indexes()
+    _entry_columns.cache_clear()
+
+def migrate_glossary_blobs():
+    db.connect(reuse_if_open=True)
+    if not has_entries():
+        return
+    db.create_tables([GlossaryCodec])
+    if 'glossary_blob' in entry_columns():
+        return
+    db.execute_sql('ALTER TABLE entry ADD COLUMN glossary_blob BLOB')
+    _entry_columns.cache_clear()
+
+## Exact lookups seek a single index of search keys (EntryKey), one row per distinct key of an entry's expression and
+## reading. The keys fold the ways the same word can be written: NFKC (half-width katakana, full-width latin), katakana
+## to hiragana, a long vowel mark after kana to the vowel it lengthens and lower case, so ラーメン, ﾗｰﾒﾝ, らーめん and
+## らあめん all find each other.
+KATAKANA_TO_HIRAGANA = {i: i - 0x60 for i in range(ord('ァ'), ord('ヶ') + 1)}
+VOWEL_ROWS = {
+    'あ': 'あかがさざただなはばぱまやらわぁゃゎゕ',
+    'い': 'いきぎしじちぢにひびぴみりぃゐ',
+    'う': 'うくぐすずつづぬふぶぷむゆるぅゅゔ',
+    'え': 'えけげせぜてでねへべぺめれぇゑゖ',
+    'お': 'おこごそぞとどのほぼぽもよろをぉょ',
+}
+LONG_VOWELS = {kana: vowel for vowel, row in VOWEL_ROWS.items() for kana in row}
+
+def search_key(text):
+    if not text:
+        return text
+    text = unicodedata.normalize('NFKC', text).lower().translate(KATAKANA_TO_HIRAGANA)
+    if 'ー' in text:
+        chars = list(text)
+        for i in range(1, len(chars)):
+            if chars[i] == 'ー':
+                chars[i] = LONG_VOWELS.get(chars[i-1], 'ー')
+        text = ''.join(chars)
+    return text
 
-def yomichan_export_to_dict(d):
-    return dict(zip(Entry._meta.sorted_field_names[2:],d))
+@lru_cache(maxsize=None)
+def _tables(database):
+    return frozenset(database.get_tables())
 
-def load_dictionary(path='dictionary_files/daijirin.zip'):
+def has_entries(database=db):
+    # False for a catalog whose dictionaries are all in shards
+    return Entry._meta.table_name in _tables(database)
+
+def has_entry_keys(database=db):
+    return EntryKey._meta.table_name in _tables(database)
+
+def insert_entry_keys(*dictionary_ids, database=db):
+    # search_key is registered on every connection, so SQLite computes the keys while copying the rows
+    def keys(column):
+        return Entry\
+            .select(fn.search_key(column), Entry.id)\
+            .where((Entry.dictionary_id << list(dictionary_ids)) & (column != ''))
+    EntryKey.insert_from(keys(Entry.expression) | keys(Entry.reading), [EntryKey.key, EntryKey.entry_id]).execute(database)
+
+def migrate_entry_keys():
+    # Builds the search keys of databases created before they existed
+    db.connect(reuse_if_open=True)
+    if not has_entries() or has_entry_keys():
+        return
+    dictionary_ids = [i for i, in Dictionary.select(Dictionary.id).tuples()] if Dictionary.table_exists() else []
+    with db.atomic():
+        db.create_tables([EntryKey])
+        if dictionary_ids:
+            print("Building search keys")
+            insert_entry_keys(*dictionary_ids)
+    _tables.cache_clear()
+
+def create_dictionary(z):
+    with z.open("index.json", mode="r") as f:
+        dictionary = Dictionary(**json.load(f))
+        dictionary.save()
+        
+        # After inserting, set the priority to be last (same as the insert row id)
+        dictionary_id = dictionary.get_id()
+        print(f"Loaded dictionary with {dictionary_id=}")
+        q = Dictionary.\
+            update({Dictionary.priority: dictionary_id}).\
+            where(Dictionary.id == dictionary_id)
+        q.execute()
+    return dictionary_id
+
+class ImportCancelled(Exception):
+    pass
+
+def create_shard_tables(shard):
+    # Entry's secondary indexes are built by build_shard_indexes once all rows are in
+    schema(Entry, shard).create_table()
+    for model in (EntryFTS, EntryKey, GlossaryCodec):
+        schema(model, shard).create_all()
+
+def build_shard_indexes(shard, *dictionary_ids):
+    schema(Entry, shard).create_indexes()
+    query = Entry\
+        .select(
+            Entry.id,
+            Entry.expression,
+            Entry.reading,
+         ).where(
+            Entry.dictionary_id << list(dictionary_ids)
+         )
+    EntryFTS.insert_from(query, EntryFTS._meta.fields.keys()).execute(shard)
+    insert_entry_keys(*dictionary_ids, database=shard)
+
+def load_dictionary(path='dictionary_files/daijirin.zip', progress=None, cancel=None):
+    # progress(stage, done, total, rows, rows_per_second) is called after every term bank and before
+    # building the search index, setting cancel (a threading.Event) rolls back the whole import.
+    # The entries go into a new shard, the catalog only gets the Dictionary row.
+    dictionary_id = None
+    shard = None
+    imported = False
     try:
         with db:
-            #db.connect(reuse_if_open=True)
-            register_tokenizer(db)
-            db.create_tables([Dictionary, Entry, EntryFTS])
-            
+            index_mode = new_shard_fts_index_mode()
+            db.create_tables([Dictionary])
+            remove_orphan_shards()
+
             with zipfile.ZipFile(path) as z:
-                with z.open("index.json", mode="r") as f:
-                    dictionary = Dictionary(**json.load(f))
-                    dictionary.save()
-                    
-                    # After inserting, set the priority to be last (same as the insert row id)
-                    dictionary_id = dictionary.get_id()
-                    print(f"Loaded dictionary with {dictionary_id=}")
-                    q = Dictionary.\
-                        update({Dictionary.priority: dictionary_id}).\
-                        where(Dictionary.id == dictionary_id)
-                    q.execute()
-                ## Insert Entry data
-                print("Inserting data into Entry table")
-                for filename in z.namelist():
-                    if filename.startswith("term_bank_"):
+                dictionary_id = create_dictionary(z)
+                shard = create_shard(dictionary_id)
+                with shard.atomic():
+                    set_fts_index_mode(index_mode)
+                    create_shard_tables(shard)
+
+                    ## Insert Entry data
+                    print("Inserting data into Entry table")
+                    filenames = [i for i in z.namelist() if i.startswith("term_bank_")]
+                    fields = [Entry.id, *Entry.insert_fields()]
+                    entry_ids = count(first_entry_id(dictionary_id))
+                    start = time.perf_counter()
+                    inserted = 0
+                    for done, filename in enumerate(filenames, 1):
                         with z.open(filename, mode="r") as f:
-                            data = json.load(f)
-                            data = [{"dictionary_id": dictionary.id, **yomichan_export_to_dict(i)} for i in data]
-                            with db.atomic():
-                                for batch in chunked(data, 100):
-                                    Entry.insert_many(batch, list(Entry._meta.fields.keys())[1:]).execute()
+                            rows = ((next(entry_ids), *yomichan_export_to_row(dictionary_id, i)) for i in iter_json_array(f))
+                            with shard.atomic():
+                                for batch in chunked(rows, ENTRY_BATCH_SIZE):
+                                    if cancel is not None and cancel.is_set():
+                                        raise ImportCancelled(path)
+                                    Entry.insert_many(batch, fields).execute(shard)
+                                    inserted += len(batch)
                         print(filename)
-    
-                ## Insert EntryFTS data
-                print("Inserting data into EntryFTS table")
-                query = Entry\
-                    .select(
-                        Entry.id,
-                        Entry.expression,
-                        Entry.reading,
-                     ).where(
-                        Entry.dictionary_id == dictionary_id
-                     )
-                EntryFTS.insert_from(query, EntryFTS._meta.fields.keys()).execute()
+                        if progress:
+                            elapsed = time.perf_counter() - start
+                            progress(filename, done, len(filenames), inserted, inserted / elapsed if elapsed else 0.0)
+
+                    ## Build the indexes, EntryFTS and the search keys
+                    print("Building Entry indexes, EntryFTS and search keys")
+                    if progress:
+                        progress("Building search index", 0, 0, inserted, 0.0)
+                    start = time.perf_counter()
+                    build_shard_indexes(shard, dictionary_id)
+                    print(f"Built indexes, EntryFTS and search keys in {time.perf_counter() - start:.1f}s")
+                    if GLOSSARY_STORAGE == 'compressed':
+                        compress_dictionary_glossaries(shard, dictionary_id)
+                    if cancel is not None and cancel.is_set():
+                        raise ImportCancelled(path)
+        imported = True
     except IntegrityError as e:
         if str(e).startswith("UNIQUE constraint failed"):
             print("Dictionary has already been loaded.")
+            dictionary_id = None
         else:
             raise
     finally:
+        if shard is not None:
+            shard.close()
+            if not imported:
+                delete_shard(shard.path)
         db.close()
+        bump_generation()
+    return dictionary_id
 
-def remove_dictionary(*dictionary_ids):
+## Bulk loading: term banks are parsed by a process pool and written by this process in large batches,
+## with the secondary indexes and EntryFTS of each shard built once all its rows are in
+BULK_BATCH_SIZE = 20000
+BULK_LOAD_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -256000, # KiB
+    'temp_store': 'memory',
+}
+
+def shape_term_bank(path, filename, dictionary_id):
+    # Runs in a worker process, returns the Entry rows of one term bank ready for executemany
+    glossary = YOMICHAN_FIELDS.index('glossary') + 1
+    with zipfile.ZipFile(path) as z:
+        with z.open(filename, mode="r") as f:
+            rows = []
+            for i in iter_json_array(f):
+                row = list(yomichan_export_to_row(dictionary_id, i))
+                row[glossary] = json.dumps(row[glossary]) # stored through json(), same as JSONField
+                rows.append(row)
+    return filename, rows
+
+@contextmanager
+def bulk_load_pragmas(shard):
+    # Only on the main database, a shard's connection has the catalog attached
+    saved = {key: shard.pragma(key, schema='main') for key in BULK_LOAD_PRAGMAS}
+    for key, value in BULK_LOAD_PRAGMAS.items():
+        shard.pragma(key, value, schema='main')
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            shard.pragma(key, value, schema='main')
+
+def insert_entry_rows(shard, rows, entry_ids):
+    fields = [Entry.id, *Entry.insert_fields()]
+    columns = ', '.join(f.column_name for f in fields)
+    placeholders = ', '.join('json(?)' if f is Entry.glossary else '?' for f in fields)
+    sql = f'INSERT INTO {Entry._meta.table_name} ({columns}) VALUES ({placeholders})'
+    for batch in chunked(rows, BULK_BATCH_SIZE):
+        shard.connection().executemany(sql, [(next(entry_ids), *row) for row in batch])
+
+def bulk_load_dictionaries(*paths, processes=None):
+    start = time.perf_counter()
+    processes = processes or os.cpu_count()
+    dictionary_ids = []
+    try:
+        db.connect(reuse_if_open=True)
+        index_mode = new_shard_fts_index_mode()
+        db.create_tables([Dictionary])
+        remove_orphan_shards()
+
+        with ProcessPoolExecutor(processes) as executor:
+            for path in paths:
+                shard = None
+                try:
+                    with db.atomic():
+                        with zipfile.ZipFile(path) as z:
+                            dictionary_id = create_dictionary(z)
+                            filenames = [i for i in z.namelist() if i.startswith("term_bank_")]
+                        shard = create_shard(dictionary_id)
+
+                        with bulk_load_pragmas(shard):
+                            set_fts_index_mode(index_mode)
+                            with shard.atomic():
+                                create_shard_tables(shard)
+
+                                ## Keep a bounded number of parsed term banks in flight so memory stays flat
+                                print(f"Inserting data into Entry table from {path}")
+                                entry_ids = count(first_entry_id(dictionary_id))
+                                pending = deque()
+                                for filename in filenames:
+                                    pending.append(executor.submit(shape_term_bank, path, filename, dictionary_id))
+                                    while len(pending) >= 2 * processes or (pending and filename == filenames[-1]):
+                                        done, rows = pending.popleft().result()
+                                        insert_entry_rows(shard, rows, entry_ids)
+                                        print(done)
+
+                                print("Building Entry indexes, EntryFTS and search keys")
+                                build_shard_indexes(shard, dictionary_id)
+                                if GLOSSARY_STORAGE == 'compressed':
+                                    compress_dictionary_glossaries(shard, dictionary_id)
+                        shard.close()
+                except BaseException as e:
+                    if shard is not None:
+                        shard.close()
+                        delete_shard(shard.path)
+                    if isinstance(e, IntegrityError) and str(e).startswith("UNIQUE constraint failed"):
+                        print(f"{path} has already been loaded.")
+                        continue
+                    raise
+                dictionary_ids.append(dictionary_id)
+    finally:
+        db.close()
+        bump_generation()
+    print(f"Loaded {len(dictionary_ids)} dictionaries in {time.perf_counter() - start:.1f}s")
+    return dictionary_ids
+
+## Glossaries can be stored as compressed blobs in Entry.glossary_blob instead of JSON text,
+## using zstd (if the zstandard package is installed) or zlib with a dictionary trained per Yomichan dictionary
+GLOSSARY_STORAGE = 'json' # or 'compressed', for newly imported dictionaries
+GLOSSARY_DICT_SIZE = 32 * 2**10
+GLOSSARY_ZLIB_DICT_SIZE = 4 * 2**10 # zlib reloads its dictionary for every glossary, so it is kept small
+GLOSSARY_SAMPLES = 5000
+GLOSSARY_SEPARATOR = '\x1f'
+GLOSSARY_BLOB_BATCH_SIZE = 500 # ids per query fetching the compressed glossaries of a lookup
+
+class Codec:
+    def __init__(self, codec, zdict):
+        self.codec = codec
+        self.zdict = zdict
+        if codec == 'zstd':
+            dict_data = zstandard.ZstdCompressionDict(zdict) if zdict else None
+            self._compressor = zstandard.ZstdCompressor(level=19, dict_data=dict_data)
+            self._decompressor = zstandard.ZstdDecompressor(dict_data=dict_data)
+            self._lock = threading.Lock()
+
+    @classmethod
+    def train(cls, samples):
+        if zstandard is not None:
+            try:
+                return cls('zstd', zstandard.train_dictionary(GLOSSARY_DICT_SIZE, samples).as_bytes())
+            except zstandard.ZstdError:
+                return cls('zstd', b'') # too few samples to train on
+        # zlib matches against the end of its preset dictionary first, so it is filled with sample text
+        return cls('zlib', b''.join(samples)[-GLOSSARY_ZLIB_DICT_SIZE:])
+
+    def compress(self, data):
+        if self.codec == 'zstd':
+            with self._lock:
+                return self._compressor.compress(data)
+        compressor = zlib.compressobj(9, zdict=self.zdict) if self.zdict else zlib.compressobj(9)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        if self.codec == 'zstd':
+            with self._lock:
+                return self._decompressor.decompress(data)
+        decompressor = zlib.decompressobj(zdict=self.zdict) if self.zdict else zlib.decompressobj()
+        return decompressor.decompress(data) + decompressor.flush()
+
+def glossary_payload(glossary):
+    # Lists of plain strings (nearly every glossary) are joined so decoding doesn't need a JSON parser
+    if glossary and all(isinstance(i, str) and GLOSSARY_SEPARATOR not in i for i in glossary):
+        return b'S', GLOSSARY_SEPARATOR.join(glossary).encode('utf-8')
+    return b'J', json.dumps(glossary, ensure_ascii=False).encode('utf-8')
+
+def encode_glossary(codec, glossary):
+    kind, payload = glossary_payload(glossary)
+    return kind + codec.compress(payload)
+
+def decode_glossary(codec, blob):
+    text = codec.decompress(blob[1:]).decode('utf-8')
+    if blob[:1] == b'S':
+        return text.split(GLOSSARY_SEPARATOR)
+    return ujson.loads(text)
+
+@lru_cache(maxsize=None)
+def _get_codec(database, dictionary_id):
+    row = GlossaryCodec.select().where(GlossaryCodec.dictionary_id == dictionary_id).get(database)
+    return Codec(row.codec, row.zdict)
+
+def get_codec(dictionary_id):
+    return _get_codec(dictionary_shard(dictionary_id), dictionary_id)
+
+def glossary_of(definition):
+    # The glossary of a definition returned by get_definition, decompressed or parsed from JSON
+    blob = definition.get('glossary_blob')
+    if blob:
+        return decode_glossary(get_codec(definition['dictionary_id']), blob)
+    return ujson.loads(definition['glossary'])
+
+def shard_dictionaries(dictionary_ids):
+    # The given dictionaries (all of them if none are given) grouped by the shard holding their entries
+    db.connect(reuse_if_open=True)
+    if not dictionary_ids:
+        dictionary_ids = [i for i, in Dictionary.select(Dictionary.id).tuples()]
+    by_shard = {}
     for dictionary_id in dictionary_ids:
-        q = Dictionary.delete().where(Dictionary.id == dictionary_id)
+        by_shard.setdefault(dictionary_shard(dictionary_id), []).append(dictionary_id)
+    return by_shard.items()
+
+def compress_dictionary_glossaries(database, dictionary_id, batch_size=5000):
+    # database is the shard of the dictionary (or the catalog), see compress_glossaries
+    pending = (Entry.dictionary_id == dictionary_id) & Entry.glossary_blob.is_null()
+    with database.atomic():
+        codec = GlossaryCodec.select().where(GlossaryCodec.dictionary_id == dictionary_id).first(database)
+        if codec is None:
+            samples = Entry.select(Entry.glossary).where(pending).order_by(fn.random()).limit(GLOSSARY_SAMPLES).execute(database)
+            codec = Codec.train([glossary_payload(i.glossary)[1] for i in samples])
+            GlossaryCodec.insert(dictionary_id=dictionary_id, codec=codec.codec, zdict=codec.zdict).execute(database)
+            _get_codec.cache_clear()
+        else:
+            codec = _get_codec(database, dictionary_id)
+
+        ## Entries are rewritten in id order, one batch at a time
+        last_id = 0
+        while True:
+            batch = list(Entry.select(Entry.id, Entry.glossary).where(pending & (Entry.id > last_id)).order_by(Entry.id).limit(batch_size).execute(database))
+            if not batch:
+                break
+            database.connection().executemany(
+                "UPDATE entry SET glossary = 'null', glossary_blob = ? WHERE id = ?",
+                [(encode_glossary(codec, i.glossary), i.id) for i in batch]
+            )
+            last_id = batch[-1].id
+    print(f"Compressed glossaries of {dictionary_id=} with {codec.codec}")
+
+def compress_glossaries(*dictionary_ids, batch_size=5000):
+    # Moves the glossaries of the given dictionaries (all of them by default) into compressed blobs
+    migrate_glossary_blobs()
+    for database, ids in shard_dictionaries(dictionary_ids):
+        for dictionary_id in ids:
+            compress_dictionary_glossaries(database, dictionary_id, batch_size)
+    bump_generation()
+
+def decompress_glossaries(*dictionary_ids, batch_size=5000):
+    # Moves compressed glossaries back into Entry.glossary as JSON
+    for database, ids in shard_dictionaries(dictionary_ids):
+        if 'glossary_blob' not in entry_columns(database):
+            continue
+        for dictionary_id in ids:
+            if GlossaryCodec.select().where(GlossaryCodec.dictionary_id == dictionary_id).first(database) is None:
+                continue
+            codec = _get_codec(database, dictionary_id)
+            with database.atomic():
+                while True:
+                    batch = list(
+                        Entry.select(Entry.id, Entry.glossary_blob)
+                        .where((Entry.dictionary_id == dictionary_id) & Entry.glossary_blob.is_null(False))
+                        .limit(batch_size)
+                        .tuples()
+                        .execute(database)
+                    )
+                    if not batch:
+                        break
+                    database.connection().executemany(
+                        "UPDATE entry SET glossary = json(?), glossary_blob = NULL WHERE id = ?",
+                        [(json.dumps(decode_glossary(codec, bytes(blob))), i) for i, blob in batch]
+                    )
+                GlossaryCodec.delete().where(GlossaryCodec.dictionary_id == dictionary_id).execute(database)
+            print(f"Decompressed glossaries of {dictionary_id=}")
+    _get_codec.cache_clear()
+    bump_generation()
+
+def remove_catalog_entries(dictionary_id):
+    # Entries of a dictionary imported before shards existed, which are in the catalog.
+    # Deleting from EntryFTS re-tokenizes the stored rows, so the tokenizers must be registered (db does it on connect)
+    q = EntryFTS.delete().where(EntryFTS.rowid << Entry.select(Entry.id).where(Entry.dictionary_id == dictionary_id))
+    q.execute()
+
+    if has_entry_keys():
+        q = EntryKey.delete().where(EntryKey.entry_id << Entry.select(Entry.id).where(Entry.dictionary_id == dictionary_id))
         q.execute()
 
-        q = EntryFTS.delete().where(EntryFTS.rowid << Entry.select(Entry.id).where(Entry.dictionary_id == dictionary_id))
-        q.execute()        
+    q = Entry.delete().where(Entry.dictionary_id == dictionary_id)
+    q.execute()
 
-        q = Entry.delete().where(Entry.dictionary_id == dictionary_id)
+    if GlossaryCodec.table_exists():
+        q = GlossaryCodec.delete().where(GlossaryCodec.dictionary_id == dictionary_id)
         q.execute()
 
+def remove_dictionary(*dictionary_ids):
+    # Deletes the catalog rows first, a shard whose file can't be deleted is then only an orphan (see remove_orphan_shards)
+    db.connect(reuse_if_open=True)
+    removed = []
+    for dictionary_id in dictionary_ids:
+        shard = dictionary_shard(dictionary_id)
+        q = Dictionary.delete().where(Dictionary.id == dictionary_id)
+        q.execute()
+        if shard is db:
+            if has_entries():
+                remove_catalog_entries(dictionary_id)
+        else:
+            removed.append(shard.path)
+    bump_generation()
+    for path in removed:
+        delete_shard(path)
+
 def remove_all_dictionaries():
+    db.connect(reuse_if_open=True)
     q = Dictionary.delete()
     q.execute()
-    
-    q = Entry.delete()
-    q.execute()
-    
-    q = EntryFTS.delete()
-    q.execute()
+
+    if has_entries():
+        q = Entry.delete()
+        q.execute()
+        
+        q = EntryFTS.delete()
+        q.execute()
+
+        if has_entry_keys():
+            q = EntryKey.delete()
+            q.execute()
+
+        if GlossaryCodec.table_exists():
+            q = GlossaryCodec.delete()
+            q.execute()
+    bump_generation()
+    remove_orphan_shards()
+
+def migrate_to_shards():
+    # Moves the dictionaries of a database created before shards existed out of the catalog into a shard each.
+    # The rows are copied through the catalog attached to the shard's connection, with their ids moved into the
+    # shard's range, then the catalog's Entry tables are dropped.
+    db.connect(reuse_if_open=True)
+    if not has_entries():
+        return
+    index_mode = new_shard_fts_index_mode()
+    migrate_reversed_keys()
+    migrate_glossary_blobs()
+    fields = [Entry.id, *Entry.insert_fields(), Entry.glossary_blob]
+    columns = ', '.join(f.column_name for f in fields)
+    values = ', '.join(['id + ?'] + [f.column_name for f in fields[1:]])
+    # Dictionaries imported since are in shards already
+    dictionary_ids = [i for i, in Entry.select(Entry.dictionary_id).distinct().tuples()]
+    for dictionary_id in dictionary_ids:
+        start = time.perf_counter()
+        shard = create_shard(dictionary_id)
+        try:
+            set_fts_index_mode(index_mode)
+            with shard.atomic():
+                create_shard_tables(shard)
+                shard.execute_sql(
+                    f'INSERT INTO main.entry ({columns}) SELECT {values} FROM catalog.entry WHERE dictionary_id = ?',
+                    (first_entry_id(dictionary_id), dictionary_id)
+                )
+                shard.execute_sql('INSERT INTO main.glossary_codec SELECT * FROM catalog.glossary_codec WHERE dictionary_id = ?', (dictionary_id,))
+                build_shard_indexes(shard, dictionary_id)
+        except BaseException:
+            shard.close()
+            delete_shard(shard.path)
+            raise
+        shard.close()
+        print(f"Moved {dictionary_id=} into {shard.path} in {time.perf_counter() - start:.1f}s")
+    with db.atomic():
+        db.drop_tables([EntryKey, EntryFTS, GlossaryCodec, Entry])
+    db.execute_sql('VACUUM')
+    bump_generation()
 
 def update_dictionary_priority(dictionary_id, new_priority):
     q = Dictionary.update({Dictionary.priority: new_priority}).where(Dictionary.id == dictionary_id)
     q.execute()
+    bump_generation()
 
-def get_definition(term, max_return=300):
+## Lookup results are cached until the dictionaries change, which bumps the generation
+RESULT_CACHE_SIZE = 64 * 2**20 # approximate bytes
+_generation = 0
+_generation_lock = threading.Lock()
+
+def get_generation():
+    return _generation
+
+def bump_generation():
+    global _generation
+    with _generation_lock:
+        _generation += 1
+    result_cache.clear()
+    _entry_columns.cache_clear()
+    _entry_indexes.cache_clear()
+    _tables.cache_clear()
+    count_rows.cache_clear()
+    _get_codec.cache_clear()
+
+def estimate_size(match_data):
+    # Rough size of a result set, dominated by the glossary text of the definitions
+    if match_data is None:
+        return 0
+    if not isinstance(match_data, list):
+        match_data = [match_data]
+    size = 0
+    for i in match_data:
+        size += 100 + len(i.expression) + len(i.reading or '')
+        size += 8 * len(getattr(i, 'entry_ids', ()))
+        for definition in getattr(i, 'definitions', ()):
+            size += sum(len(v) if isinstance(v, str) else 8 for v in definition.values())
+    return size
+
+class ResultCache:
+    """LRU cache for lookup results, bounded by the estimated size of the cached results"""
+    def __init__(self, max_size=RESULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, generation, count_miss=True):
+        with self._lock:
+            item = self._data.get((generation, key))
+            if item is None:
+                self.misses += count_miss
+                return None
+            self._data.move_to_end((generation, key))
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, generation, value):
+        size = estimate_size(value)
+        with self._lock:
+            # Results of a query that raced with a dictionary change are not cached
+            if generation != _generation or size > self.max_size or (generation, key) in self._data:
+                return
+            self._data[(generation, key)] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._data),
+                'size': self.size,
+                'max_size': self.max_size,
+            }
+
+result_cache = ResultCache()
+
+def normalize_wildcards(term):
+    return term.replace('％','%').replace('＿','_')
+
+def prefix_range(field, prefix):
+    # Every string starting with prefix sorts in [prefix, prefix with its last character incremented)
+    if ord(prefix[-1]) >= 0x10FFFF:
+        return field >= prefix
+    return (field >= prefix) & (field < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+@lru_cache(maxsize=None)
+def _entry_columns(database):
+    return frozenset(c.name for c in database.get_columns(Entry._meta.table_name))
+
+def entry_columns(database=db):
+    # Columns of the Entry table, which depend on the migrations that have been applied to the database
+    return _entry_columns(database)
+
+def has_reversed_keys(database=db):
+    return {'expression_reversed', 'reading_reversed'} <= entry_columns(database)
+
+## Headwords are listed by length, with expression and reading breaking ties so the order is total
+## and results can be paged through with the last key of the previous page (keyset pagination)
+HEADWORD_PAGE_SIZE = 100
+HEADWORD_ORDER_INDEX = 'entry_length_expression_reading'
+ORDERED_SCAN_THRESHOLD = 2000 # candidates above which walking the order index beats sorting them
+
+def headword_order():
+    return (fn.length(Entry.expression), Entry.expression, Entry.reading)
+
+def headword_key(headword):
+    # Key of a result row in headword_order, pass the last one as after to get the next page
+    return (len(headword.expression), headword.expression, headword.reading)
+
+def merge_headwords(pages, max_return, field):
+    # Merges the results of every shard in headword order, rows of the same headword in several shards are
+    # combined into a new row with the field (definitions or entry_ids) of each of them. The rows of the pages
+    # are left as they are, they may be cached or shared by several terms (see exact_definitions).
+    if len(pages) == 1:
+        return pages[0]
+    merged = {}
+    combined = set()
+    for row in heapq.merge(*pages, key=headword_key):
+        key = headword_key(row)
+        if key in merged:
+            if key not in combined:
+                merged[key] = copy.copy(merged[key])
+                setattr(merged[key], field, list(getattr(merged[key], field)))
+                combined.add(key)
+            getattr(merged[key], field).extend(getattr(row, field))
+        elif len(merged) < max_return:
+            merged[key] = row
+        else:
+            break
+    return list(merged.values())
+
+def after_key(query, after):
+    if after is None:
+        return query
+    # The bound on the length alone lets SQLite seek into the order index
+    return query.where(
+        (fn.length(Entry.expression) >= after[0]) &
+        (Tuple(*headword_order()) > Tuple(*after))
+    )
+
+@lru_cache(maxsize=None)
+def _entry_indexes(database):
+    return frozenset(i.name for i in database.get_indexes(Entry._meta.table_name))
+
+def has_headword_order_index(database=db):
+    return HEADWORD_ORDER_INDEX in _entry_indexes(database)
+
+def migrate_headword_order_index():
+    # Databases created before the order index existed get it by calling this, shards are created with it
     db.connect(reuse_if_open=True)
-    register_tokenizer(db, tokenize_flag=False)
-    term = term.replace('％','%').replace('＿','_')
-    _tokens = re.split('_|%',term)
-    tokens = [i for i in _tokens if i!='']
-
-    if len(_tokens) > 1:
-        result = Entry\
-            .select(
-                Entry.expression,
-                Entry.reading,
-                fn.json_group_array(
-                    fn.json_object(
-                  		'dictionary_id', Entry.dictionary_id,
-                        'dictionary_name', Dictionary.title,
-                        'dictionary_priority', Dictionary.priority,
-                        'definition_tags', Entry.definition_tags,
-                        'rules', Entry.rules,
-                        'score', Entry.score,
-                        'glossary', Entry.glossary,
-                        'sequence', Entry.sequence,
-                        'term_tags', Entry.term_tags
-                    )
-                ).python_value(json.loads).alias('definitions')
-            )\
-            .join(Dictionary, on=(Entry.dictionary_id==Dictionary.id))\
-            .join(EntryFTS, on=(Entry.id==EntryFTS.rowid))\
-            .where(
-                EntryFTS.match(' AND '.join(tokens)) &
-                ((Entry.expression ** term) | (Entry.reading ** term))
-            )\
-            .group_by(
-                Entry.expression,
-                Entry.reading
-            )\
-            .order_by(
-                fn.length(Entry.expression)
-            )\
-            .limit(max_return)
-        return result
-    result = Entry\
+    if not has_entries() or has_headword_order_index():
+        return
+    print("Building headword order index")
+    Entry._schema.create_indexes()
+    _entry_indexes.cache_clear()
+
+@lru_cache(maxsize=4096)
+def count_rows(database, sql, params):
+    # The candidate counts of prefer_ordered_scan, which the pages of a term and its get_definition and get_headwords
+    # lookups share until the dictionaries change
+    return database.execute_sql(sql, params).fetchone()[0]
+
+class QueryPlan:
+    """Chooses how a search term is looked up
+
+    kind is one of exact, prefix, suffix, infix, single_char (contains _) or wildcard (no literal characters),
+    route is one of search_key (seek on the normalized keys, see search_key), index (equality seek on the expression and
+    reading, for databases without search keys), prefix_range, reversed_range, fts, scan or ordered_scan
+    (walks the headword order index and stops once a page is full, see prefer_ordered_scan).
+    database is the shard the plan is for, compiled is shared by the plans of the same lookup on every shard, see execute.
+    """
+    def __init__(self, term, index_mode=None, reversed_keys=None, search_keys=None, compiled=None, database=db):
+        self.term = normalize_wildcards(term)
+        self.database = database
+        self.compiled = {} if compiled is None else compiled
+        parts = re.split('_|%', self.term)
+        self.tokens = [i for i in parts if i!='']
+        self.prefix = parts[0] if len(parts) > 1 else ''
+        self.suffix = parts[-1] if len(parts) > 1 else ''
+        self.fts_tokens = []
+
+        if len(parts) == 1:
+            self.kind = 'exact'
+        elif not self.tokens:
+            self.kind = 'wildcard'
+        elif '_' in self.term:
+            self.kind = 'single_char'
+        elif self.prefix:
+            self.kind = 'prefix'
+        elif self.suffix:
+            self.kind = 'suffix'
+        else:
+            self.kind = 'infix'
+
+        if self.kind == 'exact':
+            self.route = 'search_key' if (has_entry_keys(database) if search_keys is None else search_keys) else 'index'
+        elif self.prefix:
+            self.route = 'prefix_range'
+        elif self.suffix and (has_reversed_keys(database) if reversed_keys is None else reversed_keys):
+            self.route = 'reversed_range'
+        else:
+            index_mode = index_mode or get_fts_index_mode(database)
+            self.fts_tokens = fts_query_tokens(self.tokens, index_mode) if index_mode else []
+            self.route = 'fts' if self.fts_tokens else 'scan'
+
+    def candidates_match(self):
+        # True if every candidate of the route matches the term (up to the case of ASCII letters, which only adds
+        # matches), so the number of candidates is a lower bound on the number of matches
+        if self.route == 'prefix_range':
+            return self.term == self.prefix + '%'
+        if self.route == 'reversed_range':
+            return self.term == '%' + self.suffix
+        if self.route == 'fts':
+            return len(self.tokens) == 1 and self.fts_tokens == self.tokens and self.term == f'%{self.tokens[0]}%'
+        return False
+
+    def prefer_ordered_scan(self, threshold=ORDERED_SCAN_THRESHOLD):
+        # Sorting every candidate before returning the first page costs as much as the candidates, so terms with
+        # many matches walk the order index instead and only read rows until the page is full. That is only known for
+        # terms the candidates decide (see candidates_match): with any other literal (e.g. %あい%う) most candidates
+        # may fail LIKE, and the walk would read the whole index. A scan reads every row either way.
+        if self.route in ('search_key', 'index', 'ordered_scan') or not has_headword_order_index(self.database):
+            return self
+        if self.route == 'scan':
+            self.route = 'ordered_scan'
+        elif self.candidates_match():
+            candidates = self.apply_route(Entry.select(SQL('1'))).limit(threshold)
+            count = Select([candidates.alias('candidates')], [fn.COUNT(SQL('1'))])
+            if count_rows(self.database, *self.compile(count, 'candidates')) >= threshold:
+                self.route = 'ordered_scan'
+        return self
+
+    def compile(self, query, name):
+        # SQL and parameters of a query built with this plan. Shards with the same route and columns run the same SQL,
+        # which is compiled only once per lookup: peewee's compiler takes longer than most queries on a shard.
+        key = (name, self.route, tuple(self.fts_tokens), entry_columns(self.database))
+        if key not in self.compiled:
+            sql, params = query.sql()
+            self.compiled[key] = (sql, tuple(params))
+        return self.compiled[key]
+
+    def execute(self, query, name):
+        # Cursor over a query built with this plan, see compile
+        return self.database.execute_sql(*self.compile(query, name))
+
+    def apply_route(self, query):
+        # Adds the joins and filters of the chosen access path to a select over Entry
+        if self.route == 'prefix_range':
+            query = query.where(
+                prefix_range(Entry.expression, self.prefix) |
+                prefix_range(Entry.reading, self.prefix)
+            )
+        elif self.route == 'reversed_range':
+            query = query.where(
+                prefix_range(Entry.expression_reversed, self.suffix[::-1]) |
+                prefix_range(Entry.reading_reversed, self.suffix[::-1])
+            )
+        elif self.route == 'fts':
+            query = query\
+                .join(EntryFTS, on=(Entry.id==EntryFTS.rowid))\
+                .where(EntryFTS.match(fts_match_expression(self.fts_tokens)))
+        return query
+
+    def apply(self, query):
+        if self.route == 'search_key':
+            # An entry has a key only once, so the join doesn't repeat rows
+            return query\
+                .join_from(Entry, EntryKey, on=(EntryKey.entry_id == Entry.id))\
+                .where(EntryKey.key == search_key(self.term))
+        if self.route == 'index':
+            return query.where((Entry.expression==self.term) | (Entry.reading==self.term))
+        # The access paths only narrow down the candidates, LIKE does the actual matching
+        return self.apply_route(query).where((Entry.expression ** self.term) | (Entry.reading ** self.term))
+
+    def explain(self, query=None):
+        lines = [f"term={self.term!r} kind={self.kind} route={self.route}"]
+        if self.fts_tokens:
+            lines.append(f"fts match: {fts_match_expression(self.fts_tokens)}")
+        if query is not None:
+            sql, params = query.sql()
+            for row in self.database.execute_sql('EXPLAIN QUERY PLAN ' + sql, params):
+                lines.append(f"  {row[-1]}")
+        return '\n'.join(lines)
+
+def load_definitions(text):
+    if not instrumentation.enabled:
+        return json.loads(text)
+    start = time.perf_counter()
+    try:
+        return json.loads(text)
+    finally:
+        instrumentation.accumulate('json', (time.perf_counter() - start) * 1000)
+
+def fetch_rows(stage, query, plan=None, database=db):
+    # The rows of a select over Entry on the database of plan (or database), with instrumentation on its time is split
+    # into stage.query (SQLite, including the FTS match and the json_group_array aggregation) and stage.json
+    # (json.loads of the definitions), and slow queries are logged with their query plan. Only FTS matches are timed
+    # on their own, by running the match again for a slow query.
+    if plan is not None:
+        database = plan.database
+    def run():
+        cursor = plan.execute(query, stage) if plan is not None else database.execute(query)
+        return load_glossary_blobs(database, list(ModelObjectCursorWrapper(cursor, Entry, query.selected_columns, Entry)))
+    if not instrumentation.enabled:
+        return run()
+    instrumentation.take('json')
+    start = time.perf_counter()
+    rows = run()
+    elapsed = (time.perf_counter() - start) * 1000
+    decode = instrumentation.take('json')
+    instrumentation.record(stage + '.query', elapsed - decode)
+    if decode:
+        instrumentation.record(stage + '.json', decode)
+    if elapsed >= instrumentation.slow_query_ms:
+        sql, params = query.sql()
+        details = {'rows': len(rows), 'shard': os.path.basename(database.path)}
+        if plan is not None:
+            details.update(term=plan.term, kind=plan.kind, route=plan.route)
+            if plan.route == 'fts':
+                start = time.perf_counter()
+                details['fts_candidates'] = plan.apply_route(Entry.select(Entry.id)).count(database)
+                details['fts_match_ms'] = (time.perf_counter() - start) * 1000
+        query_plan = [row[-1] for row in database.execute_sql('EXPLAIN QUERY PLAN ' + sql, params)]
+        instrumentation.log_slow_query(stage, elapsed, sql, params, query_plan, details)
+    return rows
+
+def definitions_query(database=db):
+    # Compressed glossaries are only flagged (null for the others), see load_glossary_blobs
+    glossary_blob = ('glossary_blob', Case(None, [(Entry.glossary_blob.is_null(False), 1)])) if 'glossary_blob' in entry_columns(database) else ()
+    return Entry\
         .select(
             Entry.expression,
             Entry.reading,
             fn.json_group_array(
                 fn.json_object(
               		'dictionary_id', Entry.dictionary_id,
+                    'entry_id', Entry.id,
                     'dictionary_name', Dictionary.title,
                     'dictionary_priority', Dictionary.priority,
                     'definition_tags', Entry.definition_tags,
                     'rules', Entry.rules,
                     'score', Entry.score,
                     'glossary', Entry.glossary,
+                    *glossary_blob,
                     'sequence', Entry.sequence,
                     'term_tags', Entry.term_tags
                 )
-            ).python_value(json.loads).alias('definitions')
+            ).python_value(load_definitions).alias('definitions')
         )\
-        .join(Dictionary, on=(Entry.dictionary_id==Dictionary.id))\
-        .where((Entry.expression==term) | (Entry.reading==term))\
-        .group_by(
+        .join(Dictionary, on=(Entry.dictionary_id==Dictionary.id))
+
+def load_glossary_blobs(database, rows):
+    # Replaces the flags definitions_query leaves for compressed glossaries with their blobs, fetched by id with
+    # queries of their own since JSON can't hold them
+    compressed = {}
+    for row in rows:
+        for definition in getattr(row, 'definitions', ()):
+            if definition.get('glossary_blob'):
+                compressed[definition['entry_id']] = definition
+    for ids in chunked(list(compressed), GLOSSARY_BLOB_BATCH_SIZE):
+        query = Entry.select(Entry.id, Entry.glossary_blob).where(Entry.id << ids).tuples()
+        for entry_id, blob in query.execute(database):
+            compressed[entry_id]['glossary_blob'] = blob
+    return rows
+
+def definitions_select(term, max_return=300, plan=None, after=None):
+    plan = plan or QueryPlan(term).prefer_ordered_scan()
+    result = after_key(plan.apply(definitions_query(plan.database)), after)\
+        .group_by(*headword_order())\
+        .order_by(*headword_order())\
+        .limit(max_return)
+    return result
+
+@instrumentation.timed('get_definition')
+def get_definition(term, max_return=300):
+    key = ('definitions', normalize_wildcards(term), max_return)
+    generation = catalog_generation()
+    result = result_cache.get(key, generation)
+    if result is None:
+        compiled = {}
+        def lookup(shard):
+            plan = QueryPlan(term, compiled=compiled, database=shard).prefer_ordered_scan()
+            return fetch_rows('get_definition', definitions_select(term, max_return, plan=plan), plan)
+        result = merge_headwords(each_shard(lookup), max_return, 'definitions')
+        result_cache.put(key, generation, result)
+    return result
+
+def match_terms(database, terms):
+    # Condition matching the entries of database whose expression or reading is one of terms (none with wildcards),
+    # and a function returning the terms an expression or reading matches, in the order of terms. Through the search
+    # keys if the database has them, so a term also matches the other ways of writing it, like exact lookups.
+    if has_entry_keys(database):
+        terms_of = {}
+        for term in terms:
+            terms_of.setdefault(search_key(term), []).append(term)
+        # (a subquery rather than a join, an entry whose expression and reading have different keys may match both)
+        condition = Entry.id << EntryKey.select(EntryKey.entry_id).where(EntryKey.key << list(terms_of))
+        return condition, lambda text: terms_of.get(search_key(text), [])
+    terms = set(terms)
+    condition = (Entry.expression << list(terms)) | (Entry.reading << list(terms))
+    return condition, lambda text: [text] if text in terms else []
+
+def exact_definitions(shard, exact, max_return):
+    # get_definition of every term in exact (none with wildcards) with a single query on a shard
+    condition, terms_of = match_terms(shard, exact)
+    def row_terms(row):
+        # A headword belongs to every term its expression or its reading matches
+        return set(terms_of(row.expression)) | set(terms_of(row.reading))
+    query = definitions_query(shard)\
+        .where(condition)\
+        .group_by(*headword_order())\
+        .order_by(*headword_order())
+    matches = {term: [] for term in exact}
+    for row in load_glossary_blobs(shard, list(query.execute(shard))):
+        for term in row_terms(row):
+            if len(matches[term]) < max_return:
+                matches[term].append(row)
+    return matches
+
+def get_definitions(terms, max_return=300):
+    # get_definition for many terms at once, the ones without wildcards are looked up with a single query
+    generation = catalog_generation()
+    results = {}
+    exact = set()
+    for term in terms:
+        term = normalize_wildcards(term)
+        if term in results or term in exact:
+            continue
+        cached = result_cache.get(('definitions', term, max_return), generation)
+        if cached is not None:
+            results[term] = cached
+        elif '%' in term or '_' in term:
+            results[term] = get_definition(term, max_return)
+        else:
+            exact.add(term)
+    if exact:
+        pages = each_shard(exact_definitions, exact, max_return)
+        matches = {term: merge_headwords([i[term] for i in pages], max_return, 'definitions') for term in exact}
+        for term, result in matches.items():
+            result_cache.put(('definitions', term, max_return), generation, result)
+        results.update(matches)
+    return [results[normalize_wildcards(term)] for term in terms]
+
+## Two phase lookup: get_headwords only returns the matching headwords and the ids of their entries,
+## get_entry_definitions fetches the definitions of a single headword when it is displayed
+def parse_ids(ids):
+    return [int(i) for i in ids.split(',')]
+
+def headwords_select(term, max_return=300, plan=None, after=None):
+    plan = plan or QueryPlan(term).prefer_ordered_scan()
+    query = Entry\
+        .select(
             Entry.expression,
-            Entry.reading
-        )\
-        .order_by(
-            fn.length(Entry.expression)
-        )\
+            Entry.reading,
+            fn.group_concat(Entry.id).python_value(parse_ids).alias('entry_ids')
+        )
+    result = after_key(plan.apply(query), after)\
+        .group_by(*headword_order())\
+        .order_by(*headword_order())\
         .limit(max_return)
     return result
 
+@instrumentation.timed('get_headwords')
+def get_headwords(term, max_return=300, after=None):
+    # A page of max_return headwords, starting after the headword_key of the previous page's last row
+    key = ('headwords', normalize_wildcards(term), max_return, after)
+    generation = catalog_generation()
+    result = result_cache.get(key, generation)
+    if result is None:
+        compiled = {}
+        def lookup(shard):
+            plan = QueryPlan(term, compiled=compiled, database=shard).prefer_ordered_scan()
+            return fetch_rows('get_headwords', headwords_select(term, max_return, plan=plan, after=after), plan)
+        result = merge_headwords(each_shard(lookup), max_return, 'entry_ids')
+        result_cache.put(key, generation, result)
+    return result
+
+def cached_entry_definitions(entry_ids):
+    # get_entry_definitions if its result is cached, otherwise None (not counted as a miss, get_entry_definitions
+    # follows). Doesn't check the catalog, so it never touches the database.
+    return result_cache.get(('entries', tuple(entry_ids)), get_generation(), count_miss=False)
+
+@instrumentation.timed('get_entry_definitions')
+def get_entry_definitions(entry_ids):
+    # Same row as get_definition returns for a headword, for the entries of one get_headwords row
+    key = ('entries', tuple(entry_ids))
+    generation = catalog_generation()
+    result = result_cache.get(key, generation)
+    if result is None:
+        by_shard = {}
+        for entry_id in entry_ids:
+            by_shard.setdefault(entry_shard(entry_id), []).append(entry_id)
+        result = None
+        for shard, ids in by_shard.items():
+            query = definitions_query(shard)\
+                .where(Entry.id << ids)\
+                .group_by(
+                    Entry.expression,
+                    Entry.reading
+                )\
+                .limit(1)
+            rows = fetch_rows('get_entry_definitions', query, database=shard)
+            if rows and result is None:
+                result = rows[0]
+            elif rows:
+                result.definitions.extend(rows[0].definitions)
+        result_cache.put(key, generation, result)
+    return result
+
+def sort_definitions(definitions):
+    # Display order of a headword's definitions: by dictionary priority, then common (P) entries first
+    return sorted(definitions, key=lambda x: (x.get('dictionary_priority'), not x.get('term_tags').startswith('P ')))
+
+def like_to_regex(term):
+    # Same semantics as SQLite's LIKE: % and _ are wildcards and only ASCII letters are case insensitive
+    pattern = ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in term)
+    return re.compile(pattern, re.IGNORECASE | re.ASCII | re.DOTALL)
+
+def filter_matches(match_data, term):
+    regex = like_to_regex(normalize_wildcards(term))
+    return [i for i in match_data if regex.fullmatch(i.expression) or (i.reading and regex.fullmatch(i.reading))]
+
+class IncrementalSearch:
+    """Prefix search as you type
+
+    Typed text is looked up as text%. The matches of an extended text are a subset of the previous ones,
+    so as long as the previous result set wasn't cut off by max_return it is filtered in memory instead.
+    Pages fetched later with extend count towards the previous result set. reused counts the lookups
+    answered that way.
+    """
+    def __init__(self, max_return=HEADWORD_PAGE_SIZE):
+        self.max_return = max_return
+        self.text = None
+        self.match_data = None
+        self.complete = False
+        self.reused = 0
+
+    def pattern(self, text):
+        return normalize_wildcards(text) + '%'
+
+    def reuse(self, text):
+        # Returns the matches for text from the previous result set, or None if a query is needed
+        text = normalize_wildcards(text)
+        if self.match_data is None or not self.complete or not text.startswith(self.text):
+            return None
+        return filter_matches(self.match_data, self.pattern(text))
+
+    def update(self, text, match_data):
+        self.text = normalize_wildcards(text)
+        self.match_data = match_data
+        self.complete = len(match_data) < self.max_return
+
+    def clear(self):
+        self.text = None
+        self.match_data = None
+        self.complete = False
+
+    def extend(self, text, page):
+        if self.match_data is None or normalize_wildcards(text) != self.text:
+            return
+        self.match_data = self.match_data + page
+        self.complete = len(page) < self.max_return
+
+    def lookup(self, text):
+        match_data = self.reuse(text)
+        if match_data is None:
+            match_data = get_headwords(self.pattern(text), self.max_return)
+        else:
+            self.reused += 1
+        self.update(text, match_data)
+        return match_data
+
+def explain(term, max_return=300):
+    # Shows the route chosen for a search term on every shard together with SQLite's query plan
+    def shard_plan(shard):
+        plan = QueryPlan(term, database=shard).prefer_ordered_scan()
+        return f"{os.path.basename(shard.path)}: " + plan.explain(definitions_select(term, max_return, plan=plan))
+    return '\n'.join(each_shard(shard_plan))
+
 class Dictionary(Model):
     id = AutoField(unique=True)
     title = TextField()
@@ -214,6 +1632,14 @@ class Entry(Model):
     glossary = JSONField()
     sequence = IntegerField()
     term_tags = TextField()
+    expression_reversed = TextField(index=True, null=True) # for suffix lookups
+    reading_reversed = TextField(index=True, null=True)
+    glossary_blob = BlobField(null=True) # see compress_glossaries
+
+    @classmethod
+    def insert_fields(cls):
+        # Every field filled in on import, in definition order
+        return [cls._meta.fields[i] for i in cls._meta.sorted_field_names[1:] if i != 'glossary_blob']
 
     class Meta:
         database = db
@@ -222,6 +1648,27 @@ class Entry(Model):
             (('expression', 'reading'), False),
         )
 
+Entry.add_index(*headword_order(), name=HEADWORD_ORDER_INDEX)
+
+class GlossaryCodec(Model):
+    dictionary_id = ForeignKeyField(Dictionary, to_field="id", primary_key=True)
+    codec = TextField()
+    zdict = BlobField()
+
+    class Meta:
+        database = db
+        table_name = "glossary_codec"
+
+class EntryKey(Model):
+    key = TextField()
+    entry_id = ForeignKeyField(Entry, to_field="id")
+
+    class Meta:
+        database = db
+        table_name = "entry_key"
+        primary_key = CompositeKey('key', 'entry_id')
+        without_rowid = True
+
 class EntryFTS(FTS5Model):
     rowid = RowIDField()
     expression = SearchField()
@@ -233,8 +1680,10 @@ class EntryFTS(FTS5Model):
         options = {'tokenize': 'simple_tokenizer'}
         
 if __name__ == "__main__":
-    load_dictionary(path='dictionary_files/daijirin.zip')
-    load_dictionary(path='dictionary_files/daijisen.zip')
-    load_dictionary(path='dictionary_files/kojien.zip')
-    load_dictionary(path='dictionary_files/meikyou.zip')
-    load_dictionary(path='dictionary_files/jmdict.zip')
\ No newline at end of file
+    bulk_load_dictionaries(
+        'dictionary_files/daijirin.zip',
+        'dictionary_files/daijisen.zip',
+        'dictionary_files/kojien.zip',
+        'dictionary_files/meikyou.zip',
+        'dictionary_files/jmdict.zip',
+    )
\ No newline at end of file
@@ -0,0 +1,376 @@
+import hashlib
+import itertools
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from multiprocessing import get_context
+from peewee import Model, SqliteDatabase, TextField, IntegerField, FloatField, fn
+
+## Loading the OCR model (and importing torch) takes several seconds, so it is never done before the window is shown.
+## 'background' starts loading OCR_WARM_UP_DELAY ms after the window appears, 'on_paste' waits for the first pasted image.
+OCR_WARM_UP = 'background'
+OCR_WARM_UP_DELAY = 500
+
+## Images queued while the worker is busy are recognised together, up to OCR_BATCH_SIZE at a time
+OCR_BATCH_SIZE = 8
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+
+## Recognised text is cached by a hash of the image's pixels, so pasting the same region again is instant.
+## The least recently used results are evicted once their total size exceeds OCR_CACHE_SIZE bytes.
+## The cache is kept next to the dictionary database unless OCR_CACHE_PATH is set.
+OCR_CACHE = True
+OCR_CACHE_PATH = None
+OCR_CACHE_SIZE = 8 * 2**20
+
+def ocr_cache_path():
+    if OCR_CACHE_PATH:
+        return OCR_CACHE_PATH
+    # Imported here, the OCR worker process doesn't need the dictionary
+    from dictionary.loader import database_file
+    return os.path.join(os.path.dirname(os.path.abspath(database_file())), 'ocr_cache.db')
+
+def manga_ocr_model():
+    from manga_ocr import MangaOcr
+    return MangaOcr()
+
+def open_image(image):
+    from PIL import Image
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    return image
+
+def prepare_image(image):
+    # Same conversion MangaOcr does before recognising an image
+    return open_image(image).convert('L').convert('RGB')
+
+def image_key(image):
+    # Hash of the decoded pixels, so the same region gives the same key whichever format it was copied in
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.mode} {image.size}".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+def recognise_batch(model, images):
+    # Returns (text, error) per image. MangaOcr only takes one image at a time, so its generate step
+    # is batched here when its internals are available, falling back to one image at a time otherwise
+    if len(images) > 1 and hasattr(model, '_preprocess'):
+        try:
+            import torch
+            from manga_ocr.ocr import post_process
+            pixel_values = torch.stack([model._preprocess(prepare_image(i)) for i in images])
+            output = model.model.generate(pixel_values.to(model.model.device), max_length=300).cpu()
+            return [(post_process(model.tokenizer.decode(i, skip_special_tokens=True)), None) for i in output]
+        except Exception as e:
+            print(f"Batched OCR failed, recognising images one at a time: {e}")
+    results = []
+    for image in images:
+        try:
+            results.append((model(image), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
+
+def ocr_worker(factory, batch_size, requests, results):
+    # Runs in the OCR process. Requests are ('ocr', request_id, image or path), ('cancel', request_id, None) or None
+    # to stop, results are ('ready', None, load time), ('failed', None, error) or ('done', request_id, (text, error, seconds))
+    start = time.perf_counter()
+    try:
+        model = factory()
+    except Exception as e:
+        results.put(('failed', None, str(e)))
+        return
+    results.put(('ready', None, time.perf_counter() - start))
+
+    pending = OrderedDict()
+    while True:
+        # Only block when there is nothing left to do, then take everything that has been queued
+        messages = [] if pending else [requests.get()]
+        while True:
+            try:
+                messages.append(requests.get_nowait())
+            except queue.Empty:
+                break
+        for message in messages:
+            if message is None:
+                return
+            kind, request_id, image = message
+            if kind == 'cancel':
+                pending.pop(request_id, None)
+            else:
+                pending[request_id] = image
+
+        batch = [pending.popitem(last=False) for _ in range(min(batch_size, len(pending)))]
+        if batch:
+            request_ids, images = zip(*batch)
+            start = time.perf_counter()
+            recognised = recognise_batch(model, images)
+            seconds = (time.perf_counter() - start) / len(batch)
+            for request_id, (text, error) in zip(request_ids, recognised):
+                results.put(('done', request_id, (text, error, seconds)))
+
+ocr_db = SqliteDatabase(None)
+
+class OcrResult(Model):
+    key = TextField(primary_key=True)
+    text = TextField()
+    size = IntegerField()
+    inference_time = FloatField()
+    last_used = FloatField(index=True)
+
+    class Meta:
+        database = ocr_db
+        table_name = "ocr_result"
+
+class OcrCache:
+    """Recognised text by image_key, kept in a SQLite database across sessions
+
+    stats() reports the hit rate and the inference time the hits saved this session, to tune max_size with.
+    """
+    def __init__(self, path=None, max_size=OCR_CACHE_SIZE):
+        path = path or ocr_cache_path()
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_time = 0.0
+        self.evictions = 0
+        ocr_db.init(path, pragmas={'journal_mode': 'wal'})
+        ocr_db.create_tables([OcrResult])
+        self.size = OcrResult.select(fn.COALESCE(fn.SUM(OcrResult.size), 0)).scalar()
+
+    def get(self, key):
+        with self._lock:
+            result = OcrResult.get_or_none(OcrResult.key == key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_time += result.inference_time
+            OcrResult.update(last_used=time.time()).where(OcrResult.key == key).execute()
+            return result.text
+
+    def put(self, key, text, inference_time):
+        size = len(key) + len(text.encode('utf-8')) + 64 # rough per row overhead
+        if size > self.max_size:
+            return
+        with self._lock, ocr_db.atomic():
+            previous = OcrResult.get_or_none(OcrResult.key == key)
+            if previous is not None:
+                self.size -= previous.size
+            OcrResult.replace(key=key, text=text, size=size, inference_time=inference_time, last_used=time.time()).execute()
+            self.size += size
+            while self.size > self.max_size:
+                evicted = list(OcrResult.select(OcrResult.key, OcrResult.size).order_by(OcrResult.last_used).limit(100))
+                OcrResult.delete().where(OcrResult.key << [i.key for i in evicted]).execute()
+                self.size -= sum(i.size for i in evicted)
+                self.evictions += len(evicted)
+
+    def clear(self):
+        with self._lock:
+            OcrResult.delete().execute()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'saved_time': self.saved_time,
+                'evictions': self.evictions,
+                'entries': OcrResult.select().count(),
+                'size': self.size,
+                'max_size': self.max_size,
+            }
+
+class OcrWorker:
+    """Runs the OCR model in its own process, so recognising an image never blocks the GUI
+
+    submit returns a future for the recognised text. Cancelling a future that hasn't started yet drops it
+    from the worker's queue. The process is started by warm_up or the first submit, and restarted
+    by the next one if it dies. Images found in cache (an OcrCache) are answered without the worker,
+    they are decoded, hashed and looked up on a thread of the cache's own so submit never blocks.
+    """
+    def __init__(self, factory=manga_ocr_model, batch_size=OCR_BATCH_SIZE, cache=None):
+        self.factory = factory
+        self.batch_size = batch_size
+        self.cache = cache
+        self.load_time = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._process = None
+        self._loading = None
+        self._lookups = None
+        if cache is not None:
+            self._lookups = queue.Queue()
+            threading.Thread(target=self._look_up_cached, args=(self._lookups,), daemon=True).start()
+
+    @property
+    def ready(self):
+        loading = self._loading
+        return loading is not None and loading.done() and loading.exception() is None
+
+    def warm_up(self):
+        # Starts the worker if it isn't running, returns a future that is done once the model is loaded
+        with self._lock:
+            if self._process is None:
+                self._start()
+            return self._loading
+
+    def _start(self):
+        # Called with the lock held
+        context = get_context('spawn')
+        self._requests = context.Queue()
+        self._futures = {}
+        self._loading = Future()
+        results = context.Queue()
+        self._process = context.Process(
+            target=ocr_worker,
+            args=(self.factory, self.batch_size, self._requests, results),
+            name='ocr',
+            daemon=True
+        )
+        print("Loading OCR model")
+        self._process.start()
+        threading.Thread(
+            target=self._read_results,
+            args=(self._process, results, self._futures, self._loading),
+            daemon=True
+        ).start()
+
+    def _read_results(self, process, results, futures, loading):
+        while True:
+            try:
+                kind, request_id, value = results.get(timeout=1)
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+                error = RuntimeError("OCR worker exited")
+                break
+            if kind == 'ready':
+                self.load_time = value
+                print(f"Loaded OCR model in {value:.1f}s")
+                loading.set_result(value)
+            elif kind == 'failed':
+                error = RuntimeError(f"Failed to load OCR model: {value}")
+                break
+            else:
+                with self._lock:
+                    future, key = futures.pop(request_id, (None, None))
+                text, message, seconds = value
+                if message is None and key is not None:
+                    self.cache.put(key, text, seconds)
+                if future is not None and future.set_running_or_notify_cancel():
+                    if message is None:
+                        future.set_result(text)
+                    else:
+                        future.set_exception(RuntimeError(message))
+
+        # The worker is gone, fail everything still waiting on it
+        with self._lock:
+            if self._process is process:
+                self._process = None
+            waiting = [future for future, _ in futures.values()]
+            futures.clear()
+        if waiting or not loading.done():
+            print(error)
+        if not loading.done():
+            loading.set_exception(error)
+        for future in waiting:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
+    def submit(self, image):
+        future = Future()
+        if self._lookups is not None:
+            self._lookups.put((future, image))
+        else:
+            self._send(future, None, image)
+        return future
+
+    def _look_up_cached(self, lookups):
+        # Runs on the cache's thread, answers the images found in the cache and sends the others to the worker
+        while True:
+            future, image = lookups.get()
+            if future.cancelled():
+                continue
+            try:
+                # Decoded here to be hashed, so the worker is sent the image rather than a path
+                image = open_image(image)
+                key = image_key(image)
+                text = self.cache.get(key)
+            except Exception as e:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+                continue
+            if text is None:
+                self._send(future, key, image)
+            elif future.set_running_or_notify_cancel():
+                future.set_result(text)
+
+    def _send(self, future, key, image):
+        with self._lock:
+            if self._process is None:
+                self._start()
+            request_id = next(self._ids)
+            requests = self._requests
+            futures = self._futures
+            futures[request_id] = (future, key)
+
+        def on_done(future):
+            if future.cancelled():
+                with self._lock:
+                    futures.pop(request_id, None)
+                requests.put(('cancel', request_id, None))
+        future.add_done_callback(on_done)
+        requests.put(('ocr', request_id, image))
+
+    def __call__(self, image):
+        return self.submit(image).result()
+
+    def close(self):
+        with self._lock:
+            process, self._process = self._process, None
+        if process is not None:
+            self._requests.put(None)
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+
+def ocr_directory(path, worker):
+    # Yields (filename, text, error) in filename order. Two batches of images are queued ahead, so the worker
+    # can batch them while only those are decoded and held in memory
+    filenames = sorted(i for i in os.listdir(path) if i.lower().endswith(IMAGE_EXTENSIONS))
+    queued = deque()
+    def result(filename, future):
+        try:
+            return filename, future.result(), None
+        except Exception as e:
+            return filename, None, str(e)
+    for filename in filenames:
+        queued.append((filename, worker.submit(os.path.join(path, filename))))
+        if len(queued) >= 2 * worker.batch_size:
+            yield result(*queued.popleft())
+    while queued:
+        yield result(*queued.popleft())
+
+## Usage: python -m dictionary.ocr images_directory output.jsonl
+if __name__ == "__main__":
+    image_directory, output_path = sys.argv[1:3]
+    worker = OcrWorker(cache=OcrCache() if OCR_CACHE else None)
+    start = time.perf_counter()
+    count = 0
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for filename, text, error in ocr_directory(image_directory, worker):
+            f.write(json.dumps({'file': filename, 'text': text, 'error': error}, ensure_ascii=False) + '\n')
+            count += 1
+    worker.close()
+    print(f"Recognised {count} images in {time.perf_counter() - start:.1f}s")
+    if worker.cache is not None:
+        print(worker.cache.stats())
@@ -0,0 +1,124 @@
+import re
+from collections import OrderedDict
+from dictionary.loader import get_generation, glossary_of, sort_definitions
+from dictionary.instrument import instrumentation
+
+## The HTML page of a headword's definitions, shown by the web views of the main window. Kept apart from display
+## so it can be rendered without Qt.
+
+## Rendered pages are cached per headword until the dictionaries (or their priorities) change
+PAGE_CACHE_SIZE = 512
+
+## Make sure there is a line break before bracketed circled unicode numbers
+## (?<!^) negative look behind to ensure that the pattern is not at the start of the string
+## \uff08 and \uff09 are brackets
+## \u2460-\u2473 is the range of circled unicode numbers
+BRACKETED_NUMBER = re.compile(r'(?<!^)(<br>)*(\uff08[\u2460-\u2473]\uff09)')
+
+## Similar to above, make sure there is a line break before unbracketed circled unicode numbers while ignoring the bracketed ones
+UNBRACKETED_NUMBER = re.compile(r'(?<!^)(<br>)*([\u2460-\u2473])(?!\uff09)')
+
+def format_definitions(text):
+    out = text.replace('\n','<br>')
+    out = BRACKETED_NUMBER.sub(r"<br>\2",out)
+    out = UNBRACKETED_NUMBER.sub(r"<br>\2",out)
+    return out
+
+def definition_to_html(definition, expression, reading):
+    _definition = glossary_of(definition)
+    try:
+        _headword, d = _definition[0].removesuffix('\n').split('\n',1)
+        _definition_list = [d]+_definition[1:]
+        _definition_list = [format_definitions(i) for i in _definition_list]
+    except: #Mainly for JMdict
+        if reading:
+            _headword = f"{expression} 【{reading}】"
+        else:
+            _headword = f"{expression}"
+        _headword = _headword+f"{'(P) ' if definition.get('term_tags').startswith('P ') else ''}"
+        _definition_list = _definition
+
+    if len(_definition) > 1:
+        _definition_list = '<ol>'+''.join(f"<li>{i}</li>" for i in _definition)+'</ol>'
+    else:
+        _definition_list = _definition_list[0]
+        
+    if reading:
+        return f"""<definition>
+    <b>{_headword}</b><dictname>{definition['dictionary_name']}</dictname>
+    <br>
+    <blockquote>
+    {_definition_list}
+    </blockquote>
+    </definition>
+    """
+    return f"""<definition>
+    <b>{_headword}</b><dictname>{definition['dictionary_name']}</dictname>
+    <br>
+    <blockquote>
+    {_definition_list}
+    </blockquote>
+    </definition>
+    """
+
+def definitions_to_html(definitions, expression, reading):
+    return '<p>'.join(definition_to_html(definition, expression, reading) for definition in definitions)
+
+PAGE_HEAD = """
+    <html>
+    <head>
+    <style type="text/css">
+    blockquote {
+      margin: 1em;
+      padding: 0 1em;
+      border-left: .25em solid #d0d7de;
+    }
+    ol li 
+    {
+      margin: 0px;
+      padding: 0px;
+      margin-left: -1.4em;
+    }
+    dictname
+    {
+      padding: .2em .4em;
+      margin: 0;
+      font-size: 85%;
+      background-color: rgba(175,184,193,0.2);
+      border-radius: 6px;
+    }
+    </style>
+    </head>
+    <body>
+    """
+
+PAGE_TAIL = """ 
+    </body>
+    </html>"""
+
+_page_cache = OrderedDict()
+
+@instrumentation.timed('generate_page_html')
+def generate_page_html(entry):
+    if not entry:
+        return PAGE_HEAD + PAGE_TAIL
+    key = (
+        get_generation(),
+        entry.expression,
+        entry.reading,
+        tuple((i.get('entry_id'), i.get('dictionary_id')) for i in entry.definitions)
+    )
+    html = _page_cache.get(key)
+    if html is not None:
+        _page_cache.move_to_end(key)
+        return html
+    definitions = definitions_to_html(
+        definitions = sort_definitions(entry.definitions), 
+        expression = entry.expression,
+        reading = entry.reading
+    )
+    html = PAGE_HEAD + definitions + PAGE_TAIL
+    _page_cache[key] = html
+    if len(_page_cache) > PAGE_CACHE_SIZE:
+        _page_cache.popitem(last=False)
+    return html
@@ -0,0 +1,269 @@
+import heapq
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from dictionary.loader import Entry, result_cache, catalog_generation, close_connections, database_file, each_shard, match_terms
+from dictionary.instrument import instrumentation
+
+## Every expression and reading in the database is kept in a prefix trie, saved next to the database and memory-mapped,
+## so a whole sentence can be scanned for the dictionary words starting at each of its characters without a query per
+## substring. The file starts with the entry count and highest entry id it was built from, and is rebuilt when they change.
+## Layout after the header (little-endian): first edge of every node (node count + 1 uint32), edge labels (code points,
+## sorted within a node) and edge targets (uint32 each), then a terminal flag byte per node. Node 0 is the root.
+TRIE_MAGIC = b'SHTRIE01'
+TRIE_HEADER = struct.Struct('<8sQQII')
+SCAN_MAX_RETURN = 300
+
+def trie_path(database=None):
+    # dictionary_fts.db -> dictionary_fts.trie, also for the file: URIs read-only connections use
+    return os.path.splitext(database_file(database))[0] + '.trie'
+
+def entry_signature():
+    # Entry ids are unique across shards, so the total count and the highest id change with any import or removal
+    signatures = each_shard(lambda shard: shard.execute_sql('SELECT count(*), coalesce(max(id), 0) FROM entry').fetchone())
+    return (sum(i for i, _ in signatures), max((i for _, i in signatures), default=0))
+
+def headword_keys():
+    # Distinct expressions and readings in code point order, which is SQLite's default collation for UTF-8
+    def shard_keys(shard):
+        cursor = shard.execute_sql("SELECT expression FROM entry UNION SELECT reading FROM entry WHERE reading != '' ORDER BY 1")
+        return [i for i, in cursor if i]
+    keys = []
+    for key in heapq.merge(*each_shard(shard_keys)):
+        if not keys or key != keys[-1]:
+            keys.append(key)
+    return keys
+
+def build_trie_data(keys, signature):
+    # keys must be sorted. Nodes are laid out breadth first, each one a range of the keys sharing its prefix,
+    # so the children of a node are numbered consecutively and found by splitting its range on the next character
+    first_edge = array('I')
+    labels = array('I')
+    targets = array('I')
+    terminal = bytearray()
+    queue = [(0, len(keys), 0)]
+    for lo, hi, depth in queue:
+        first_edge.append(len(labels))
+        terminal.append(lo < hi and len(keys[lo]) == depth)
+        i = lo + terminal[-1]
+        while i < hi:
+            c = keys[i][depth]
+            j = i + 1
+            while j < hi and keys[j][depth] == c:
+                j += 1
+            labels.append(ord(c))
+            targets.append(len(queue))
+            queue.append((i, j, depth + 1))
+            i = j
+    first_edge.append(len(labels))
+    if struct.pack('=I', 1) != struct.pack('<I', 1):
+        for i in (first_edge, labels, targets):
+            i.byteswap()
+    return b''.join((
+        TRIE_HEADER.pack(TRIE_MAGIC, *signature, len(terminal), len(labels)),
+        first_edge.tobytes(),
+        labels.tobytes(),
+        targets.tobytes(),
+        bytes(terminal),
+    ))
+
+class Trie:
+    """Prefix trie of headwords over a buffer (a memory-mapped file or bytes) in the layout built by build_trie_data"""
+    def __init__(self, buffer, mapped=None):
+        self._mapped = mapped
+        magic, *signature, nodes, edges = TRIE_HEADER.unpack_from(buffer)
+        if magic != TRIE_MAGIC:
+            raise ValueError("Not a headword trie")
+        self.signature = tuple(signature)
+        view = memoryview(buffer)
+        offset = TRIE_HEADER.size
+        def take(count, format):
+            nonlocal offset
+            size = count * struct.calcsize(format)
+            part = view[offset:offset + size].cast(format)
+            offset += size
+            return part
+        self.first_edge = take(nodes + 1, 'I')
+        self.labels = take(edges, 'I')
+        self.targets = take(edges, 'I')
+        self.terminal = take(nodes, 'B')
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls(mapped, mapped)
+        except Exception:
+            mapped.close()
+            raise
+
+    def close(self):
+        for i in (self.first_edge, self.labels, self.targets, self.terminal):
+            i.release()
+        if self._mapped is not None:
+            self._mapped.close()
+
+    def prefix_lengths(self, text, start=0):
+        # Lengths of the headwords that text[start:] starts with, shortest first
+        first_edge, labels, targets, terminal = self.first_edge, self.labels, self.targets, self.terminal
+        lengths = []
+        node = 0
+        for i in range(start, len(text)):
+            lo, hi = first_edge[node], first_edge[node + 1]
+            c = ord(text[i])
+            j = bisect_left(labels, c, lo, hi)
+            if j == hi or labels[j] != c:
+                break
+            node = targets[j]
+            if terminal[node]:
+                lengths.append(i + 1 - start)
+        return lengths
+
+    def scan(self, text):
+        # (start, word) of every headword in text, by position and longest first like Yomichan's scanning
+        return [(start, text[start:start + length]) for start in range(len(text)) for length in reversed(self.prefix_lengths(text, start))]
+
+def save_trie(path, data):
+    # Writes a trie built by build_trie_data and maps it, the file is replaced in one step
+    try:
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        # e.g. next to a database on a read-only location, the trie is only kept in memory then
+        print(f"Couldn't save headword trie: {e}")
+        return Trie(data)
+    return Trie.open(path)
+
+def build_trie(path=None):
+    # Writes the trie of the current database
+    path = path or trie_path()
+    start = time.perf_counter()
+    data = build_trie_data(headword_keys(), entry_signature())
+    trie = save_trie(path, data)
+    print(f"Built headword trie in {time.perf_counter() - start:.1f}s ({len(data) / 2**20:.1f} MiB)")
+    return trie
+
+## Lookups scan with the trie in _trie, which is only replaced once a rebuilt one is ready, so a lookup never waits for
+## a rebuild: refresh_trie runs on the import's thread, or on a thread of its own (refresh_trie_in_background) when a
+## lookup sees the dictionaries changed. _trie_lock is held while scanning and while swapping the tries, the previous
+## mapping is closed before the file is replaced (Windows can't replace a mapped file).
+_trie = None
+_trie_generation = None # of the dictionaries _trie was checked against
+_trie_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_refresh_thread = None
+
+def open_saved_trie(path, signature=None):
+    # The saved trie, if there is one (built from the given signature)
+    try:
+        trie = Trie.open(path)
+    except (OSError, ValueError):
+        return None
+    if signature is not None and trie.signature != signature:
+        trie.close()
+        return None
+    return trie
+
+def refresh_trie():
+    # Rebuilds the trie if the dictionaries changed since it was built, unless another process saved the new one already
+    global _trie, _trie_generation
+    with _refresh_lock:
+        generation = catalog_generation()
+        if _trie is not None and _trie_generation == generation:
+            return
+        path = trie_path()
+        signature = entry_signature()
+        trie = _trie if _trie is not None and _trie.signature == signature else open_saved_trie(path, signature)
+        data = None
+        if trie is None:
+            start = time.perf_counter()
+            data = build_trie_data(headword_keys(), signature)
+        with _trie_lock:
+            if _trie is not None and _trie is not trie:
+                _trie.close()
+            if data is not None:
+                trie = save_trie(path, data)
+            _trie = trie
+            _trie_generation = generation
+        if data is not None:
+            print(f"Built headword trie in {time.perf_counter() - start:.1f}s ({len(data) / 2**20:.1f} MiB)")
+
+def run_refresh_trie():
+    try:
+        refresh_trie()
+    except Exception as e:
+        print(f"Couldn't rebuild headword trie: {e}")
+    finally:
+        close_connections()
+
+def refresh_trie_in_background():
+    # Starts refresh_trie on a thread of its own, unless it is running already
+    global _refresh_thread
+    with _trie_lock:
+        if _refresh_thread is not None and _refresh_thread.is_alive():
+            return
+        _refresh_thread = threading.Thread(target=run_refresh_trie, name='refresh_trie', daemon=True)
+        _refresh_thread.start()
+
+def scan_trie(text, generation):
+    # trie.scan(text) with the current trie, which is refreshed in the background if the dictionaries changed.
+    # Until the first trie has been built nothing is found.
+    global _trie, _trie_generation
+    with _trie_lock:
+        if _trie is None:
+            _trie = open_saved_trie(trie_path())
+            _trie_generation = None
+        found = _trie.scan(text) if _trie is not None else []
+        stale = _trie_generation != generation
+    if stale:
+        refresh_trie_in_background()
+    return found
+
+@instrumentation.timed('scan_headwords')
+def scan_headwords(text, max_return=SCAN_MAX_RETURN):
+    # get_headwords rows for every dictionary word in text, in the order they appear (longest first at each position).
+    # The words are found in the trie and their entries fetched with a single query.
+    key = ('scan', text, max_return)
+    generation = catalog_generation()
+    result = result_cache.get(key, generation)
+    if result is not None:
+        return result
+
+    found = scan_trie(text, generation)
+    order = {}
+    for position, (start, word) in enumerate(found):
+        order.setdefault(word, position)
+    if not order:
+        return []
+    # Every word is a headword of its own, so words past the first max_return only make headwords that are cut off
+    words = list(order)[:max_return]
+
+    def lookup(shard):
+        # Matched like exact lookups, through the search keys
+        condition, terms_of = match_terms(shard, words)
+        query = Entry\
+            .select(Entry.id, Entry.expression, Entry.reading)\
+            .where(condition)\
+            .tuples()
+        return [(row, terms_of(row[1]) + terms_of(row[2])) for row in query.execute(shard)]
+
+    headwords = {}
+    for (entry_id, expression, reading), matched in chain.from_iterable(each_shard(lookup)):
+        headword = headwords.get((expression, reading))
+        if headword is None:
+            headword = headwords[(expression, reading)] = Entry(expression=expression, reading=reading)
+            headword.entry_ids = []
+            headword.position = min(order[i] for i in matched)
+        headword.entry_ids.append(entry_id)
+    result = sorted(headwords.values(), key=lambda i: (i.position, len(i.expression), i.expression, i.reading))[:max_return]
+    for i in result:
+        i.entry_ids.sort()
+    result_cache.put(key, generation, result)
+    return result
@@ -0,0 +1,175 @@
+import argparse
+import queue
+import ujson
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from dictionary.loader import db, ConnectionSet, get_definition, get_definitions, lend_connections, result_cache, shards
+from dictionary.batch import match_records
+
+## Local HTTP/JSON lookup service for tools that can't embed the GUI (reader scripts, Anki helpers, ...)
+##   GET  /lookup?term=...&max_return=300   -> {"term": ..., "matches": [...]}
+##   POST /batch {"terms": [...], "max_return": 300} -> {"results": [{"term": ..., "matches": [...]}, ...]}
+##   GET  /stats                            -> result cache statistics
+## Matches are in the same format as python -m dictionary.batch writes. Connections are kept alive (HTTP/1.1)
+## and every request is handled on its own thread with read-only connections from a shared pool.
+## Usage: python -m dictionary.server [-d dictionary_fts.db] [--port 8765] [--connections 4]
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+SERVER_CONNECTIONS = 4
+MAX_BATCH_TERMS = 10000
+
+class ConnectionPool:
+    """Read-only connections to the dictionary database, shared by the request threads
+
+    Every slot is a ConnectionSet with a connection to the catalog and one to each shard, all opened by their
+    database so the tokenizers are registered once when they are created. connection() lends a slot to the calling
+    thread until the block ends, so a request never opens connections of its own.
+    """
+    def __init__(self, path, size=SERVER_CONNECTIONS):
+        db.init(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        # Most recently returned first, its pages are the likeliest to still be in SQLite's cache
+        self._slots = queue.LifoQueue()
+        for _ in range(size):
+            slot = ConnectionSet()
+            with lend_connections(slot):
+                for database in (db, *shards()):
+                    slot.get(database)
+            self._slots.put(slot)
+
+    @contextmanager
+    def connection(self):
+        slot = self._slots.get()
+        try:
+            with lend_connections(slot):
+                yield slot
+        finally:
+            self._slots.put(slot)
+
+    def close(self):
+        while True:
+            try:
+                self._slots.get_nowait().close()
+            except queue.Empty:
+                break
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class LookupHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive
+    # The headers and body are buffered and sent together when the request is done, without waiting
+    # for the client's delayed ACK of a first small packet (~40ms per request on keep-alive connections)
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        if url.path == '/lookup':
+            self.respond(self.lookup, params)
+        elif url.path == '/stats':
+            self.respond(lambda: result_cache.stats())
+        else:
+            self.send_json(404, {'error': f"Not found: {url.path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        # The body is read even for unknown paths, otherwise it would be taken for the next request
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if url.path == '/batch':
+            self.respond(self.batch, body)
+        else:
+            self.send_json(404, {'error': f"Not found: {url.path}"})
+
+    def lookup(self, params):
+        term = params.get('term', [''])[0]
+        if not term:
+            raise RequestError(400, "Missing term")
+        max_return = self.max_return(params.get('max_return', [300])[0])
+        with self.server.pool.connection():
+            return {'term': term, 'matches': match_records(get_definition(term, max_return))}
+
+    def batch(self, body):
+        try:
+            request = ujson.loads(body)
+        except ValueError:
+            raise RequestError(400, "Body is not valid JSON")
+        terms = request.get('terms') if isinstance(request, dict) else None
+        if not isinstance(terms, list) or not all(isinstance(i, str) and i for i in terms):
+            raise RequestError(400, "terms must be a list of non-empty strings")
+        if len(terms) > MAX_BATCH_TERMS:
+            raise RequestError(400, f"At most {MAX_BATCH_TERMS} terms per request")
+        max_return = self.max_return(request.get('max_return', 300))
+        with self.server.pool.connection():
+            return {
+                'results': [
+                    {'term': term, 'matches': match_records(matches)}
+                    for term, matches in zip(terms, get_definitions(terms, max_return))
+                ]
+            }
+
+    def max_return(self, value):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            value = 0
+        if value < 1:
+            raise RequestError(400, "max_return must be a positive integer")
+        return value
+
+    def respond(self, handler, *args):
+        try:
+            self.send_json(200, handler(*args))
+        except RequestError as e:
+            self.send_json(e.status, {'error': str(e)})
+        except Exception as e:
+            print(f"Lookup failed: {e}")
+            self.send_json(500, {'error': str(e)})
+
+    def send_json(self, status, data):
+        body = ujson.dumps(data, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class LookupServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, database='dictionary_fts.db', host=SERVER_HOST, port=SERVER_PORT, connections=SERVER_CONNECTIONS, verbose=False):
+        self.pool = ConnectionPool(database, connections)
+        self.verbose = verbose
+        super().__init__((host, port), LookupHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m dictionary.server', description="Serve dictionary lookups as JSON over HTTP")
+    parser.add_argument('-d', '--database', default='dictionary_fts.db')
+    parser.add_argument('--host', default=SERVER_HOST, help="address to listen on (default: loopback only)")
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--connections', type=int, default=SERVER_CONNECTIONS, help="read-only database connections shared by the requests")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log every request")
+    args = parser.parse_args(argv)
+
+    server = LookupServer(args.database, args.host, args.port, args.connections, args.verbose)
+    print(f"Serving {args.database} on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -11,9 +11,13 @@ from PyQt6.QtWidgets import (
     ,QMenu
 )
 from PyQt6.QtCore import Qt, pyqtSignal, QTimer, QSize
-from PyQt6.QtGui import QFontDatabase, QFont, QAction, QCursor
+from PyQt6.QtGui import QFont, QAction, QCursor, QKeySequence, QShortcut
 from PyQt6.QtWebEngineWidgets import QWebEngineView
+from dictionary.fonts import font_family
+from dictionary.instrument_window import InstrumentationWindow
 
+## Closed tabs are kept as snapshots of their state (see display.MainWindow.snapshot), the widgets themselves are deleted
+CLOSED_TAB_HISTORY = 50
 
 class MainWindow(QMainWindow):  
     def __init__(self):
@@ -39,23 +43,25 @@ class ShrinkTabBar(QTabBar):
         self._recursiveTimer = QTimer(singleShot=True, timeout=self._unsetRecursiveCheck, interval=0)
         self._closeIconTimer = QTimer(singleShot=True, timeout=self._updateClosable, interval=0)
         
-        _id = QFontDatabase.addApplicationFont("font/NotoSansJP-Regular.otf")
-        _fontstr = QFontDatabase.applicationFontFamilies(_id)[0]
-        self._font = QFont(_fontstr, 10)
+        self._font = QFont(font_family(), 10)
         self.setFont(self._font)
 
         ## Context menu
         self.context_menu = QMenu()
         self.context_menu_close = QAction("Close")
         self.context_menu_close_others = QAction("Close other tabs")
+        self.context_menu_reopen = QAction("Reopen closed tab")
         self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         self.customContextMenuRequested.connect(self.on_context_menu)
         self.context_menu_close.triggered.connect(self.context_menu_tab_close)
         self.context_menu_close_others.triggered.connect(self.context_menu_tab_close_others)
+        self.context_menu_reopen.triggered.connect(lambda: self.parent()._reopenTab())
     
     def on_context_menu(self, pos):
         self.context_menu.addAction(self.context_menu_close)
         self.context_menu.addAction(self.context_menu_close_others)
+        self.context_menu.addAction(self.context_menu_reopen)
+        self.context_menu_reopen.setEnabled(bool(self.parent().removedTabs))
         self.global_cursor_pos = QCursor.pos()
         self.context_menu.exec(self.global_cursor_pos)
     
@@ -183,9 +189,14 @@ class ShrinkTabWidget(QTabWidget):
     def __init__(self, display_window=QWebEngineView):
         super().__init__()
         self._tabBar = ShrinkTabBar(self)
-        self.removedTabs = deque()
+        self.removedTabs = deque(maxlen=CLOSED_TAB_HISTORY)
         self.setTabBar(self._tabBar)
         self._tabBar.addClicked.connect(self._addTab)
+        self.reopen_shortcut = QShortcut(QKeySequence("Ctrl+Shift+T"), self)
+        self.reopen_shortcut.activated.connect(self._reopenTab)
+        self.instrumentation_shortcut = QShortcut(QKeySequence("Ctrl+Shift+I"), self)
+        self.instrumentation_shortcut.activated.connect(self._showInstrumentation)
+        self.instrumentation_window = None
         self.display_window = display_window
         if display_window is not None:
             self._addTab()
@@ -194,18 +205,43 @@ class ShrinkTabWidget(QTabWidget):
         self._tabBar._updateSize()
         super().resizeEvent(event)
 
-    def _addTab(self, tab_title="New Tab", tab_from_lookup=False, insert_at_position=None):
+    def _addTab(self, tab_title="New Tab", tab_from_lookup=False, insert_at_position=None, background=False):
+        # Tabs opened in the background stay placeholders until they are first shown, see display.MainWindow.showEvent
         if not tab_from_lookup:
             self.addTab(self.display_window(self), tab_title)
             self.setCurrentIndex(self.count()-1)
         else:
             idx = self.insertTab(insert_at_position, self.display_window(self), tab_title)
-            self.setCurrentIndex(idx)
+            if not background:
+                self.setCurrentIndex(idx)
             return idx
         
     def _tabClosed(self, index):
-        self.removedTabs.append({"index": index, "widget": self.widget(index)})
+        widget = self.widget(index)
+        # Stop work (lookups, OCR) that would only update the closed tab
+        if hasattr(widget, 'tab_closed'):
+            widget.tab_closed()
+        snapshot = widget.snapshot() if hasattr(widget, 'snapshot') else None
+        self.removedTabs.append({"index": index, "title": self.tabText(index), "snapshot": snapshot})
         self.removeTab(index)
+        widget.deleteLater()
+
+    def _reopenTab(self):
+        # Rebuilds the most recently closed tab at its old position
+        if not self.removedTabs:
+            return
+        closed = self.removedTabs.pop()
+        idx = self._addTab(closed["title"], True, min(closed["index"], self.count()))
+        widget = self.widget(idx)
+        if closed["snapshot"] is not None and hasattr(widget, 'restore'):
+            widget.restore(closed["snapshot"])
+
+    def _showInstrumentation(self):
+        # Debug window with the lookup latencies, see dictionary.instrument
+        if self.instrumentation_window is None:
+            self.instrumentation_window = InstrumentationWindow()
+        self.instrumentation_window.show()
+        self.instrumentation_window.raise_()
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
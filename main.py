@@ -5,13 +5,15 @@ from PyQt6.QtWidgets import (
     QApplication
     ,QMainWindow
 )
-from manga_ocr import MangaOcr
+from PyQt6.QtCore import QTimer
+from dictionary.ocr import OcrWorker, OcrCache, OCR_CACHE, OCR_WARM_UP, OCR_WARM_UP_DELAY
+from dictionary.scan import refresh_trie_in_background
 import functools
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.manga_ocr = MangaOcr()
+        self.manga_ocr = OcrWorker(cache=OcrCache() if OCR_CACHE else None)
         self.dictionary_display = functools.partial(dictionary_display.MainWindow,self.manga_ocr)
         self.tab_widget = tab_widget.ShrinkTabWidget(self.dictionary_display)
         self.setCentralWidget(self.tab_widget)
@@ -21,4 +23,9 @@ if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
+    # Maps the headword trie for scanning sentences, or rebuilds it if the dictionaries changed since it was saved.
+    # On a thread of its own, the lookups have the thread pool to themselves
+    refresh_trie_in_background()
+    if OCR_WARM_UP == 'background':
+        QTimer.singleShot(OCR_WARM_UP_DELAY, window.manga_ocr.warm_up)
     sys.exit(app.exec())
\ No newline at end of file
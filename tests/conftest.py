@@ -0,0 +1,32 @@
+import pytest
+from benchmarks.synthetic import make_dictionary, synthetic_terms
+from dictionary.loader import db, close_connections, load_dictionary
+from dictionary.scan import refresh_trie
+
+## Two synthetic dictionaries generated from the same seed, the smaller one's terms are the first of the larger one's,
+## so their headwords are in both shards
+LARGE_ENTRIES = 3000
+SMALL_ENTRIES = 1000
+
+@pytest.fixture(scope='session')
+def dictionary_ids(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('dictionaries')
+    db.init(str(directory / 'dictionary_fts.db'))
+    ids = [
+        load_dictionary(make_dictionary(str(directory / 'large.zip'), LARGE_ENTRIES, title='synthetic-large')),
+        load_dictionary(make_dictionary(str(directory / 'small.zip'), SMALL_ENTRIES, title='synthetic-small')),
+    ]
+    refresh_trie()
+    yield ids
+    # sqlitefts' tokenizers are gone by the time the interpreter closes connections left open
+    close_connections()
+
+@pytest.fixture(scope='session')
+def terms():
+    # Rows of the large dictionary
+    return list(synthetic_terms(LARGE_ENTRIES))
+
+@pytest.fixture(scope='session')
+def small_terms(terms):
+    # Rows of the small dictionary, which are also in the large one
+    return terms[:SMALL_ENTRIES]
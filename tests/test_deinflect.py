@@ -0,0 +1,37 @@
+from benchmarks.deinflection import inflected_forms
+from dictionary.deinflect import RULE_BITS, Deinflection, deinflect, deinflected_headwords, rule_mask
+
+def test_rule_mask_ignores_other_tags():
+    assert rule_mask('v1 vt') == RULE_BITS['v1']
+    assert rule_mask('v5 adj-i') == RULE_BITS['v5'] | RULE_BITS['adj-i']
+    assert rule_mask('') == 0
+
+def test_term_itself_comes_first():
+    assert deinflect('食べた')[0] == Deinflection('食べた', 0, ())
+
+def test_verbs():
+    assert Deinflection('食べる', RULE_BITS['v1'], ('past',)) in deinflect('食べた')
+    assert Deinflection('書く', RULE_BITS['v5'], ('negative',)) in deinflect('書かない')
+    assert Deinflection('行く', RULE_BITS['v5'], ('past',)) in deinflect('行った')
+    assert Deinflection('勉強', RULE_BITS['vs'], ('suru', 'polite')) in deinflect('勉強します')
+
+def test_chained_inflections_list_the_innermost_first():
+    assert Deinflection('読む', RULE_BITS['v5'], ('te', 'progressive')) in deinflect('読んでいる')
+
+def test_adjectives():
+    assert Deinflection('高い', RULE_BITS['adj-i'], ('negative',)) in deinflect('高くない')
+
+def test_headwords_of_inflected_forms(dictionary_ids):
+    pairs = inflected_forms(50)
+    assert pairs
+    for base, inflected in pairs:
+        headwords = deinflected_headwords(inflected)
+        assert any(base in (i.expression, i.reading) for i in headwords), inflected
+        for i in headwords:
+            if inflected not in (i.expression, i.reading):
+                assert i.reasons
+
+def test_rules_of_the_candidate_must_match_the_entry(dictionary_ids, terms):
+    # Nouns (no rule types) are not the dictionary form of a past tense
+    noun = next(expression for expression, _, _, rules, *_ in terms if not rules and expression.endswith('る'))
+    assert not any(i.expression == noun for i in deinflected_headwords(noun[:-1] + 'た'))
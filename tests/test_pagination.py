@@ -0,0 +1,34 @@
+from collections import Counter
+import pytest
+from dictionary.loader import get_headwords, headword_key
+
+def pages(term, page_size):
+    rows = []
+    after = None
+    while True:
+        page = get_headwords(term, page_size, after)
+        assert len(page) <= page_size
+        if not page:
+            return rows
+        rows.extend(page)
+        after = headword_key(page[-1])
+
+def common_prefix(terms):
+    return Counter(expression[0] for expression, *_ in terms).most_common(1)[0][0] + '%'
+
+@pytest.mark.parametrize('page_size', [7, 100])
+def test_pages_add_up_to_all_matches(dictionary_ids, terms, page_size):
+    for term in ('%', common_prefix(terms)):
+        everything = get_headwords(term, 10**6)
+        paged = pages(term, page_size)
+        assert [headword_key(i) for i in paged] == [headword_key(i) for i in everything]
+        assert [sorted(i.entry_ids) for i in paged] == [sorted(i.entry_ids) for i in everything]
+
+def test_headword_order(dictionary_ids):
+    keys = [headword_key(i) for i in get_headwords('%', 10**6)]
+    assert len(keys) > 100
+    assert keys == sorted(set(keys))
+
+def test_after_the_last_headword(dictionary_ids):
+    last = get_headwords('%', 10**6)[-1]
+    assert get_headwords('%', 100, headword_key(last)) == []
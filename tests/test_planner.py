@@ -0,0 +1,59 @@
+import pytest
+from dictionary.loader import QueryPlan, shards
+
+def plan(term, index_mode='ngram', reversed_keys=True, search_keys=True):
+    return QueryPlan(term, index_mode=index_mode, reversed_keys=reversed_keys, search_keys=search_keys)
+
+@pytest.mark.parametrize('term, kind, route', [
+    ('日本', 'exact', 'search_key'),
+    ('日%', 'prefix', 'prefix_range'),
+    ('日%本', 'prefix', 'prefix_range'),
+    ('%本', 'suffix', 'reversed_range'),
+    ('%日本%', 'infix', 'fts'),
+    ('_本', 'single_char', 'reversed_range'),
+    ('%', 'wildcard', 'scan'),
+    ('%_%', 'wildcard', 'scan'),
+])
+def test_routes(term, kind, route):
+    query_plan = plan(term)
+    assert (query_plan.kind, query_plan.route) == (kind, route)
+
+def test_exact_without_search_keys_seeks_expression_and_reading():
+    assert plan('日本', search_keys=False).route == 'index'
+
+def test_suffix_without_reversed_keys_uses_fts():
+    query_plan = plan('%本', reversed_keys=False)
+    assert query_plan.route == 'fts'
+    assert query_plan.fts_tokens == ['本']
+
+def test_full_width_wildcards():
+    query_plan = plan('日％')
+    assert (query_plan.term, query_plan.route) == ('日%', 'prefix_range')
+
+def test_ngram_tokens():
+    assert plan('%日本語です%').fts_tokens == ['日本語', '本語で', '語です']
+    assert plan('%日本%語%').fts_tokens == ['日本', '語']
+
+def test_trigram_index_cant_match_short_tokens():
+    assert plan('%日本%', index_mode='trigram').route == 'scan'
+
+def test_candidates_match():
+    assert plan('日%').candidates_match()
+    assert plan('%本').candidates_match()
+    assert plan('%日本%').candidates_match()
+    assert not plan('日%本').candidates_match()
+    assert not plan('%日本語です%').candidates_match()
+    assert not plan('%').candidates_match()
+
+def test_routes_of_a_shard(dictionary_ids):
+    shard = shards()[0]
+    assert QueryPlan('日本', database=shard).route == 'search_key'
+    assert QueryPlan('%本', database=shard).route == 'reversed_range'
+    assert QueryPlan('%', database=shard).prefer_ordered_scan().route == 'ordered_scan'
+
+def test_ordered_scan_only_for_terms_the_candidates_decide(dictionary_ids, terms):
+    shard = shards()[0]
+    word = terms[0][0]
+    assert QueryPlan(word[0] + '%', database=shard).prefer_ordered_scan(threshold=1).route == 'ordered_scan'
+    assert QueryPlan(word[0] + '%', database=shard).prefer_ordered_scan().route == 'prefix_range'
+    assert QueryPlan(word[0] + '%' + word[-1], database=shard).prefer_ordered_scan(threshold=1).route == 'prefix_range'
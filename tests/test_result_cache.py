@@ -0,0 +1,56 @@
+from dictionary.loader import Entry, ResultCache, bump_generation, get_definition, get_generation, result_cache
+
+def rows():
+    return [Entry(expression='日本', reading='にほん')]
+
+def test_hit_in_the_same_generation():
+    cache = ResultCache()
+    generation = get_generation()
+    cache.put('key', generation, rows())
+    assert cache.get('key', generation)[0].expression == '日本'
+    assert (cache.hits, cache.misses) == (1, 0)
+
+def test_results_of_an_older_generation_are_not_cached():
+    cache = ResultCache()
+    generation = get_generation()
+    bump_generation()
+    cache.put('key', generation, rows())
+    assert cache.get('key', generation) is None
+    assert cache.stats()['entries'] == 0
+
+def test_new_generation_misses():
+    cache = ResultCache()
+    cache.put('key', get_generation(), rows())
+    bump_generation()
+    assert cache.get('key', get_generation()) is None
+    assert cache.misses == 1
+
+def test_uncounted_miss():
+    cache = ResultCache()
+    assert cache.get('key', get_generation(), count_miss=False) is None
+    assert cache.misses == 0
+
+def test_least_recently_used_are_evicted():
+    cache = ResultCache(max_size=250)
+    generation = get_generation()
+    for key in ('a', 'b', 'c'):
+        cache.put(key, generation, rows())
+        cache.get('a', generation)
+    assert cache.get('a', generation) is not None
+    assert cache.get('b', generation) is None
+    assert cache.evictions == 1
+    assert cache.size <= cache.max_size
+
+def test_too_large_results_are_not_cached():
+    cache = ResultCache(max_size=10)
+    cache.put('key', get_generation(), rows())
+    assert cache.get('key', get_generation()) is None
+
+def test_lookups_after_a_bump(dictionary_ids, terms):
+    word = terms[0][0]
+    before = get_definition(word)
+    assert result_cache.get(('definitions', word, 300), get_generation()) is before
+    bump_generation()
+    after = get_definition(word)
+    assert after is not before
+    assert [(i.expression, i.reading, len(i.definitions)) for i in after] == [(i.expression, i.reading, len(i.definitions)) for i in before]
@@ -0,0 +1,32 @@
+from dictionary.scan import Trie, build_trie_data, scan_headwords
+
+def make_trie(*keys):
+    return Trie(build_trie_data(sorted(keys), (len(keys), 0)))
+
+def test_prefix_lengths_shortest_first():
+    trie = make_trie('日', '日本', '日本語', '本')
+    assert trie.prefix_lengths('日本語です') == [1, 2, 3]
+    assert trie.prefix_lengths('日本語です', 1) == [1]
+    assert trie.prefix_lengths('です') == []
+
+def test_prefix_lengths_needs_a_whole_key():
+    trie = make_trie('日本語')
+    assert trie.prefix_lengths('日本') == []
+
+def test_scan_longest_first_at_each_position():
+    trie = make_trie('日', '日本', '本', '本当')
+    assert trie.scan('日本当') == [(0, '日本'), (0, '日'), (1, '本当'), (1, '本')]
+
+def test_empty_trie():
+    trie = make_trie()
+    assert trie.scan('日本') == []
+
+def test_signature():
+    assert make_trie('a', 'b').signature == (2, 0)
+
+def test_scan_headwords(dictionary_ids, terms):
+    words = [expression for expression, *_ in terms[:3]]
+    text = '、'.join(words)
+    expressions = {i.expression for i in scan_headwords(text)}
+    assert set(words) <= expressions
+    assert all(i.expression in text or i.reading in text for i in scan_headwords(text))
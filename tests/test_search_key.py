@@ -0,0 +1,20 @@
+from dictionary.loader import search_key
+
+def test_kana_variants_share_a_key():
+    assert search_key('ラーメン') == search_key('ﾗｰﾒﾝ') == search_key('らーめん') == search_key('らあめん') == 'らあめん'
+
+def test_long_vowel_mark_takes_the_vowel_of_the_kana_before_it():
+    assert search_key('コーヒー') == 'こおひい'
+    assert search_key('ゲーム') == 'げえむ'
+
+def test_long_vowel_mark_without_kana_before_it_is_kept():
+    assert search_key('ー') == 'ー'
+    assert search_key('Aー') == 'aー'
+
+def test_full_width_latin_is_folded_to_lower_case():
+    assert search_key('ＡＢＣ') == 'abc'
+    assert search_key('Kanji') == 'kanji'
+
+def test_kanji_are_unchanged():
+    assert search_key('漢字') == '漢字'
+    assert search_key('') == ''
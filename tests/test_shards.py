@@ -0,0 +1,77 @@
+from dictionary.loader import (
+    Entry,
+    SHARD_ID_BITS,
+    ShardDatabase,
+    bump_generation,
+    get_definition,
+    get_definitions,
+    get_entry_definitions,
+    get_headwords,
+    headword_key,
+    merge_headwords,
+    shard_path,
+    shards,
+)
+
+def headword(expression, reading, *entry_ids):
+    row = Entry(expression=expression, reading=reading)
+    row.entry_ids = list(entry_ids)
+    return row
+
+def test_merge_in_headword_order():
+    pages = [
+        [headword('日', 'ひ', 1), headword('日本', 'にほん', 2)],
+        [headword('本', 'ほん', 3), headword('日本', 'にほん', 4), headword('日本語', 'にほんご', 5)],
+    ]
+    merged = merge_headwords(pages, 10, 'entry_ids')
+    assert [(i.expression, i.entry_ids) for i in merged] == [('日', [1]), ('本', [3]), ('日本', [2, 4]), ('日本語', [5])]
+
+def test_merge_stops_at_max_return():
+    pages = [[headword('日', 'ひ', 1), headword('日本', 'にほん', 2)], [headword('本', 'ほん', 3)]]
+    assert [i.expression for i in merge_headwords(pages, 2, 'entry_ids')] == ['日', '本']
+
+def test_a_shard_per_dictionary(dictionary_ids):
+    assert all(isinstance(i, ShardDatabase) for i in shards())
+    assert [i.path for i in shards()] == [shard_path(i) for i in dictionary_ids]
+
+def test_entry_ids_start_at_the_dictionary_id(dictionary_ids, small_terms):
+    for i in get_headwords(small_terms[0][0]):
+        assert {entry_id >> SHARD_ID_BITS for entry_id in i.entry_ids} == set(dictionary_ids)
+
+def test_headwords_of_both_dictionaries_are_merged(dictionary_ids, small_terms):
+    for expression, reading, *_ in small_terms[:20]:
+        rows = get_definition(expression)
+        keys = [headword_key(i) for i in rows]
+        assert len(keys) == len(set(keys))
+        row = next(i for i in rows if (i.expression, i.reading) == (expression, reading or ''))
+        assert {i['dictionary_id'] for i in row.definitions} == set(dictionary_ids)
+
+def test_headwords_of_one_dictionary(dictionary_ids, terms, small_terms):
+    small = {expression for expression, *_ in small_terms}
+    expression = next(expression for expression, *_ in terms if expression not in small)
+    for row in get_definition(expression):
+        if row.expression == expression:
+            assert {i['dictionary_id'] for i in row.definitions} == {dictionary_ids[0]}
+
+def test_entry_definitions_from_every_shard(dictionary_ids, small_terms):
+    for row in get_headwords(small_terms[0][0]):
+        entry = get_entry_definitions(row.entry_ids)
+        assert (entry.expression, entry.reading) == (row.expression, row.reading)
+        assert sorted(i['entry_id'] for i in entry.definitions) == sorted(row.entry_ids)
+
+def test_batch_lookups_match_single_lookups(dictionary_ids, terms):
+    words = [expression for expression, *_ in terms[::150]] + ['%' + terms[0][0][-1]]
+    for word, rows in zip(words, get_definitions(words, 20)):
+        single = get_definition(word, 20)
+        assert [(headword_key(i), len(i.definitions)) for i in rows] == [(headword_key(i), len(i.definitions)) for i in single]
+
+def test_batch_lookups_leave_the_rows_of_each_shard_alone(dictionary_ids, small_terms):
+    # A headword found by its expression and by its reading is the same row of each shard for both terms, merging
+    # them must not add the other shard's definitions to it twice, or to the cached results
+    bump_generation()
+    expression, reading, *_ = next(i for i in small_terms if i[1] and i[1] != i[0])
+    for rows in get_definitions([expression, reading]) + [get_definition(expression), get_definition(reading)]:
+        row = next(i for i in rows if (i.expression, i.reading) == (expression, reading))
+        entry_ids = [i['entry_id'] for i in row.definitions]
+        assert len(entry_ids) == len(set(entry_ids))
+        assert {i['dictionary_id'] for i in row.definitions} == set(dictionary_ids)